@@ -0,0 +1,126 @@
+"""
+Compare launch time and memory of local browsers in each BROWSER_MODES mode.
+
+Each run launches a browser the way the server does for a task, opens a
+context and loads a page, then records the time that took and the resident
+memory of the browser's process tree (Playwright driver included, as the
+memory watchdog counts it).
+
+Usage:
+    uv run python scripts/benchmark_browser_modes.py --runs 5
+    uv run python scripts/benchmark_browser_modes.py --modes headless,headed --url https://example.com
+
+Headed runs need a display (e.g. the Docker image built with
+BROWSER_MODE=headed, or xvfb-run); modes whose browser is not installed or
+cannot start are reported as skipped.
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "server"))
+
+from browser_use.browser.browser import Browser  # noqa: E402
+
+from server import (  # noqa: E402
+    BROWSER_MODES,
+    create_browser_config,
+    get_browser_driver_pid,
+    get_process_tree_rss_mb,
+)
+
+
+async def measure(mode: str, url: str, settle_seconds: float) -> Dict[str, float]:
+    """Launch one browser in a mode and return its launch time and memory."""
+    started = time.perf_counter()
+    browser = Browser(config=create_browser_config(mode=mode))
+    try:
+        context = await browser.new_context()
+        page = await context.get_current_page()
+        await page.goto(url, wait_until="load")
+        launch_seconds = time.perf_counter() - started
+
+        # Let startup work (and its memory) settle before sampling
+        await asyncio.sleep(settle_seconds)
+        rss_mb = get_process_tree_rss_mb(get_browser_driver_pid(browser))
+        await context.close()
+    finally:
+        await browser.close()
+    return {"launch_seconds": launch_seconds, "rss_mb": rss_mb}
+
+
+async def benchmark(
+    modes: list[str], runs: int, url: str, settle_seconds: float
+) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for mode in modes:
+        samples = []
+        try:
+            # The first launch warms the disk cache and is not counted
+            await measure(mode, url, 0)
+            for _ in range(runs):
+                samples.append(await measure(mode, url, settle_seconds))
+        except Exception as e:
+            results[mode] = {"skipped": str(e).splitlines()[0]}
+            continue
+        results[mode] = {
+            key: {
+                "median": round(statistics.median(s[key] for s in samples), 3),
+                "max": round(max(s[key] for s in samples), 3),
+            }
+            for key in ("launch_seconds", "rss_mb")
+        }
+    return results
+
+
+@click.command()
+@click.option(
+    "--modes",
+    default=",".join(BROWSER_MODES),
+    help="Comma-separated browser modes to compare",
+)
+@click.option("--runs", default=5, help="Measured launches per mode")
+@click.option("--url", default="about:blank", help="Page to load in each browser")
+@click.option(
+    "--settle-seconds",
+    default=1.0,
+    help="Wait after loading the page before sampling memory",
+)
+@click.option("--json", "as_json", is_flag=True, help="Print the results as JSON")
+def main(modes: str, runs: int, url: str, settle_seconds: float, as_json: bool) -> None:
+    """Compare per-browser launch time and RSS between browser modes."""
+    selected = [mode.strip() for mode in modes.split(",") if mode.strip()]
+    for mode in selected:
+        if mode not in BROWSER_MODES:
+            raise click.BadParameter(
+                f"Unknown browser mode: {mode}. Supported modes: {', '.join(BROWSER_MODES)}"
+            )
+
+    results = asyncio.run(benchmark(selected, runs, url, settle_seconds))
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+
+    click.echo(
+        f"{'mode':<15}{'launch median':>15}{'launch max':>12}{'RSS median':>13}{'RSS max':>10}"
+    )
+    for mode, result in results.items():
+        if "skipped" in result:
+            click.echo(f"{mode:<15}skipped: {result['skipped']}")
+            continue
+        launch, rss = result["launch_seconds"], result["rss_mb"]
+        click.echo(
+            f"{mode:<15}{launch['median']:>14.2f}s{launch['max']:>11.2f}s"
+            f"{rss['median']:>10.0f} MB{rss['max']:>7.0f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,21 @@ This package provides the core implementation of the MCP server for browser auto
 
 from .server import (
     CONFIG,
+    ArtifactStore,
+    BrowserPool,
+    JsonFileSpanExporter,
+    LLMClientPool,
+    LLMGovernor,
+    ReplayScriptStore,
     Server,
+    SharedTaskState,
+    SpanExporter,
+    SQLiteTaskStateBackend,
+    StorageStateStore,
+    TaskStateBackend,
+    Tracer,
     cleanup_old_tasks,
+    create_browser_config,
     create_browser_context_for_task,
     create_mcp_server,
     init_configuration,
@@ -26,4 +39,17 @@ __all__ = [
     "init_configuration",
     "CONFIG",
     "task_store",
+    "StorageStateStore",
+    "BrowserPool",
+    "ReplayScriptStore",
+    "TaskStateBackend",
+    "SQLiteTaskStateBackend",
+    "SharedTaskState",
+    "LLMGovernor",
+    "LLMClientPool",
+    "SpanExporter",
+    "JsonFileSpanExporter",
+    "Tracer",
+    "ArtifactStore",
+    "create_browser_config",
 ]
@@ -56,15 +56,41 @@ if '--stdio' in sys.argv:
     )
 
 # Set up SSE transport
+import atexit
+import base64
+import codecs
+import contextlib
+import contextvars
+import cProfile
+import hashlib
+import hmac
+import importlib
+import inspect
+import io
+import itertools
+import logging.handlers
+import marshal
+import mimetypes
+import multiprocessing
+import queue
+import re
+import signal
+import socket
+import sqlite3
 import threading
 import time
 import traceback
 import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import Any, Dict, Optional, Tuple, Union
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlparse
 
 # Third-party imports
 import click
+import httpx
 import mcp.types as types
 import uvicorn
 
@@ -74,15 +100,20 @@ from browser_use.browser.browser import Browser, BrowserConfig
 from browser_use.browser.context import BrowserContext, BrowserContextConfig
 from dotenv import load_dotenv
 from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import HumanMessage
 
 # LLM providers
 from langchain_openai import ChatOpenAI
 
 # MCP server components
 from mcp.server import Server
+from mcp.server.lowlevel.helper_types import ReadResourceContents
 from mcp.server.sse import SseServerTransport
+from playwright.async_api import async_playwright
+from pydantic import AnyUrl
 from pythonjsonlogger import jsonlogger
 from starlette.applications import Starlette
+from starlette.responses import FileResponse, JSONResponse, Response
 from starlette.routing import Mount, Route
 
 # Load environment variables
@@ -176,6 +207,41 @@ def configure_logging_for_stdio():
     sys.stdout = MCPStdoutFilter()
 
 
+class SamplingFilter(logging.Filter):
+    """
+    Let through one in every `every` records of each message, plus all warnings.
+
+    Records are counted per message template, so a sampled logger still shows
+    every kind of message it emits, just less often.
+    """
+
+    def __init__(self, every: int = 1):
+        super().__init__()
+        self.every = max(1, every)
+        self._counts: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every == 1 or record.levelno >= logging.WARNING:
+            return True
+        count = self._counts.get(record.msg, 0)
+        self._counts[record.msg] = count + 1
+        return count % self.every == 0
+
+
+# Log records are queued on the calling thread and formatted and written to
+# stderr by a background thread, so logging never blocks the event loop
+log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+log_handler = logging.handlers.QueueHandler(log_queue)
+handler = logging.StreamHandler(sys.stderr)
+formatter = jsonlogger.JsonFormatter(
+    '{"time":"%(asctime)s","level":"%(levelname)s","name":"%(name)s","message":"%(message)s"}'
+)
+handler.setFormatter(formatter)
+log_listener = logging.handlers.QueueListener(log_queue, handler)
+log_listener.start()
+# Write out whatever is still queued when the process exits
+atexit.register(log_listener.stop)
+
 # Check if we're in stdio mode and configure logging immediately
 if '--stdio' in sys.argv:
     configure_logging_for_stdio()
@@ -183,27 +249,26 @@ else:
     # Configure logging normally for non-stdio mode
     logger = logging.getLogger()
     logger.handlers = []  # Remove any existing handlers
-    handler = logging.StreamHandler(sys.stderr)
-    formatter = jsonlogger.JsonFormatter(
-        '{"time":"%(asctime)s","level":"%(levelname)s","name":"%(name)s","message":"%(message)s"}'
-    )
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    logger.addHandler(log_handler)
     logger.setLevel(logging.INFO)
 
     # Ensure uvicorn also logs to stderr in JSON format
     uvicorn_logger = logging.getLogger("uvicorn")
     uvicorn_logger.handlers = []
-    uvicorn_logger.addHandler(handler)
+    uvicorn_logger.addHandler(log_handler)
 
     # Ensure all other loggers use the same format
-    logging.getLogger("browser_use").addHandler(handler)
-    logging.getLogger("playwright").addHandler(handler)
-    logging.getLogger("mcp").addHandler(handler)
+    logging.getLogger("browser_use").addHandler(log_handler)
+    logging.getLogger("playwright").addHandler(log_handler)
+    logging.getLogger("mcp").addHandler(log_handler)
 
 # Get logger instance for use throughout the module
 logger = logging.getLogger(__name__)
 
+# High-volume per-step messages, sampled with LOG_STEP_SAMPLE_EVERY
+step_logger = logging.getLogger(f"{__name__}.steps")
+step_logger.addFilter(SamplingFilter(int(os.environ.get("LOG_STEP_SAMPLE_EVERY", 1))))
+
 
 def parse_bool_env(env_var: str, default: bool = False) -> bool:
     """
@@ -246,10 +311,98 @@ def init_configuration() -> Dict[str, Any]:
         "DEFAULT_ESTIMATED_TASK_SECONDS": int(
             os.environ.get("ESTIMATED_TASK_SECONDS", 60)
         ),
+        # Task time estimates from completed tasks; ESTIMATED_TASK_SECONDS is
+        # used until ETA_MIN_SAMPLES tasks have completed
+        "ETA_MIN_SAMPLES": int(os.environ.get("ETA_MIN_SAMPLES", 3)),
+        "POLL_MIN_SECONDS": int(os.environ.get("POLL_MIN_SECONDS", 3)),
+        "POLL_MAX_SECONDS": int(os.environ.get("POLL_MAX_SECONDS", 30)),
         "CLEANUP_INTERVAL_SECONDS": int(
             os.environ.get("CLEANUP_INTERVAL_SECONDS", 3600)
         ),  # 1 hour
         "MAX_AGENT_STEPS": int(os.environ.get("MAX_AGENT_STEPS", 10)),
+        # Concurrency limits - tasks beyond the limit wait in "pending"
+        "MAX_CONCURRENT_TASKS": int(os.environ.get("MAX_CONCURRENT_TASKS", 5)),
+        "BATCH_MAX_ITEMS": int(os.environ.get("BATCH_MAX_ITEMS", 200)),
+        "BATCH_MAX_CONCURRENCY": int(os.environ.get("BATCH_MAX_CONCURRENCY", 5)),
+        # Execution mode for agent tasks: "inline" runs them on the server's event
+        # loop, "process" runs them in a pool of worker processes
+        "EXECUTION_MODE": os.environ.get("EXECUTION_MODE", "inline").lower(),
+        "PROCESS_WORKERS": int(os.environ.get("PROCESS_WORKERS", os.cpu_count() or 1)),
+        "TASKS_PER_WORKER": int(os.environ.get("TASKS_PER_WORKER", 2)),
+        "WORKER_PROGRESS_INTERVAL_SECONDS": float(
+            os.environ.get("WORKER_PROGRESS_INTERVAL_SECONDS", 0.5)
+        ),
+        # Memory watchdog - tasks wait while less than MEMORY_MIN_AVAILABLE_MB is
+        # free and are stopped when their browser exceeds TASK_MEMORY_LIMIT_MB
+        # (0 disables either check)
+        "MEMORY_MIN_AVAILABLE_MB": int(os.environ.get("MEMORY_MIN_AVAILABLE_MB", 256)),
+        "MEMORY_ADMISSION": os.environ.get("MEMORY_ADMISSION", "queue").lower(),
+        "TASK_MEMORY_LIMIT_MB": int(os.environ.get("TASK_MEMORY_LIMIT_MB", 2048)),
+        "MEMORY_SAMPLE_SECONDS": float(os.environ.get("MEMORY_SAMPLE_SECONDS", 2.0)),
+        # Event loop monitoring: lag sampling interval (0 disables it) and how
+        # long the loop must be blocked before the blocking call is reported
+        "LOOP_LAG_SAMPLE_SECONDS": float(
+            os.environ.get("LOOP_LAG_SAMPLE_SECONDS", 0.5)
+        ),
+        "LOOP_STALL_SECONDS": float(os.environ.get("LOOP_STALL_SECONDS", 0.5)),
+        # Profiling through /admin/profile, enabled by setting ADMIN_TOKEN.
+        # PROFILE_EVERY_N_TASKS > 0 also profiles every Nth task
+        "ADMIN_TOKEN": os.environ.get("ADMIN_TOKEN") or None,
+        "PROFILE_DIR": os.environ.get("PROFILE_DIR", "profiles"),
+        "PROFILE_SAMPLE_SECONDS": float(
+            os.environ.get("PROFILE_SAMPLE_SECONDS", 0.005)
+        ),
+        "PROFILE_MAX_SECONDS": float(os.environ.get("PROFILE_MAX_SECONDS", 300)),
+        "PROFILE_EVERY_N_TASKS": int(os.environ.get("PROFILE_EVERY_N_TASKS", 0)),
+        # Tracing: TRACE_EXPORTER is "none", "file" (JSON lines in TRACE_FILE)
+        # or "otlp" (OTLP/HTTP JSON to TRACE_OTLP_ENDPOINT)
+        "TRACE_EXPORTER": os.environ.get("TRACE_EXPORTER", "none"),
+        "TRACE_FILE": os.environ.get("TRACE_FILE", "traces.jsonl"),
+        "TRACE_OTLP_ENDPOINT": os.environ.get(
+            "TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces"
+        ),
+        "TRACE_SERVICE_NAME": os.environ.get(
+            "TRACE_SERVICE_NAME", "browser-use-mcp-server"
+        ),
+        # LLM call governor, per provider/model (0 disables a limit)
+        "LLM_REQUESTS_PER_SECOND": float(os.environ.get("LLM_REQUESTS_PER_SECOND", 0)),
+        "LLM_TOKENS_PER_MINUTE": int(os.environ.get("LLM_TOKENS_PER_MINUTE", 0)),
+        "LLM_MAX_CONCURRENCY": int(os.environ.get("LLM_MAX_CONCURRENCY", 8)),
+        "LLM_MAX_RETRIES": int(os.environ.get("LLM_MAX_RETRIES", 3)),
+        # Loop and stall detection for agent runs (0 disables a check).
+        # PROGRESS_ACTION "hint" warns the agent once before stopping it,
+        # "stop" ends the run at the first detection
+        "LOOP_REPEAT_THRESHOLD": int(os.environ.get("LOOP_REPEAT_THRESHOLD", 3)),
+        "STALL_STEPS": int(os.environ.get("STALL_STEPS", 4)),
+        "PROGRESS_ACTION": os.environ.get("PROGRESS_ACTION", "hint").lower(),
+        # Default LLM token budget per task, 0 means no limit
+        "TASK_MAX_TOKENS_BUDGET": int(os.environ.get("TASK_MAX_TOKENS_BUDGET", 0)),
+        # Wall-clock limit for a running task, 0 disables it
+        "TASK_TIMEOUT_SECONDS": int(os.environ.get("TASK_TIMEOUT_SECONDS", 300)),
+        # Scripted actions (browser_script) settings
+        "BROWSER_POOL_SIZE": int(os.environ.get("BROWSER_POOL_SIZE", 2)),
+        # Remote browsers - comma-separated CDP endpoints (http:// or ws://);
+        # when set, all tasks run in these instead of locally launched browsers
+        "BROWSER_CDP_URLS": [
+            url.strip()
+            for url in os.environ.get("BROWSER_CDP_URLS", "").split(",")
+            if url.strip()
+        ],
+        "BROWSER_RECONNECT_SECONDS": float(
+            os.environ.get("BROWSER_RECONNECT_SECONDS", 5)
+        ),
+        "SCRIPT_STEP_TIMEOUT_MS": int(os.environ.get("SCRIPT_STEP_TIMEOUT_MS", 10000)),
+        # Page extraction (browser_extract) settings
+        "EXTRACT_CACHE_TTL_SECONDS": int(
+            os.environ.get("EXTRACT_CACHE_TTL_SECONDS", 300)
+        ),
+        "EXTRACT_CACHE_MAX_ENTRIES": int(
+            os.environ.get("EXTRACT_CACHE_MAX_ENTRIES", 256)
+        ),
+        "EXTRACT_TIMEOUT_MS": int(os.environ.get("EXTRACT_TIMEOUT_MS", 15000)),
+        # Replay of compiled agent runs - off unless enabled
+        "REPLAY_SCRIPTS": parse_bool_env("REPLAY_SCRIPTS", False),
+        "REPLAY_MAX_SCRIPTS": int(os.environ.get("REPLAY_MAX_SCRIPTS", 500)),
         # Browser arguments
         "BROWSER_ARGS": [
             "--no-sandbox",
@@ -258,8 +411,56 @@ def init_configuration() -> Dict[str, Any]:
             "--disable-dev-shm-usage",
             "--remote-debugging-port=0",  # Use random port to avoid conflicts
         ],
+        # How local browsers run (see BROWSER_MODES)
+        "BROWSER_MODE": os.environ.get("BROWSER_MODE", "headless").lower(),
         # Patient mode - if true, functions wait for task completion before returning
         "PATIENT_MODE": parse_bool_env("PATIENT", False),
+        # Server-wide execution profile, overridable per call (see EXECUTION_PROFILES)
+        "EXECUTION_PROFILE": os.environ.get("EXECUTION_PROFILE", "default").lower(),
+        # Storage-state snapshots - disabled unless a directory is configured
+        "STORAGE_STATE_DIR": os.environ.get("STORAGE_STATE_DIR") or None,
+        "STORAGE_STATE_KEY": os.environ.get("STORAGE_STATE_KEY") or None,
+        "STORAGE_STATE_TTL_MINUTES": int(
+            os.environ.get("STORAGE_STATE_TTL_MINUTES", 1440)
+        ),  # 1 day
+        # Shared task state for multi-instance deployments - "memory" keeps
+        # tasks local to this instance
+        "TASK_STATE_BACKEND": os.environ.get("TASK_STATE_BACKEND", "memory").lower(),
+        "TASK_STATE_PATH": os.environ.get("TASK_STATE_PATH", "browser_use_tasks.db"),
+        "TASK_STATE_SYNC_SECONDS": float(
+            os.environ.get("TASK_STATE_SYNC_SECONDS", 1.0)
+        ),
+        "INSTANCE_ID": os.environ.get("INSTANCE_ID")
+        or f"{socket.gethostname()}-{os.getpid()}",
+        # Address other instances use to reach this one, e.g. http://10.0.0.5:8000
+        "INSTANCE_URL": os.environ.get("INSTANCE_URL") or None,
+        "INSTANCE_SECRET": os.environ.get("INSTANCE_SECRET") or None,
+        # /readyz reports not ready at or above these numbers of queued and
+        # running tasks (0 disables a check)
+        "READY_MAX_QUEUED_TASKS": int(os.environ.get("READY_MAX_QUEUED_TASKS", 10)),
+        "READY_MAX_RUNNING_TASKS": int(os.environ.get("READY_MAX_RUNNING_TASKS", 0)),
+        # Large result fields are kept on disk in ARTIFACT_DIR, capped at
+        # ARTIFACT_MAX_MB, and read in chunks of ARTIFACT_CHUNK_BYTES
+        "ARTIFACT_DIR": os.environ.get("ARTIFACT_DIR", "artifacts"),
+        "ARTIFACT_MAX_MB": int(os.environ.get("ARTIFACT_MAX_MB", 1024)),
+        "ARTIFACT_INLINE_BYTES": int(os.environ.get("ARTIFACT_INLINE_BYTES", 16384)),
+        "ARTIFACT_CHUNK_BYTES": int(
+            os.environ.get("ARTIFACT_CHUNK_BYTES", 1024 * 1024)
+        ),
+        # Screenshots of tasks that ask for them; resizing to the maximum width
+        # and height (0 means no limit) and WebP need Pillow
+        "SCREENSHOT_FORMAT": os.environ.get("SCREENSHOT_FORMAT", "jpeg").lower(),
+        "SCREENSHOT_QUALITY": int(os.environ.get("SCREENSHOT_QUALITY", 80)),
+        "SCREENSHOT_MAX_WIDTH": int(os.environ.get("SCREENSHOT_MAX_WIDTH", 0)),
+        "SCREENSHOT_MAX_HEIGHT": int(os.environ.get("SCREENSHOT_MAX_HEIGHT", 0)),
+        "SCREENSHOT_FULL_PAGE": parse_bool_env("SCREENSHOT_FULL_PAGE", False),
+        # Screenshots up to this size are returned as images with the result;
+        # larger ones only as artifact references
+        "SCREENSHOT_INLINE_MAX_BYTES": int(
+            os.environ.get("SCREENSHOT_INLINE_MAX_BYTES", 512 * 1024)
+        ),
+        # On SIGTERM/SIGINT, time given to running tasks before they are cancelled
+        "DRAIN_GRACE_SECONDS": float(os.environ.get("DRAIN_GRACE_SECONDS", 60)),
     }
 
     return config
@@ -346,399 +547,5126 @@ def create_llm(
         raise ValueError(f"Unsupported LLM provider: {provider}. Supported providers: openai, anthropic, ollama")
 
 
+# Named execution profiles trading accuracy for latency and tokens.
+# "default" matches the behaviour the server has always had.
+EXECUTION_PROFILES: Dict[str, Dict[str, Any]] = {
+    "fast": {
+        # No overlay injection, no screenshots/image tokens, lean DOM state
+        "highlight_elements": False,
+        "use_vision": False,
+        "viewport_expansion": 0,
+        "include_attributes": ["type", "name", "role", "aria-label", "placeholder"],
+    },
+    "default": {
+        "highlight_elements": True,
+        "use_vision": True,
+        "viewport_expansion": 0,
+        "include_attributes": None,  # browser_use defaults
+    },
+    "accurate": {
+        # Include elements just outside the viewport so fewer scrolls are needed
+        "highlight_elements": True,
+        "use_vision": True,
+        "viewport_expansion": 500,
+        "include_attributes": None,  # browser_use defaults
+    },
+}
+
+
+class MetricsRegistry:
+    """
+    Minimal in-process metrics registry served by the /metrics endpoint.
+
+    Metrics are identified by a name plus optional labels. Counters only go up,
+    gauges hold the last value set and summaries keep count/sum/max of observed
+    values.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._summaries: Dict[str, Dict[str, float]] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> str:
+        if not labels:
+            return name
+        rendered = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+        return f"{name}{{{rendered}}}"
+
+    def incr(self, name: str, value: float = 1, **labels: Any) -> None:
+        """Increment a counter."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: Any) -> None:
+        """Set a gauge to the given value."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """Record an observation in a summary."""
+        key = self._key(name, labels)
+        with self._lock:
+            summary = self._summaries.setdefault(
+                key, {"count": 0, "sum": 0.0, "max": 0.0}
+            )
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a JSON-serializable copy of all metrics."""
+        with self._lock:
+            summaries = {
+                key: {
+                    **summary,
+                    "avg": summary["sum"] / summary["count"]
+                    if summary["count"]
+                    else 0.0,
+                }
+                for key, summary in self._summaries.items()
+            }
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "summaries": summaries,
+            }
+
+
 # Initialize configuration
 CONFIG = init_configuration()
 
 # Task storage for async operations
 task_store: Dict[str, Dict[str, Any]] = {}
 
+# Batch storage for browser_use_batch; items live in task_store
+batch_store: Dict[str, Dict[str, Any]] = {}
 
-async def create_browser_context_for_task(
-    chrome_path: Optional[str] = None,
-    window_width: int = CONFIG["DEFAULT_WINDOW_WIDTH"],
-    window_height: int = CONFIG["DEFAULT_WINDOW_HEIGHT"],
-    locale: str = CONFIG["DEFAULT_LOCALE"],
-) -> Tuple[Browser, BrowserContext]:
-    """
-    Create a fresh browser and context for a task.
-
-    This function creates an isolated browser instance and context
-    with proper configuration for a single task.
-
-    Args:
-        chrome_path: Path to Chrome executable
-        window_width: Browser window width
-        window_height: Browser window height
-        locale: Browser locale
+# Handles of background tasks that are pending or running, for cancellation
+task_handles: Dict[str, asyncio.Task] = {}
 
-    Returns:
-        A tuple containing the browser instance and browser context
+# Agents of running tasks, so cancellation can also stop them between steps
+task_agents: Dict[str, Agent] = {}
 
-    Raises:
-        Exception: If browser or context creation fails
-    """
-    try:
-        # Create browser configuration
-        browser_config = BrowserConfig(
-            extra_chromium_args=CONFIG["BROWSER_ARGS"],
-        )
+# Statuses of tasks that will not change any more
+FINISHED_STATUSES = ("completed", "failed", "cancelled", "timed_out")
 
-        # Set chrome path if provided
-        if chrome_path:
-            browser_config.chrome_instance_path = chrome_path
+# Server metrics
+metrics = MetricsRegistry()
 
-        # Create browser instance
-        browser = Browser(config=browser_config)
 
-        # Create context configuration
-        context_config = BrowserContextConfig(
-            wait_for_network_idle_page_load_time=0.6,
-            maximum_wait_page_load_time=1.2,
-            minimum_wait_page_load_time=0.2,
-            browser_window_size={"width": window_width, "height": window_height},
-            locale=locale,
-            user_agent=CONFIG["DEFAULT_USER_AGENT"],
-            highlight_elements=True,
-            viewport_expansion=0,
-        )
+# ID of the browser task the current coroutine works for, used to queue LLM
+# calls fairly across tasks
+current_task_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "current_task_id", default=None
+)
 
-        # Create context with the browser
-        context = BrowserContext(browser=browser, config=context_config)
 
-        return browser, context
-    except Exception as e:
-        logger.error(f"Error creating browser context: {str(e)}")
-        raise
+class Span:
+    """One timed operation in a trace, with attributes for latency breakdowns."""
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str],
+        attributes: Dict[str, Any],
+        start_ns: Optional[int] = None,
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
 
 
-async def run_browser_task_async(
-    task_id: str,
-    url: str,
-    action: str,
-    llm: BaseLanguageModel,
-    window_width: int = CONFIG["DEFAULT_WINDOW_WIDTH"],
-    window_height: int = CONFIG["DEFAULT_WINDOW_HEIGHT"],
-    locale: str = CONFIG["DEFAULT_LOCALE"],
-) -> None:
+class SpanExporter(ABC):
     """
-    Run a browser task asynchronously and store the result.
+    Destination for finished spans; subclasses implement export().
 
-    This function executes a browser automation task with the given URL and action,
-    and updates the task store with progress and results.
+    Exporters are called from the tracer's background thread with batches of
+    span dicts (see Span.to_dict), so they may block.
+    """
 
-    When PATIENT_MODE is enabled, the calling function will wait for this function
-    to complete before returning to the client.
+    @abstractmethod
+    def export(self, spans: list[Dict[str, Any]]) -> None:
+        """Send a batch of finished spans."""
 
-    Args:
-        task_id: Unique identifier for the task
-        url: URL to navigate to
-        action: Action to perform after navigation
-        llm: Language model to use for browser agent
-        window_width: Browser window width
-        window_height: Browser window height
-        locale: Browser locale
-    """
-    browser = None
-    context = None
+    def shutdown(self) -> None:
+        """Release any resources held by the exporter."""
 
-    try:
-        # Update task status to running
-        task_store[task_id]["status"] = "running"
-        task_store[task_id]["start_time"] = datetime.now().isoformat()
-        task_store[task_id]["progress"] = {
-            "current_step": 0,
-            "total_steps": 0,
-            "steps": [],
-        }
 
-        # Define step callback function with the correct signature
-        async def step_callback(
-            browser_state: Any, agent_output: Any, step_number: int
-        ) -> None:
-            # Update progress in task store
-            task_store[task_id]["progress"]["current_step"] = step_number
-            task_store[task_id]["progress"]["total_steps"] = max(
-                task_store[task_id]["progress"]["total_steps"], step_number
-            )
+class JsonFileSpanExporter(SpanExporter):
+    """Appends spans to a file as JSON lines, for offline analysis."""
 
-            # Add step info with minimal details
-            step_info = {"step": step_number, "time": datetime.now().isoformat()}
+    def __init__(self, path: str):
+        self.path = path
 
-            # Add goal if available
-            if agent_output and hasattr(agent_output, "current_state"):
-                if hasattr(agent_output.current_state, "next_goal"):
-                    step_info["goal"] = agent_output.current_state.next_goal
+    def export(self, spans: list[Dict[str, Any]]) -> None:
+        with open(self.path, "a") as f:
+            for span in spans:
+                f.write(json.dumps(span, default=str) + "\n")
 
-            # Add to progress steps
-            task_store[task_id]["progress"]["steps"].append(step_info)
 
-            # Log progress
-            logger.info(f"Task {task_id}: Step {step_number} completed")
+class OTLPHttpSpanExporter(SpanExporter):
+    """
+    Sends spans to an OpenTelemetry collector over OTLP/HTTP with JSON encoding.
+    """
 
-        # Define done callback function with the correct signature
-        async def done_callback(history: Any) -> None:
-            # Log completion
-            logger.info(f"Task {task_id}: Completed with {len(history.history)} steps")
+    def __init__(self, endpoint: str, service_name: str):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self._client = httpx.Client(timeout=10)
+
+    @staticmethod
+    def _value(value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def _span(self, span: Dict[str, Any]) -> Dict[str, Any]:
+        encoded = {
+            "traceId": span["trace_id"],
+            "spanId": span["span_id"],
+            "name": span["name"],
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(span["start_ns"]),
+            "endTimeUnixNano": str(span["end_ns"]),
+            "attributes": [
+                {"key": key, "value": self._value(value)}
+                for key, value in span["attributes"].items()
+                if value is not None
+            ],
+            # STATUS_CODE_OK / STATUS_CODE_ERROR
+            "status": {"code": 2, "message": span["error"]}
+            if span["error"]
+            else {"code": 1},
+        }
+        if span["parent_id"]:
+            encoded["parentSpanId"] = span["parent_id"]
+        return encoded
 
-            # Add final step
-            current_step = task_store[task_id]["progress"]["current_step"] + 1
-            task_store[task_id]["progress"]["steps"].append(
+    def export(self, spans: list[Dict[str, Any]]) -> None:
+        payload = {
+            "resourceSpans": [
                 {
-                    "step": current_step,
-                    "time": datetime.now().isoformat(),
-                    "status": "completed",
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": self.service_name},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "browser_use_mcp_server"},
+                            "spans": [self._span(span) for span in spans],
+                        }
+                    ],
                 }
-            )
+            ]
+        }
+        try:
+            self._client.post(self.endpoint, json=payload).raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning("Could not export %d spans: %s", len(spans), e)
 
-        # Get Chrome path from environment if available
-        chrome_path = os.environ.get("CHROME_PATH")
+    def shutdown(self) -> None:
+        self._client.close()
 
-        # Create a fresh browser and context for this task
-        browser, context = await create_browser_context_for_task(
-            chrome_path=chrome_path,
-            window_width=window_width,
-            window_height=window_height,
-            locale=locale,
-        )
 
-        # Create agent with the fresh context
-        agent = Agent(
-            task=f"First, navigate to {url}. Then, {action}",
-            llm=llm,
-            browser_context=context,
-            register_new_step_callback=step_callback,
-            register_done_callback=done_callback,
-        )
+def create_span_exporter() -> Optional[SpanExporter]:
+    """
+    Create the span exporter selected by TRACE_EXPORTER, if any.
 
-        # Run the agent with a reasonable step limit
-        agent_result = await agent.run(max_steps=CONFIG["MAX_AGENT_STEPS"])
+    Besides the built-in exporters, TRACE_EXPORTER may name a SpanExporter
+    subclass as "package.module:ClassName"; it is created without arguments.
+    """
+    exporter = CONFIG["TRACE_EXPORTER"]
+    if ":" in exporter:
+        module_name, class_name = exporter.split(":", 1)
+        return getattr(importlib.import_module(module_name), class_name)()
+    if exporter == "none":
+        return None
+    if exporter == "file":
+        return JsonFileSpanExporter(CONFIG["TRACE_FILE"])
+    if exporter == "otlp":
+        return OTLPHttpSpanExporter(
+            CONFIG["TRACE_OTLP_ENDPOINT"], CONFIG["TRACE_SERVICE_NAME"]
+        )
+    raise ValueError(
+        f"Unsupported trace exporter: {exporter}. Supported exporters: none, file, otlp"
+    )
 
-        # Get the final result
-        final_result = agent_result.final_result()
 
-        # Check if we have a valid result
-        if final_result and hasattr(final_result, "raise_for_status"):
-            final_result.raise_for_status()
-            result_text = str(final_result.text)
-        else:
-            result_text = (
-                str(final_result) if final_result else "No final result available"
-            )
+# Span the current coroutine runs in; child tasks inherit it
+current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "current_span", default=None
+)
 
-        # Gather essential information from the agent history
-        is_successful = agent_result.is_successful()
-        has_errors = agent_result.has_errors()
-        errors = agent_result.errors()
-        urls_visited = agent_result.urls()
-        action_names = agent_result.action_names()
-        extracted_content = agent_result.extracted_content()
-        steps_taken = agent_result.number_of_steps()
-
-        # Create a focused response with the most relevant information
-        response_data = {
-            "final_result": result_text,
-            "success": is_successful,
-            "has_errors": has_errors,
-            "errors": [str(err) for err in errors if err],
-            "urls_visited": [str(url) for url in urls_visited if url],
-            "actions_performed": action_names,
-            "extracted_content": extracted_content,
-            "steps_taken": steps_taken,
-        }
 
-        # Store the result
-        task_store[task_id]["status"] = "completed"
-        task_store[task_id]["end_time"] = datetime.now().isoformat()
-        task_store[task_id]["result"] = response_data
+class Tracer:
+    """
+    Records spans and hands them to an exporter from a background thread.
 
-    except Exception as e:
-        logger.error(f"Error in async browser task: {str(e)}")
-        tb = traceback.format_exc()
+    The active span is tracked in a context variable, so spans opened in a
+    task started from a tool call become children of the tool call's span.
+    Traces continue a W3C traceparent passed in by the client. Without an
+    exporter, spans are still created (so attributes can be set) but dropped.
+    """
 
-        # Store the error
-        task_store[task_id]["status"] = "failed"
-        task_store[task_id]["end_time"] = datetime.now().isoformat()
-        task_store[task_id]["error"] = str(e)
-        task_store[task_id]["traceback"] = tb
+    def __init__(self, exporter: Optional[SpanExporter], flush_seconds: float = 1.0):
+        self.exporter = exporter
+        self.flush_seconds = flush_seconds
+        self._queue: "queue.SimpleQueue[Dict[str, Any]]" = queue.SimpleQueue()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if exporter:
+            self._thread = threading.Thread(
+                target=self._run, name="span-exporter", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    @staticmethod
+    def parse_traceparent(traceparent: Optional[str]) -> Optional[Span]:
+        """Turn a W3C traceparent header into a stand-in for the remote parent."""
+        match = re.fullmatch(
+            r"[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}",
+            (traceparent or "").strip().lower(),
+        )
+        if not match:
+            return None
+        parent = Span("remote", match.group(1), None, {})
+        parent.span_id = match.group(2)
+        return parent
+
+    def traceparent(self) -> Optional[str]:
+        """W3C traceparent of the current span, to continue the trace elsewhere."""
+        span = current_span.get()
+        return f"00-{span.trace_id}-{span.span_id}-01" if span else None
+
+    def _new_span(
+        self,
+        name: str,
+        parent: Optional[Span],
+        attributes: Dict[str, Any],
+        **kwargs: Any,
+    ) -> Span:
+        parent = parent or current_span.get()
+        if parent:
+            return Span(name, parent.trace_id, parent.span_id, attributes, **kwargs)
+        return Span(name, os.urandom(16).hex(), None, attributes, **kwargs)
+
+    @contextlib.contextmanager
+    def span(self, name: str, parent: Optional[Span] = None, **attributes: Any):
+        """
+        Time the enclosed block as a span, a child of the current span.
 
-    finally:
-        # Clean up browser resources
+        Args:
+            name: Operation name, e.g. "browser.context"
+            parent: Explicit parent, e.g. from parse_traceparent
+            **attributes: Attributes to attach to the span
+        """
+        span = self._new_span(name, parent, attributes)
+        token = current_span.set(span)
         try:
-            if context:
-                await context.close()
-            if browser:
-                await browser.close()
-            logger.info(f"Browser resources for task {task_id} cleaned up")
-        except Exception as e:
-            logger.error(
-                f"Error cleaning up browser resources for task {task_id}: {str(e)}"
-            )
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            current_span.reset(token)
+            self._finish(span)
+
+    def record(self, name: str, start_ns: int, end_ns: int, **attributes: Any) -> None:
+        """Record a span that has already happened, as a child of the current span."""
+        span = self._new_span(name, None, attributes, start_ns=start_ns)
+        span.end_ns = end_ns
+        self._finish(span)
+
+    def annotate(self, **attributes: Any) -> None:
+        """Set attributes on the current span, if there is one."""
+        span = current_span.get()
+        if span:
+            span.attributes.update(attributes)
+
+    def _finish(self, span: Span) -> None:
+        if span.end_ns is None:
+            span.end_ns = time.time_ns()
+        if self.exporter:
+            self._queue.put(span.to_dict())
+
+    def _drain(self) -> None:
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get())
+        if batch:
+            try:
+                self.exporter.export(batch)
+            except Exception as e:
+                logger.error("Error exporting spans: %s", e)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.flush_seconds):
+            self._drain()
+
+    def shutdown(self) -> None:
+        """Export the remaining spans and stop the background thread."""
+        if not self._thread or self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._drain()
+        self.exporter.shutdown()
+
+
+tracer = Tracer(create_span_exporter())
+
+
+def record_llm_usage(
+    model: str, input_tokens: int, output_tokens: int, seconds: float
+) -> None:
+    """
+    Account an LLM call to the metrics and to the task it was made for.
 
+    The task's running totals are kept in its "usage" entry. When they reach
+    the task's max_tokens_budget the agent is asked to stop; it finishes the
+    current step and the task completes with the results gathered so far.
 
-async def cleanup_old_tasks() -> None:
+    Args:
+        model: provider/model of the call
+        input_tokens: Prompt tokens reported by the provider
+        output_tokens: Completion tokens reported by the provider
+        seconds: Time spent in the call
     """
-    Periodically clean up old completed tasks to prevent memory leaks.
+    metrics.incr("llm_prompt_tokens", input_tokens, model=model)
+    metrics.incr("llm_completion_tokens", output_tokens, model=model)
+    metrics.observe("llm_call_seconds", seconds, model=model)
+
+    task_id = current_task_id.get()
+    task_data = task_store.get(task_id) if task_id else None
+    if task_data is None:
+        return
+
+    usage = task_data.setdefault(
+        "usage",
+        {
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+            "llm_calls": 0,
+            "llm_seconds": 0.0,
+        },
+    )
+    usage["prompt_tokens"] += input_tokens
+    usage["completion_tokens"] += output_tokens
+    usage["total_tokens"] += input_tokens + output_tokens
+    usage["llm_calls"] += 1
+    usage["llm_seconds"] = round(usage["llm_seconds"] + seconds, 3)
+
+    budget = task_data.get("max_tokens_budget")
+    if (
+        budget
+        and usage["total_tokens"] >= budget
+        and not task_data.get("budget_exhausted")
+    ):
+        logger.warning(
+            "Task %s: Token budget of %s used up, stopping the agent", task_id, budget
+        )
+        metrics.incr("tasks_budget_exhausted")
+        task_data["budget_exhausted"] = True
+        agent = task_agents.get(task_id)
+        if agent is not None:
+            agent.stop()
 
-    This function runs continuously in the background, removing tasks that have been
-    completed or failed for more than 1 hour to conserve memory.
-    """
-    while True:
-        try:
-            # Sleep first to avoid cleaning up tasks too early
-            await asyncio.sleep(CONFIG["CLEANUP_INTERVAL_SECONDS"])
 
-            current_time = datetime.now()
-            tasks_to_remove = []
+def estimate_message_tokens(messages: list[Any]) -> int:
+    """
+    Roughly estimate the prompt tokens of a list of chat messages.
 
-            # Find completed tasks older than 1 hour
-            for task_id, task_data in task_store.items():
-                if (
-                    task_data["status"] in ["completed", "failed"]
-                    and "end_time" in task_data
-                ):
-                    end_time = datetime.fromisoformat(task_data["end_time"])
-                    hours_elapsed = (current_time - end_time).total_seconds() / 3600
+    Text counts as four characters per token and each image as a fixed
+    amount, which is close enough for rate limiting ahead of the call.
+    """
+    chars = 0
+    images = 0
+    for message in messages:
+        content = getattr(message, "content", message)
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content:
+            if isinstance(part, dict) and part.get("type") == "image_url":
+                images += 1
+            elif isinstance(part, dict):
+                chars += len(str(part.get("text", "")))
+            else:
+                chars += len(str(part))
+    return chars // 4 + images * 1000
 
-                    if hours_elapsed > 1:  # Remove tasks older than 1 hour
-                        tasks_to_remove.append(task_id)
 
-            # Remove old tasks
-            for task_id in tasks_to_remove:
-                del task_store[task_id]
+def get_rate_limit_delay(error: Exception) -> Optional[float]:
+    """
+    Tell whether an LLM error is a rate limit (HTTP 429) and how long to wait.
 
-            if tasks_to_remove:
-                logger.info(f"Cleaned up {len(tasks_to_remove)} old tasks")
+    Returns:
+        Seconds from the Retry-After header, 0.0 for a rate limit without one,
+        or None if the error is not a rate limit
+    """
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(
+        response, "status_code", None
+    )
+    if status != 429 and type(error).__name__ != "RateLimitError":
+        return None
 
-        except Exception as e:
-            logger.error(f"Error in task cleanup: {str(e)}")
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        return float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0  # An HTTP date; fall back to exponential backoff
 
 
-def create_mcp_server(
-    llm: BaseLanguageModel,
-    task_expiry_minutes: int = CONFIG["DEFAULT_TASK_EXPIRY_MINUTES"],
-    window_width: int = CONFIG["DEFAULT_WINDOW_WIDTH"],
-    window_height: int = CONFIG["DEFAULT_WINDOW_HEIGHT"],
-    locale: str = CONFIG["DEFAULT_LOCALE"],
-) -> Server:
+class LLMGovernor:
     """
-    Create and configure an MCP server for browser interaction.
-
-    Args:
-        llm: The language model to use for browser agent
-        task_expiry_minutes: Minutes after which tasks are considered expired
-        window_width: Browser window width
-        window_height: Browser window height
-        locale: Browser locale
+    Limits the calls made to one provider/model across all tasks.
 
-    Returns:
-        Configured MCP server instance
+    Calls wait for a permit that respects requests per second, tokens per
+    minute and concurrent calls (0 disables a limit). Waiting calls are
+    served round-robin by task, so one busy task cannot starve the others.
+    A rate-limit response pauses every call to the model for its Retry-After
+    (or an exponential backoff) before the call is retried.
     """
-    # Create MCP server instance
-    app = Server("browser_use")
 
-    @app.call_tool()
-    async def call_tool(
-        name: str, arguments: dict
-    ) -> list[Union[types.TextContent, types.ImageContent, types.EmbeddedResource]]:
+    def __init__(
+        self,
+        name: str,
+        requests_per_second: float = CONFIG["LLM_REQUESTS_PER_SECOND"],
+        tokens_per_minute: int = CONFIG["LLM_TOKENS_PER_MINUTE"],
+        max_concurrency: int = CONFIG["LLM_MAX_CONCURRENCY"],
+        max_retries: int = CONFIG["LLM_MAX_RETRIES"],
+    ):
         """
-        Handle tool calls from the MCP client.
+        Create a governor.
 
         Args:
-            name: The name of the tool to call
-            arguments: The arguments to pass to the tool
+            name: provider/model the governor is for, used in metrics
+            requests_per_second: Maximum call rate
+            tokens_per_minute: Maximum (estimated, then actual) tokens per minute
+            max_concurrency: Maximum calls in flight
+            max_retries: Retries of a call that was rate limited
+        """
+        self.name = name
+        self.requests_per_second = requests_per_second
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._queues: "OrderedDict[Optional[str], deque]" = OrderedDict()
+        self._in_flight = 0
+        self._next_request_at = 0.0
+        self._paused_until = 0.0
+        self._tokens: deque = deque()  # (monotonic time, tokens) in the last minute
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _tokens_used(self, now: float) -> int:
+        while self._tokens and self._tokens[0][0] <= now - 60:
+            self._tokens.popleft()
+        return sum(tokens for _, tokens in self._tokens)
+
+    def _dispatch(self) -> None:
+        """Hand out permits to queued calls while the limits allow it."""
+        self._timer = None
+        loop = asyncio.get_running_loop()
+        while self._queues:
+            if self.max_concurrency and self._in_flight >= self.max_concurrency:
+                return  # release() dispatches again
+
+            task_id, queue = next(iter(self._queues.items()))
+            while queue and queue[0][0].done():
+                queue.popleft()  # Waiter was cancelled
+            if not queue:
+                del self._queues[task_id]
+                continue
+            future, tokens = queue[0]
+
+            now = time.monotonic()
+            wait = max(self._paused_until, self._next_request_at) - now
+            if self.tokens_per_minute and self._tokens:
+                used = self._tokens_used(now)
+                if used + tokens > self.tokens_per_minute:
+                    # Wait until enough of the window has expired (a single
+                    # oversized call is let through on an empty window)
+                    excess = used + tokens - self.tokens_per_minute
+                    for at, spent in self._tokens:
+                        excess -= spent
+                        if excess <= 0:
+                            wait = max(wait, at + 60 - now)
+                            break
+            if wait > 0:
+                self._timer = loop.call_later(wait, self._dispatch)
+                return
+
+            # Round-robin: the task goes to the back of the line
+            queue.popleft()
+            if queue:
+                self._queues.move_to_end(task_id)
+            else:
+                del self._queues[task_id]
+
+            self._in_flight += 1
+            if self.requests_per_second:
+                self._next_request_at = now + 1 / self.requests_per_second
+            if tokens:
+                self._tokens.append((now, tokens))
+            future.set_result(None)
+
+    def _schedule(self) -> None:
+        if self._timer is None:
+            self._dispatch()
+
+    async def acquire(self, tokens: int) -> None:
+        """Wait for permission to make a call of about `tokens` tokens."""
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(current_task_id.get(), deque()).append((future, tokens))
+        started = time.monotonic()
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # Granted just as we were cancelled
+            raise
+        metrics.observe("llm_wait_seconds", time.monotonic() - started, model=self.name)
+
+    def release(self, estimated_tokens: int = 0, actual_tokens: int = 0) -> None:
+        """Return a permit, correcting the token estimate with actual usage."""
+        self._in_flight -= 1
+        if actual_tokens and actual_tokens != estimated_tokens:
+            self._tokens.append((time.monotonic(), actual_tokens - estimated_tokens))
+        self._schedule()
+
+    def backoff(self, seconds: float) -> None:
+        """Pause all calls to the model for the given time."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    async def call(
+        self,
+        generate: Callable[..., Awaitable[Any]],
+        messages: list[Any],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        """Run a model call under the limits, retrying it when rate limited."""
+        estimated_tokens = estimate_message_tokens(messages)
+        with tracer.span(
+            "llm.call",
+            task_id=current_task_id.get(),
+            model=self.name,
+            estimated_tokens=estimated_tokens,
+        ) as span:
+            for attempt in range(self.max_retries + 1):
+                waited = time.monotonic()
+                await self.acquire(estimated_tokens)
+                actual_tokens = 0
+                started = time.monotonic()
+                span.set_attribute("attempts", attempt + 1)
+                span.set_attribute(
+                    "wait_seconds",
+                    round(span.attributes.get("wait_seconds", 0) + started - waited, 3),
+                )
+                try:
+                    result = await generate(messages, *args, **kwargs)
+                    usage = getattr(
+                        result.generations[0].message, "usage_metadata", None
+                    )
+                    if usage:
+                        actual_tokens = usage.get("total_tokens", 0)
+                    record_llm_usage(
+                        self.name,
+                        usage.get("input_tokens", 0) if usage else 0,
+                        usage.get("output_tokens", 0) if usage else 0,
+                        time.monotonic() - started,
+                    )
+                    span.set_attribute(
+                        "input_tokens", usage.get("input_tokens", 0) if usage else 0
+                    )
+                    span.set_attribute(
+                        "output_tokens", usage.get("output_tokens", 0) if usage else 0
+                    )
+                    return result
+                except Exception as e:
+                    delay = get_rate_limit_delay(e)
+                    if delay is None or attempt == self.max_retries:
+                        raise
+                    delay = delay or min(60, 2 ** (attempt + 1))
+                    logger.warning(
+                        "LLM %s rate limited, pausing calls for %gs", self.name, delay
+                    )
+                    metrics.incr("llm_rate_limited", model=self.name)
+                    self.backoff(delay)
+                finally:
+                    self.release(estimated_tokens, actual_tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the governor's current load."""
+        return {
+            "in_flight": self._in_flight,
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "tokens_last_minute": self._tokens_used(time.monotonic()),
+            "paused_for_seconds": round(
+                max(0.0, self._paused_until - time.monotonic()), 1
+            ),
+        }
 
-        Returns:
-            A list of content objects to return to the client.
-            When PATIENT_MODE is enabled, the browser_use tool will wait for the task to complete
-            and return the full result immediately instead of just the task ID.
+
+# One governor per provider/model, shared by every client of that model
+llm_governors: Dict[str, LLMGovernor] = {}
+
+
+def govern_llm(
+    llm: BaseLanguageModel, provider: str, processes: int = 1
+) -> BaseLanguageModel:
+    """
+    Route a model's async calls through the governor for its provider/model.
+
+    The model is patched in place rather than wrapped, because browser_use
+    picks its tool-calling method from the model's class.
+
+    Args:
+        llm: Model created by create_llm
+        provider: Provider the model belongs to
+        processes: Number of processes calling the model; each one's governor
+            gets an equal share of the configured limits
+
+    Returns:
+        The same model
+    """
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or "default"
+    name = f"{provider.lower()}/{model}"
+    governor = llm_governors.get(name)
+    if governor is None:
+        processes = max(1, processes)
+        tokens_per_minute = CONFIG["LLM_TOKENS_PER_MINUTE"]
+        max_concurrency = CONFIG["LLM_MAX_CONCURRENCY"]
+        # 0 disables a limit, so a share is never rounded down to 0
+        governor = llm_governors[name] = LLMGovernor(
+            name,
+            requests_per_second=CONFIG["LLM_REQUESTS_PER_SECOND"] / processes,
+            tokens_per_minute=tokens_per_minute
+            and max(1, tokens_per_minute // processes),
+            max_concurrency=max_concurrency and max(1, max_concurrency // processes),
+        )
+
+    generate = llm._agenerate
+
+    async def _agenerate(messages: list[Any], *args: Any, **kwargs: Any) -> Any:
+        return await governor.call(generate, messages, *args, **kwargs)
+
+    object.__setattr__(llm, "_agenerate", _agenerate)
+    return llm
+
+
+class LLMClientPool:
+    """
+    Long-lived LLM clients keyed by provider, model and temperature.
+
+    Clients are created with create_llm on first use, routed through the
+    governor for their provider/model and then reused by every task asking
+    for the same combination, so their HTTP connection pools (and TLS
+    sessions) outlive individual tasks. Models are named "model" (on the
+    server's provider) or "provider/model".
+    """
+
+    def __init__(
+        self,
+        provider: str = "openai",
+        model: Optional[str] = None,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        temperature: float = 0.0,
+        processes: int = 1,
+    ):
+        """
+        Create a pool whose defaults are the server's LLM settings.
+
+        Args:
+            provider: Default LLM provider
+            model: Default model name
+            api_key: API key for the default provider
+            base_url: Base URL for the default provider
+            temperature: Default temperature
+            processes: Number of processes with a pool of their own, which
+                split the LLM rate limits between them (see govern_llm)
+        """
+        self.provider = provider.lower()
+        self.model = model
+        self.api_key = api_key
+        self.base_url = base_url
+        self.temperature = temperature
+        self.processes = processes
+        self._clients: Dict[Tuple[str, Optional[str], float], BaseLanguageModel] = {}
+
+    def _parse(self, model: Optional[str]) -> Tuple[str, Optional[str]]:
+        if not model:
+            return self.provider, self.model
+        provider, _, name = model.partition("/")
+        if name and provider.lower() in ("openai", "anthropic", "ollama"):
+            return provider.lower(), name
+        return self.provider, model
+
+    def get(
+        self, model: Optional[str] = None, temperature: Optional[float] = None
+    ) -> BaseLanguageModel:
+        """
+        Return the pooled client for a model, creating it on first use.
+
+        Args:
+            model: "model" or "provider/model"; the server's model if omitted
+            temperature: Sampling temperature; the server's if omitted
+
+        Raises:
+            ValueError: If the provider is not supported or not configured
+            ImportError: If the provider's package is not installed
+        """
+        provider, name = self._parse(model)
+        temperature = self.temperature if temperature is None else float(temperature)
+        key = (provider, name, temperature)
+        client = self._clients.get(key)
+        if client is None:
+            # The key and URL given on the command line belong to the server's
+            # provider; other providers use their environment variables
+            own_provider = provider == self.provider
+            client = create_llm(
+                provider=provider,
+                model=name,
+                api_key=self.api_key if own_provider else None,
+                base_url=self.base_url if own_provider else None,
+                temperature=temperature,
+            )
+            client = self._clients[key] = govern_llm(client, provider, self.processes)
+            logger.info(
+                "Created LLM client %s/%s (temperature %g)",
+                provider,
+                name or "default",
+                temperature,
+            )
+        return client
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the pooled clients."""
+        return {
+            "clients": [
+                f"{provider}/{name or 'default'}@{temperature:g}"
+                for provider, name, temperature in self._clients
+            ]
+        }
+
+
+def get_task_domain(url: str) -> Optional[str]:
+    """
+    Extract the host a task targets from its URL.
+
+    Args:
+        url: Task URL, with or without a scheme
+
+    Returns:
+        Lowercased host name, or None if the URL has no host
+    """
+    if "://" not in url:
+        url = f"http://{url}"
+    host = urlparse(url).hostname
+    return host.lower() if host else None
+
+
+class StorageStateStore:
+    """
+    Encrypted on-disk cache of Playwright storage-state snapshots.
+
+    Snapshots (cookies + localStorage) are keyed by domain and credential label
+    so that tasks against a known domain can skip re-authentication. Each
+    snapshot is encrypted with Fernet, whose timestamped tokens also give us
+    expiry for free.
+    """
+
+    def __init__(self, directory: str, key: str, ttl_minutes: int):
+        """
+        Create a store rooted at the given directory.
+
+        Args:
+            directory: Directory to keep snapshot files in
+            key: Fernet key (urlsafe base64, 32 bytes) used to encrypt snapshots
+            ttl_minutes: Minutes after which a snapshot is considered expired
+
+        Raises:
+            ValueError: If the key is missing or invalid
+            ImportError: If the cryptography package is not installed
+        """
+        try:
+            from cryptography.fernet import Fernet, InvalidToken
+        except ImportError:
+            raise ImportError(
+                "cryptography package is required for storage-state snapshots. "
+                "Install it with: pip install cryptography"
+            )
+
+        if not key:
+            raise ValueError(
+                "Storage-state encryption key is required. Set STORAGE_STATE_KEY "
+                "environment variable to a Fernet key."
+            )
+
+        self.directory = directory
+        self.ttl_seconds = ttl_minutes * 60
+        self._fernet = Fernet(key.encode() if isinstance(key, str) else key)
+        self._invalid_token = InvalidToken
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+    def _path(self, domain: str, label: str) -> str:
+        # Hash the key so labels never leak into file names
+        digest = hashlib.sha256(f"{domain}\0{label}".encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.state")
+
+    def load(self, domain: str, label: str) -> Optional[Dict[str, Any]]:
+        """
+        Load the snapshot for a domain and credential label.
+
+        Expired or undecryptable snapshots are removed and treated as missing.
+
+        Returns:
+            Playwright storage state dict, or None if no usable snapshot exists
+        """
+        path = self._path(domain, label)
+        try:
+            with open(path, "rb") as f:
+                token = f.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            payload = self._fernet.decrypt(token, ttl=self.ttl_seconds)
+        except self._invalid_token:
+            logger.info("Discarding expired storage state for %s (%s)", domain, label)
+            self.delete(domain, label)
+            return None
+
+        return json.loads(payload)
+
+    def save(self, domain: str, label: str, state: Dict[str, Any]) -> None:
+        """Encrypt and store a snapshot, replacing any previous one."""
+        path = self._path(domain, label)
+        token = self._fernet.encrypt(json.dumps(state).encode())
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(token)
+        os.replace(tmp_path, path)
+
+    def delete(self, domain: str, label: str) -> None:
+        """Remove a snapshot if it exists."""
+        try:
+            os.remove(self._path(domain, label))
+        except FileNotFoundError:
+            pass
+
+
+def create_storage_state_store() -> Optional[StorageStateStore]:
+    """
+    Create the storage-state store from configuration.
+
+    Returns:
+        A StorageStateStore, or None if STORAGE_STATE_DIR is not set
+    """
+    if not CONFIG["STORAGE_STATE_DIR"]:
+        return None
+
+    return StorageStateStore(
+        directory=CONFIG["STORAGE_STATE_DIR"],
+        key=CONFIG["STORAGE_STATE_KEY"],
+        ttl_minutes=CONFIG["STORAGE_STATE_TTL_MINUTES"],
+    )
+
+
+async def apply_storage_state(
+    context: BrowserContext, storage_state: Dict[str, Any]
+) -> None:
+    """
+    Seed a browser context with a storage-state snapshot.
+
+    Cookies are added to the Playwright context directly and localStorage is
+    restored per origin by an init script, so nothing is written to disk in
+    plain text.
+
+    Args:
+        context: Browser context to seed
+        storage_state: Playwright storage state (cookies + origins)
+    """
+    session = await context.get_session()
+
+    cookies = storage_state.get("cookies") or []
+    if cookies:
+        await session.context.add_cookies(cookies)
+
+    local_storage = {
+        origin["origin"]: [
+            [item["name"], item["value"]] for item in origin["localStorage"]
+        ]
+        for origin in storage_state.get("origins") or []
+        if origin.get("localStorage")
+    }
+    if local_storage:
+        # Only fill keys the page has not set itself, so we never clobber
+        # values written during the task on later navigations
+        await session.context.add_init_script(
+            script=(
+                "(state => {"
+                " const entries = state[window.location.origin];"
+                " if (!entries) return;"
+                " for (const [name, value] of entries) {"
+                "  try { if (window.localStorage.getItem(name) === null)"
+                " window.localStorage.setItem(name, value); } catch (e) {}"
+                " }"
+                f"}})({json.dumps(local_storage)});"
+            )
+        )
+
+
+# How local browsers can run. The headless shell is the lightest; full
+# Chromium's new headless mode renders like a headed browser; headed browsers
+# need a display, such as the Docker image's optional VNC desktop
+BROWSER_MODES: Dict[str, str] = {
+    "headless": "Chromium headless shell",
+    "headless-full": "full Chromium in its new headless mode",
+    "headed": "full Chromium in a window (needs a display)",
+}
+
+
+def create_browser_config(
+    chrome_path: Optional[str] = None,
+    cdp_url: Optional[str] = None,
+    mode: Optional[str] = None,
+) -> BrowserConfig:
+    """
+    Create the configuration of a local or remote browser.
+
+    Args:
+        chrome_path: Path to Chrome executable
+        cdp_url: CDP endpoint of a remote browser to connect to instead
+        mode: One of BROWSER_MODES (defaults to BROWSER_MODE); remote
+            browsers run however they were started
+
+    Returns:
+        A BrowserConfig for browser_use's Browser
+    """
+    mode = mode or CONFIG["BROWSER_MODE"]
+    if mode not in BROWSER_MODES:
+        raise ValueError(
+            f"Unknown browser mode: {mode}. Supported modes: {', '.join(BROWSER_MODES)}"
+        )
+
+    browser_config = BrowserConfig(extra_chromium_args=list(CONFIG["BROWSER_ARGS"]))
+    if cdp_url:
+        browser_config.cdp_url = cdp_url
+        return browser_config
+    if chrome_path:
+        browser_config.chrome_instance_path = chrome_path
+
+    # Playwright launches its headless shell when asked for a headless browser.
+    # A Chrome started from chrome_path, or full Chromium launched as headed,
+    # is made headless with Chromium's own switch instead.
+    if mode == "headless" and not chrome_path:
+        browser_config.headless = True
+    elif mode != "headed":
+        browser_config.extra_chromium_args.append("--headless=new")
+    return browser_config
+
+
+class IsolatedBrowserContext(BrowserContext):
+    """
+    BrowserContext that always opens a new Playwright context.
+
+    Connected over CDP (or to an already running Chrome), browser_use reuses
+    the browser's first context. Tasks would then share cookies, storage and
+    tabs, and the viewport, locale and user agent of the task would be ignored.
+    """
+
+    async def _create_context(self, browser: Any) -> Any:
+        # Hide the existing contexts so browser_use creates and configures one
+        return await super()._create_context(
+            SimpleNamespace(contexts=[], new_context=browser.new_context)
+        )
+
+
+async def create_browser_context_for_task(
+    chrome_path: Optional[str] = None,
+    window_width: int = CONFIG["DEFAULT_WINDOW_WIDTH"],
+    window_height: int = CONFIG["DEFAULT_WINDOW_HEIGHT"],
+    locale: str = CONFIG["DEFAULT_LOCALE"],
+    storage_state: Optional[Dict[str, Any]] = None,
+    profile: str = CONFIG["EXECUTION_PROFILE"],
+    browser: Optional[Browser] = None,
+) -> Tuple[Browser, BrowserContext]:
+    """
+    Create a fresh browser and context for a task.
+
+    This function creates an isolated browser instance and context
+    with proper configuration for a single task. When an existing (e.g. pooled)
+    browser is passed, only a fresh context is created in it.
+
+    Args:
+        chrome_path: Path to Chrome executable
+        window_width: Browser window width
+        window_height: Browser window height
+        locale: Browser locale
+        storage_state: Optional storage-state snapshot to seed the context with
+        profile: Name of the execution profile to configure the context for
+        browser: Existing browser to open the context in instead of launching one
+
+    Returns:
+        A tuple containing the browser instance and browser context
+
+    Raises:
+        Exception: If browser or context creation fails
+    """
+    try:
+        profile_settings = EXECUTION_PROFILES[profile]
+
+        if browser is None:
+            browser = Browser(config=create_browser_config(chrome_path=chrome_path))
+
+        # Create context configuration
+        context_config = BrowserContextConfig(
+            wait_for_network_idle_page_load_time=0.6,
+            maximum_wait_page_load_time=1.2,
+            minimum_wait_page_load_time=0.2,
+            browser_window_size={"width": window_width, "height": window_height},
+            locale=locale,
+            user_agent=CONFIG["DEFAULT_USER_AGENT"],
+            highlight_elements=profile_settings["highlight_elements"],
+            viewport_expansion=profile_settings["viewport_expansion"],
+        )
+
+        # Create context with the browser
+        context = IsolatedBrowserContext(browser=browser, config=context_config)
+
+        # Restore a saved session so the task can skip re-authentication.
+        # BrowserContextConfig only supports a plain-text cookies file, so the
+        # snapshot is applied to the Playwright context directly instead.
+        if storage_state:
+            await apply_storage_state(context, storage_state)
+
+        return browser, context
+    except Exception as e:
+        logger.error("Error creating browser context: %s", e)
+        raise
+
+
+class BrowserPool:
+    """
+    Pool of long-lived browsers that hand out fresh, isolated contexts.
+
+    Launching Chromium dominates the latency of short, scripted tasks, so the
+    pool keeps up to `size` browsers running and opens a new context in the
+    least loaded one for each lease. Contexts are closed on release; browsers
+    that have disconnected are replaced transparently.
+
+    When remote endpoints are given, the pool instead holds one connection per
+    CDP endpoint and launches nothing locally. Contexts go to the endpoint with
+    the fewest active contexts; an endpoint that cannot be reached is skipped
+    for reconnect_seconds and then reconnected on demand.
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        chrome_path: Optional[str] = None,
+        endpoints: Optional[list[str]] = None,
+        reconnect_seconds: float = CONFIG["BROWSER_RECONNECT_SECONDS"],
+    ):
+        """
+        Create an empty pool; browsers are launched or connected on first use.
+
+        Args:
+            size: Maximum number of browsers to keep running
+            chrome_path: Path to Chrome executable
+            endpoints: CDP URLs of remote browsers to use instead of launching
+                local ones (e.g. http://browser-1:9222 or a ws:// debugger URL)
+            reconnect_seconds: How long an unreachable endpoint is skipped
+        """
+        self.endpoints = list(endpoints or [])
+        self.size = len(self.endpoints) if self.endpoints else max(1, size)
+        self.chrome_path = chrome_path
+        self.reconnect_seconds = reconnect_seconds
+        self._browsers: list[Browser] = []
+        self._leases: Dict[int, int] = {}
+        self._endpoint_of: Dict[int, str] = {}
+        self._down_until: Dict[str, float] = {}
+        self._lock = asyncio.Lock()
+        # One connection attempt per endpoint at a time
+        self._connect_locks = {endpoint: asyncio.Lock() for endpoint in self.endpoints}
+
+    def _is_healthy(self, browser: Browser) -> bool:
+        playwright_browser = getattr(browser, "playwright_browser", None)
+        # Not launched yet counts as healthy; it starts on first context
+        return playwright_browser is None or playwright_browser.is_connected()
+
+    def _add_browser(self, endpoint: Optional[str] = None) -> Browser:
+        browser = Browser(
+            config=create_browser_config(chrome_path=self.chrome_path, cdp_url=endpoint)
+        )
+        self._browsers.append(browser)
+        self._leases[id(browser)] = 0
+        if endpoint:
+            self._endpoint_of[id(browser)] = endpoint
+        return browser
+
+    async def _drop_browser(self, browser: Browser) -> None:
+        self._browsers.remove(browser)
+        self._leases.pop(id(browser), None)
+        endpoint = self._endpoint_of.pop(id(browser), None)
+        try:
+            await browser.close()
+        except Exception:
+            pass
+        if endpoint:
+            # Reconnect lazily on the next lease
+            self._add_browser(endpoint)
+
+    async def _pick_browser(self) -> Browser:
+        async with self._lock:
+            # Drop browsers that crashed or were closed underneath us
+            for browser in [b for b in self._browsers if not self._is_healthy(b)]:
+                endpoint = self._endpoint_of.get(id(browser))
+                if endpoint:
+                    logger.warning("Reconnecting to browser endpoint %s", endpoint)
+                    metrics.incr("browser_reconnects", endpoint=endpoint)
+                else:
+                    logger.warning("Replacing disconnected pooled browser")
+                await self._drop_browser(browser)
+
+            if self.endpoints:
+                if not self._browsers:
+                    for endpoint in self.endpoints:
+                        self._add_browser(endpoint)
+                now = time.monotonic()
+                candidates = [
+                    b
+                    for b in self._browsers
+                    if self._down_until.get(self._endpoint_of[id(b)], 0) <= now
+                ]
+                if not candidates:
+                    raise RuntimeError(
+                        "No browser endpoint is reachable; retrying in "
+                        f"{self.reconnect_seconds:g}s"
+                    )
+            else:
+                if len(self._browsers) < self.size:
+                    self._add_browser()
+                candidates = self._browsers
+
+            browser = min(candidates, key=lambda b: self._leases[id(b)])
+            self._leases[id(browser)] += 1
+            return browser
+
+    async def _connect(self, browser: Browser) -> None:
+        """Connect to a remote endpoint now, so failures can move to another."""
+        endpoint = self._endpoint_of[id(browser)]
+        try:
+            async with self._connect_locks[endpoint]:
+                if browser.playwright_browser is None:
+                    # Same as Browser._init for cdp_url, but without leaking the
+                    # Playwright driver when the endpoint is down
+                    playwright = await async_playwright().start()
+                    try:
+                        browser.playwright_browser = (
+                            await playwright.chromium.connect_over_cdp(endpoint)
+                        )
+                    except BaseException:
+                        await playwright.stop()
+                        raise
+                    browser.playwright = playwright
+            self._down_until.pop(endpoint, None)
+        except Exception:
+            logger.warning(
+                "Browser endpoint %s unreachable, skipping it for %gs",
+                endpoint,
+                self.reconnect_seconds,
+            )
+            metrics.incr("browser_endpoint_failures", endpoint=endpoint)
+            self._down_until[endpoint] = time.monotonic() + self.reconnect_seconds
+            async with self._lock:
+                if browser in self._browsers:
+                    await self._drop_browser(browser)
+            raise
+
+    async def acquire(
+        self,
+        window_width: int = CONFIG["DEFAULT_WINDOW_WIDTH"],
+        window_height: int = CONFIG["DEFAULT_WINDOW_HEIGHT"],
+        locale: str = CONFIG["DEFAULT_LOCALE"],
+        storage_state: Optional[Dict[str, Any]] = None,
+        profile: str = CONFIG["EXECUTION_PROFILE"],
+    ) -> BrowserContext:
+        """
+        Open a fresh context in a pooled browser.
+
+        The context must be handed back with release() when done. With remote
+        endpoints, each endpoint is tried at most once before giving up.
+
+        Returns:
+            A new browser context
+        """
+        attempts = len(self.endpoints) or 1
+        for attempt in range(attempts):
+            browser = await self._pick_browser()
+            try:
+                if self.endpoints:
+                    await self._connect(browser)
+                _, context = await create_browser_context_for_task(
+                    window_width=window_width,
+                    window_height=window_height,
+                    locale=locale,
+                    storage_state=storage_state,
+                    profile=profile,
+                    browser=browser,
+                )
+                return context
+            except Exception:
+                if id(browser) in self._leases:
+                    self._leases[id(browser)] = max(0, self._leases[id(browser)] - 1)
+                if attempt == attempts - 1:
+                    raise
+
+    async def release(self, context: BrowserContext) -> None:
+        """Close a leased context and free its slot."""
+        browser = context.browser
+        try:
+            await context.close()
+        finally:
+            if id(browser) in self._leases:
+                self._leases[id(browser)] = max(0, self._leases[id(browser)] - 1)
+
+    def endpoints_up(self) -> int:
+        """Number of remote endpoints not currently skipped after a failure."""
+        now = time.monotonic()
+        return sum(
+            1 for endpoint in self.endpoints if self._down_until.get(endpoint, 0) <= now
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the number of pooled browsers and active contexts."""
+        stats: Dict[str, Any] = {
+            "browsers": len(self._browsers),
+            "max_browsers": self.size,
+            "active_contexts": sum(self._leases.values()),
+        }
+        if self.endpoints:
+            now = time.monotonic()
+            stats["endpoints"] = [
+                {
+                    "url": self._endpoint_of[id(browser)],
+                    "contexts": self._leases[id(browser)],
+                    "connected": getattr(browser, "playwright_browser", None)
+                    is not None,
+                    "retry_in_seconds": round(
+                        max(
+                            0.0,
+                            self._down_until.get(self._endpoint_of[id(browser)], 0)
+                            - now,
+                        ),
+                        1,
+                    ),
+                }
+                for browser in self._browsers
+            ]
+        return stats
+
+    async def close(self) -> None:
+        """Close all pooled browsers (or disconnect from remote ones)."""
+        async with self._lock:
+            for browser in self._browsers:
+                try:
+                    await browser.close()
+                except Exception as e:
+                    logger.error("Error closing pooled browser: %s", e)
+            self._browsers.clear()
+            self._leases.clear()
+            self._endpoint_of.clear()
+
+
+class ReplayScriptStore:
+    """
+    Compiled, selector-based replay scripts of successful agent runs.
+
+    Scripts are keyed by a URL pattern, an action template and the credential
+    label the run was made with. Quoted strings and numbers in the action are
+    treated as parameters, so "search for 'laptops'" and "search for 'phones'"
+    share one script, with the typed text substituted on replay. Only runs made entirely of actions that can be
+    expressed as browser_script steps are compiled.
+    """
+
+    _PARAM_PATTERN = re.compile(r"\"([^\"]+)\"|'([^']+)'|\b(\d+(?:\.\d+)?)\b")
+
+    def __init__(self, max_scripts: int = 500):
+        """
+        Create an empty store.
+
+        Args:
+            max_scripts: Maximum number of scripts to keep (least recently used
+                are evicted first)
+        """
+        self.max_scripts = max_scripts
+        self._scripts: "OrderedDict[Tuple[str, str, str], list[Dict[str, Any]]]" = (
+            OrderedDict()
+        )
+
+    @staticmethod
+    def url_pattern(url: str) -> str:
+        """Generalize a URL to host + path, with numeric path segments wildcarded."""
+        if "://" not in url:
+            url = f"http://{url}"
+        parsed = urlparse(url)
+        segments = [
+            "*" if segment.isdigit() else segment
+            for segment in parsed.path.rstrip("/").split("/")
+        ]
+        return f"{(parsed.hostname or '').lower()}{'/'.join(segments)}"
+
+    @classmethod
+    def action_template(cls, action: str) -> Tuple[str, list[str]]:
+        """Split an action into a normalized template and its parameter values."""
+        params: list[str] = []
+
+        def _placeholder(match: re.Match) -> str:
+            params.append(next(group for group in match.groups() if group is not None))
+            return f"{{{{p{len(params) - 1}}}}}"
+
+        template = cls._PARAM_PATTERN.sub(_placeholder, action)
+        return " ".join(template.lower().split()), params
+
+    def _key(
+        self, url: str, action: str, credential_label: str
+    ) -> Tuple[Tuple[str, str, str], list[str]]:
+        template, params = self.action_template(action)
+        return (self.url_pattern(url), template, credential_label), params
+
+    @staticmethod
+    def _selector(element: Any) -> Optional[str]:
+        if element is None or getattr(element, "shadow_root", False):
+            return None
+        if element.css_selector:
+            return element.css_selector
+        if element.xpath:
+            return f"xpath=/{element.xpath.lstrip('/')}"
+        return None
+
+    def compile(
+        self, url: str, action: str, history: Any
+    ) -> Optional[list[Dict[str, Any]]]:
+        """
+        Compile an agent history into browser_script actions.
+
+        Args:
+            url: Task URL
+            action: Task action
+            history: AgentHistoryList of a successful run
+
+        Returns:
+            Parameterized script, or None if the run cannot be replayed
+        """
+        _, params = self.action_template(action)
+
+        def _parameterize(value: str) -> str:
+            if value == url:
+                return "{{url}}"
+            for index, param in enumerate(params):
+                value = re.sub(
+                    rf"(?<!\w){re.escape(param)}(?!\w)", f"{{{{p{index}}}}}", value
+                )
+            return value
+
+        script: list[Dict[str, Any]] = []
+        for model_action in history.model_actions():
+            element = model_action.get("interacted_element")
+            name = next(key for key in model_action if key != "interacted_element")
+            args = model_action[name] or {}
+
+            if name == "go_to_url":
+                script.append({"type": "navigate", "url": _parameterize(args["url"])})
+            elif name == "click_element":
+                selector = self._selector(element)
+                if not selector:
+                    return None
+                script.append({"type": "click", "selector": selector})
+            elif name == "input_text":
+                selector = self._selector(element)
+                if not selector:
+                    return None
+                script.append(
+                    {
+                        "type": "type",
+                        "selector": selector,
+                        "text": _parameterize(args["text"]),
+                    }
+                )
+            elif name == "send_keys" and args.get("keys") == "Enter" and script:
+                if script[-1]["type"] != "type":
+                    return None
+                script[-1]["submit"] = True
+            elif name == "wait":
+                script.append({"type": "wait_for", "state": "networkidle"})
+            elif name in ("extract_content", "done"):
+                # The LLM summary cannot be replayed; return the page text instead
+                if not script or script[-1]["type"] != "extract_text":
+                    script.append({"type": "extract_text"})
+            elif name in ("scroll_down", "scroll_up", "scroll_to_text"):
+                # Selector-based steps do not depend on the scroll position
+                continue
+            else:
+                return None
+
+        if not any(step["type"] == "navigate" for step in script):
+            script.insert(0, {"type": "navigate", "url": "{{url}}"})
+        if script[-1]["type"] != "extract_text":
+            script.append({"type": "extract_text"})
+        return script
+
+    def record(
+        self, url: str, action: str, history: Any, credential_label: str = "default"
+    ) -> bool:
+        """
+        Compile and store the script for a successful run.
+
+        Args:
+            url: Task URL
+            action: Task action
+            history: AgentHistoryList of the run
+            credential_label: Credentials the run was made with; the script is
+                only replayed for tasks using the same ones
+
+        Returns:
+            True if the run could be compiled and was stored
+        """
+        script = self.compile(url, action, history)
+        if not script:
+            return False
+
+        key, _ = self._key(url, action, credential_label)
+        self._scripts[key] = script
+        self._scripts.move_to_end(key)
+        while len(self._scripts) > self.max_scripts:
+            self._scripts.popitem(last=False)
+        return True
+
+    def lookup(
+        self, url: str, action: str, credential_label: str = "default"
+    ) -> Optional[list[Dict[str, Any]]]:
+        """
+        Find the script for a task and fill in its parameters.
+
+        Returns:
+            Ready-to-run browser_script actions, or None if there is no match
+        """
+        key, params = self._key(url, action, credential_label)
+        script = self._scripts.get(key)
+        if script is None:
+            return None
+        self._scripts.move_to_end(key)
+
+        def _fill(value: Any) -> Any:
+            if not isinstance(value, str):
+                return value
+            value = value.replace("{{url}}", url)
+            for index, param in enumerate(params):
+                value = value.replace(f"{{{{p{index}}}}}", param)
+            return value
+
+        return [{k: _fill(v) for k, v in step.items()} for step in script]
+
+    def discard(self, url: str, action: str, credential_label: str = "default") -> None:
+        """Forget the script for a task, e.g. after it failed to replay."""
+        key, _ = self._key(url, action, credential_label)
+        self._scripts.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._scripts)
+
+
+class ArtifactStore:
+    """
+    Keeps large task outputs on disk instead of in task records.
+
+    Fields of a result larger than inline_bytes are written to
+    <directory>/<task_id>/<name> and replaced by a small reference with the
+    artifact's URI (artifact://<task_id>/<name>), size, MIME type and a short
+    preview. The directory is capped at max_bytes by deleting the oldest
+    artifacts first. Worker processes and instances on the same host can share
+    the directory, so usage is taken from the directory itself.
+    """
+
+    def __init__(
+        self,
+        directory: str = CONFIG["ARTIFACT_DIR"],
+        max_bytes: int = CONFIG["ARTIFACT_MAX_MB"] * 1024 * 1024,
+        inline_bytes: int = CONFIG["ARTIFACT_INLINE_BYTES"],
+    ):
+        """
+        Create a store in the given directory.
+
+        Args:
+            directory: Where artifacts are written
+            max_bytes: Total size above which the oldest artifacts are deleted
+            inline_bytes: Fields up to this size stay in the task record
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.inline_bytes = inline_bytes
+
+    def _path(self, task_id: str, name: str) -> str:
+        return os.path.join(
+            self.directory, os.path.basename(task_id), os.path.basename(name)
+        )
+
+    def put(
+        self, task_id: str, name: str, data: bytes, mime_type: str, preview: str = ""
+    ) -> Dict[str, Any]:
+        """
+        Write an artifact and return the reference to store in its place.
+        """
+        path = self._path(task_id, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        metrics.incr("artifacts_written")
+        self._evict()
+        return {
+            "artifact": f"artifact://{task_id}/{name}",
+            "size": len(data),
+            "mime_type": mime_type,
+            "preview": preview,
+        }
+
+    def offload(self, task_id: str, name: str, value: Any) -> Any:
+        """Move a str or JSON value to an artifact if it is too large to inline."""
+        if isinstance(value, str):
+            data, mime_type, extension = value.encode(), "text/plain", "txt"
+        else:
+            data = json.dumps(value, ensure_ascii=False).encode()
+            mime_type, extension = "application/json", "json"
+        if len(data) <= self.inline_bytes:
+            return value
+        return self.put(
+            task_id,
+            f"{name}.{extension}",
+            data,
+            mime_type,
+            preview=data[:200].decode(errors="ignore"),
+        )
+
+    def offload_result(self, task_id: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Replace the large fields of a task result with artifact references."""
+        result = dict(result)
+        for field in ("final_result", "extracted_content"):
+            if field in result:
+                result[field] = self.offload(task_id, field, result[field])
+        if result.get("screenshots"):
+            result["screenshots"] = [
+                self.put(
+                    task_id,
+                    f"screenshot-{index}.png",
+                    base64.b64decode(screenshot),
+                    "image/png",
+                )
+                for index, screenshot in enumerate(result["screenshots"])
+            ]
+        return result
+
+    def read(
+        self, uri: str, offset: int = 0, length: int = CONFIG["ARTIFACT_CHUNK_BYTES"]
+    ) -> Tuple[Union[str, bytes], str]:
+        """
+        Read up to length bytes of an artifact, starting at a byte offset.
+
+        Text is cut back to whole UTF-8 characters, so the next offset is
+        offset plus the UTF-8 length of the returned text.
+
+        Returns:
+            The chunk (str for text, bytes otherwise) and its MIME type
+
+        Raises:
+            FileNotFoundError: If the artifact does not exist (or was evicted)
+        """
+        parsed = urlparse(uri)
+        path = self._path(parsed.netloc, parsed.path.lstrip("/"))
+        mime_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        with open(path, "rb") as f:
+            f.seek(offset)
+            chunk = f.read(length)
+            at_end = not f.read(1)
+        if mime_type.startswith("text/") or mime_type == "application/json":
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            return decoder.decode(chunk, final=at_end), mime_type
+        return chunk, mime_type
+
+    def _files(self) -> list[Tuple[float, int, str]]:
+        files = []
+        if not os.path.isdir(self.directory):
+            return files
+        for task_dir in os.scandir(self.directory):
+            if not task_dir.is_dir():
+                continue
+            for entry in os.scandir(task_dir.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # Evicted by another process
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _evict(self) -> None:
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+                metrics.incr("artifacts_evicted")
+            total -= size
+            with contextlib.suppress(OSError):
+                os.rmdir(os.path.dirname(path))  # Only succeeds once empty
+        metrics.set_gauge("artifact_bytes", total)
+
+    def stats(self) -> Dict[str, Any]:
+        files = self._files()
+        return {
+            "files": len(files),
+            "bytes": sum(size for _, size, _ in files),
+            "max_bytes": self.max_bytes,
+        }
+
+
+class ProgressMonitor:
+    """
+    Detects agent runs that loop or stall, from what each step did.
+
+    Every step contributes an action fingerprint (the actions with their
+    arguments) and a page fingerprint (URL, title, scroll position and the
+    interactive elements on the page). The same actions on the same URL
+    repeat_threshold steps in a row count as "repeated_action"; an unchanged
+    page for stall_steps steps counts as "stalled".
+    """
+
+    def __init__(
+        self,
+        repeat_threshold: int = CONFIG["LOOP_REPEAT_THRESHOLD"],
+        stall_steps: int = CONFIG["STALL_STEPS"],
+    ):
+        """
+        Create a monitor for one agent run.
+
+        Args:
+            repeat_threshold: Consecutive identical steps that count as a loop
+                (0 disables the check)
+            stall_steps: Consecutive steps on an unchanged page that count as
+                a stall (0 disables the check)
+        """
+        self.repeat_threshold = repeat_threshold
+        self.stall_steps = stall_steps
+        self.reset()
+
+    def reset(self) -> None:
+        """Start counting afresh, e.g. after the agent was given a hint."""
+        self._last_action: Optional[str] = None
+        self._repeats = 0
+        self._last_page: Optional[str] = None
+        self._unchanged = 0
+
+    @staticmethod
+    def page_fingerprint(browser_state: Any) -> str:
+        selector_map = getattr(browser_state, "selector_map", None) or {}
+        parts = [
+            getattr(browser_state, "url", ""),
+            getattr(browser_state, "title", ""),
+            str(getattr(browser_state, "pixels_above", 0)),
+            *sorted(getattr(node, "xpath", "") for node in selector_map.values()),
+        ]
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+    @staticmethod
+    def action_fingerprint(agent_output: Any) -> str:
+        actions = getattr(agent_output, "action", None) or []
+        return json.dumps(
+            [action.model_dump(exclude_none=True) for action in actions],
+            sort_keys=True,
+            default=str,
+        )
+
+    def observe(self, browser_state: Any, agent_output: Any) -> Optional[str]:
+        """
+        Record a step.
+
+        Returns:
+            "repeated_action" or "stalled" if the run is looping or stalled
+        """
+        action = f"{getattr(browser_state, 'url', '')}|{self.action_fingerprint(agent_output)}"
+        self._repeats = self._repeats + 1 if action == self._last_action else 1
+        self._last_action = action
+
+        page = self.page_fingerprint(browser_state)
+        self._unchanged = self._unchanged + 1 if page == self._last_page else 1
+        self._last_page = page
+
+        if self.repeat_threshold and self._repeats >= self.repeat_threshold:
+            return "repeated_action"
+        if self.stall_steps and self._unchanged >= self.stall_steps:
+            return "stalled"
+        return None
+
+
+# Messages given to an agent the first time it is caught looping or stalling
+PROGRESS_HINTS = {
+    "repeated_action": (
+        "You have repeated the same action on this page several times without "
+        "result. Do not repeat it again: try a different element or approach, "
+        "or call done with what you have found so far."
+    ),
+    "stalled": (
+        "The page has not changed for several steps, so your recent actions are "
+        "not making progress. Try a different approach (another element, "
+        "navigating elsewhere, scrolling) or call done with what you have found "
+        "so far."
+    ),
+}
+
+
+class TaskDurationEstimator:
+    """
+    Estimates how long tasks take from the run times of completed tasks.
+
+    Run times are kept as exponentially weighted averages at decreasing levels
+    of detail: host, action type and model; host and action type; host; and
+    all tasks. An estimate comes from the most specific level with at least
+    min_samples completed tasks, falling back to default_seconds.
+    """
+
+    # Keywords that classify an action, checked in order
+    ACTION_TYPES = (
+        (
+            "form",
+            ("fill", "submit", "log in", "login", "sign in", "sign up", "register"),
+        ),
+        ("search", ("search", "look up", "query")),
+        ("extract", ("extract", "get ", "find", "list", "read", "summar", "scrape")),
+        ("navigate", ("go to", "open", "click", "navigate", "visit")),
+    )
+
+    def __init__(
+        self,
+        default_seconds: float = CONFIG["DEFAULT_ESTIMATED_TASK_SECONDS"],
+        min_samples: int = CONFIG["ETA_MIN_SAMPLES"],
+        alpha: float = 0.3,
+    ):
+        """
+        Create an estimator with no history.
+
+        Args:
+            default_seconds: Estimate used until enough tasks have completed
+            min_samples: Completed tasks needed before a level is trusted
+            alpha: Weight of the newest run time in the running averages
+        """
+        self.default_seconds = default_seconds
+        self.min_samples = min_samples
+        self.alpha = alpha
+        # Key -> [average seconds, completed tasks]
+        self._stats: Dict[tuple, list[float]] = {}
+
+    @classmethod
+    def action_type(cls, action: str) -> str:
+        action = action.lower()
+        for action_type, keywords in cls.ACTION_TYPES:
+            if any(keyword in action for keyword in keywords):
+                return action_type
+        return "other"
+
+    def _keys(self, task: Dict[str, Any]) -> list[tuple]:
+        host = urlparse(task.get("url", "")).hostname or ""
+        action_type = self.action_type(task.get("action", ""))
+        return [
+            (host, action_type, task.get("model") or ""),
+            (host, action_type),
+            (host,),
+            (),
+        ]
+
+    def record(self, task: Optional[Dict[str, Any]]) -> None:
+        """Add the run time of a completed task to the history."""
+        if not task or task.get("status") != "completed":
+            return
+        try:
+            seconds = (
+                datetime.fromisoformat(task["end_time"])
+                - datetime.fromisoformat(task["start_time"])
+            ).total_seconds()
+        except (KeyError, TypeError, ValueError):
+            return
+        for key in self._keys(task):
+            stats = self._stats.setdefault(key, [seconds, 0])
+            stats[0] += self.alpha * (seconds - stats[0])
+            stats[1] += 1
+
+    def run_seconds(self, task: Optional[Dict[str, Any]] = None) -> float:
+        """Expected run time of a task, or of any task if none is given."""
+        for key in self._keys(task) if task else [()]:
+            stats = self._stats.get(key)
+            if stats and stats[1] >= self.min_samples:
+                return stats[0]
+        return self.default_seconds
+
+    def estimate(
+        self, task: Dict[str, Any], tasks_ahead: int, max_concurrent: int
+    ) -> Dict[str, float]:
+        """
+        Estimate the time left for a task and when to check on it next.
+
+        Args:
+            task: The task record
+            tasks_ahead: Tasks running or queued before this one
+            max_concurrent: Tasks that can run at once
+
+        Returns:
+            estimated_seconds until the result is ready, of which queue_seconds
+            is waiting for a slot, and poll_after_seconds until the next check
+        """
+        run_seconds = self.run_seconds(task)
+        queue_seconds = 0.0
+        if task.get("status") == "pending" and tasks_ahead >= max_concurrent:
+            # Tasks ahead run in waves of max_concurrent
+            waves = (tasks_ahead - max_concurrent) // max_concurrent + 1
+            queue_seconds = waves * self.run_seconds()
+
+        remaining = queue_seconds + run_seconds
+        if task.get("start_time"):
+            elapsed = (
+                datetime.now() - datetime.fromisoformat(task["start_time"])
+            ).total_seconds()
+            remaining = max(0.0, run_seconds - elapsed)
+
+        # Check halfway through the expected remainder, within sane bounds
+        poll_after = min(
+            max(remaining / 2, CONFIG["POLL_MIN_SECONDS"]), CONFIG["POLL_MAX_SECONDS"]
+        )
+        return {
+            "estimated_seconds": round(remaining),
+            "queue_seconds": round(queue_seconds),
+            "poll_after_seconds": round(poll_after),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "completed_tasks": int(self._stats.get((), [0, 0])[1]),
+            "average_seconds": round(self.run_seconds(), 1),
+        }
+
+
+def get_available_memory_mb() -> Optional[float]:
+    """
+    Return the memory available to this server in MB.
+
+    Uses MemAvailable from /proc/meminfo, lowered to the remaining headroom
+    of the cgroup (v2 or v1) when running under a container memory limit.
+
+    Returns:
+        Available memory in MB, or None where /proc is not available
+    """
+    available = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) / 1024
+                    break
+    except OSError:
+        return None
+
+    for limit_path, usage_path in (
+        ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+        (
+            "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+            "/sys/fs/cgroup/memory/memory.usage_in_bytes",
+        ),
+    ):
+        try:
+            with open(limit_path) as f:
+                limit = f.read().strip()
+            with open(usage_path) as f:
+                usage = int(f.read().strip())
+        except (OSError, ValueError):
+            continue
+        # "max" (v2) or a huge number (v1) means no limit
+        if limit.isdigit() and int(limit) < 1 << 60:
+            headroom = (int(limit) - usage) / (1024 * 1024)
+            available = headroom if available is None else min(available, headroom)
+        break
+
+    return available
+
+
+def get_process_tree_rss_mb(pid: int) -> float:
+    """
+    Return the combined resident memory of a process and its descendants in MB.
+
+    Args:
+        pid: Root of the process tree
+    """
+    children: Dict[int, list[int]] = {}
+    rss_pages: Dict[int, int] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields follow the last ")"
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        rss_pages[int(entry)] = int(fields[21])
+
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        total += rss_pages.get(current, 0)
+        stack.extend(children.get(current, []))
+    return total * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def get_browser_driver_pid(browser: Browser) -> Optional[int]:
+    """
+    Return the PID of the Playwright driver behind a browser.
+
+    Each task's Browser starts its own driver, and the Chromium it launches
+    runs below it, so the driver's process tree is the task's browser.
+
+    Returns:
+        The driver PID, or None if the browser has not started yet
+    """
+    try:
+        return browser.playwright._impl_obj._connection._transport._proc.pid
+    except AttributeError:
+        return None
+
+
+class MemoryWatchdog:
+    """
+    Samples available memory and the RSS of each task's browser.
+
+    New tasks wait (or, with MEMORY_ADMISSION=reject, are refused) while
+    available memory is below min_available_mb, and a task whose browser
+    process tree grows beyond task_limit_mb is stopped as "failed" and its
+    browser killed, so that one runaway page does not get every in-flight task
+    killed by the OOM killer. The peak RSS of each watched task is recorded as
+    peak_memory_mb.
+    """
+
+    def __init__(
+        self,
+        min_available_mb: int = CONFIG["MEMORY_MIN_AVAILABLE_MB"],
+        task_limit_mb: int = CONFIG["TASK_MEMORY_LIMIT_MB"],
+        sample_seconds: float = CONFIG["MEMORY_SAMPLE_SECONDS"],
+    ):
+        """
+        Create the watchdog; sampling starts with run().
+
+        Args:
+            min_available_mb: Available memory below which tasks are not
+                admitted (0 disables admission control)
+            task_limit_mb: Browser RSS above which a task is stopped (0
+                disables the limit)
+            sample_seconds: Interval between samples
+        """
+        self.min_available_mb = min_available_mb
+        self.task_limit_mb = task_limit_mb
+        self.sample_seconds = sample_seconds
+        self.available_mb = get_available_memory_mb()
+        self._browsers: Dict[str, Browser] = {}
+        self._peaks: Dict[str, float] = {}
+
+    def has_headroom(self) -> bool:
+        """Whether enough memory is available to start another task."""
+        if not self.min_available_mb:
+            return True
+        self.available_mb = get_available_memory_mb()
+        return self.available_mb is None or self.available_mb >= self.min_available_mb
+
+    async def wait_for_headroom(self, task_id: str) -> None:
+        """Wait until enough memory is available to start a task."""
+        if self.has_headroom():
+            return
+        logger.warning(
+            "Task %s: Waiting for memory (%.0f MB available, %s MB required)",
+            task_id,
+            self.available_mb,
+            self.min_available_mb,
+        )
+        metrics.incr("memory_admission_waits")
+        while not self.has_headroom():
+            await asyncio.sleep(self.sample_seconds)
+
+    def watch(self, task_id: str, browser: Browser) -> None:
+        """Start sampling the browser of a task."""
+        self._browsers[task_id] = browser
+        self._peaks[task_id] = 0.0
+
+    def unwatch(self, task_id: str) -> Optional[float]:
+        """
+        Stop sampling a task.
+
+        Returns:
+            The task's peak browser RSS in MB, or None if never sampled
+        """
+        self._browsers.pop(task_id, None)
+        peak = self._peaks.pop(task_id, None)
+        return round(peak, 1) if peak else None
+
+    def _sample(self) -> Dict[str, float]:
+        usage = {}
+        for task_id, browser in list(self._browsers.items()):
+            pid = get_browser_driver_pid(browser)
+            if pid is not None:
+                usage[task_id] = get_process_tree_rss_mb(pid)
+        return usage
+
+    def _kill_browser(self, browser: Browser) -> None:
+        """Kill the processes below a browser's driver, leaving the driver."""
+        pid = get_browser_driver_pid(browser)
+        if pid is None:
+            return
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parent = int(f.read().rsplit(")", 1)[1].split()[1])
+                if parent == pid:
+                    os.kill(int(entry), signal.SIGKILL)
+            except (OSError, IndexError, ValueError):
+                continue
+
+    async def run(self) -> None:
+        """Sample memory and enforce the per-task limit until cancelled."""
+        while True:
+            await asyncio.sleep(self.sample_seconds)
+            try:
+                self.available_mb = get_available_memory_mb()
+                if self.available_mb is not None:
+                    metrics.set_gauge("memory_available_mb", round(self.available_mb))
+                if not self._browsers:
+                    continue
+
+                usage = await asyncio.to_thread(self._sample)
+                metrics.set_gauge("browser_rss_mb", round(sum(usage.values())))
+                for task_id, rss_mb in usage.items():
+                    if task_id not in self._peaks:
+                        continue  # Finished while we were sampling
+                    self._peaks[task_id] = max(self._peaks[task_id], rss_mb)
+                    if self.task_limit_mb and rss_mb > self.task_limit_mb:
+                        logger.error(
+                            "Task %s: Browser uses %.0f MB, over the %s MB limit; stopping it",
+                            task_id,
+                            rss_mb,
+                            self.task_limit_mb,
+                        )
+                        metrics.incr("tasks_memory_killed")
+                        task_store[task_id]["error"] = (
+                            f"Browser exceeded the memory limit of {self.task_limit_mb} MB"
+                        )
+                        cancel_task(task_id, "failed")
+                        await asyncio.to_thread(
+                            self._kill_browser, self._browsers[task_id]
+                        )
+            except Exception as e:
+                logger.error("Error in memory watchdog: %s", e)
+
+
+class EventLoopMonitor:
+    """
+    Measures event loop lag and reports calls that block the loop.
+
+    A coroutine sleeps for sample_seconds at a time and records how late it
+    wakes up as event_loop_lag_seconds. A watcher thread notices when the loop
+    has been blocked for more than stall_seconds and captures the loop
+    thread's stack and the task_id of the task that was running; once the loop
+    recovers, the stall is logged, counted as event_loop_stalls and kept among
+    the last max_reports stalls. Nothing is captured while the loop is healthy,
+    so the monitor is cheap enough to leave on.
+    """
+
+    def __init__(
+        self,
+        sample_seconds: float = CONFIG["LOOP_LAG_SAMPLE_SECONDS"],
+        stall_seconds: float = CONFIG["LOOP_STALL_SECONDS"],
+        max_reports: int = 20,
+    ):
+        """
+        Create the monitor; sampling starts with run().
+
+        Args:
+            sample_seconds: Interval between lag samples (0 disables the monitor)
+            stall_seconds: Time the loop must be blocked to report a stall
+            max_reports: Number of recent stalls kept for stats()
+        """
+        self.sample_seconds = sample_seconds
+        self.stall_seconds = stall_seconds
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls: deque = deque(maxlen=max_reports)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread_id: Optional[int] = None
+        self._beat = time.monotonic()
+        self._stalled_beat: Optional[float] = None
+        self._pending: Optional[Dict[str, Any]] = None
+        self._stopped = threading.Event()
+
+    def _capture(self) -> Dict[str, Any]:
+        """Describe what the blocked loop thread is doing (runs off the loop)."""
+        frame = sys._current_frames().get(self._thread_id)
+        stack = traceback.format_stack(frame)[-15:] if frame else []
+        task_id = coroutine = None
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        if task is not None:
+            coroutine = getattr(task.get_coro(), "__qualname__", None)
+            # Task.get_context() is new in Python 3.12
+            if hasattr(task, "get_context"):
+                task_id = task.get_context().get(current_task_id)
+        return {
+            "task_id": task_id,
+            "coroutine": coroutine,
+            "at": datetime.now().isoformat(),
+            "stack": "".join(stack),
+        }
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.stall_seconds / 2):
+            beat = self._beat
+            overdue = time.monotonic() - beat - self.sample_seconds
+            if overdue > self.stall_seconds and self._stalled_beat != beat:
+                # Capture once per stall, while the loop is still stuck
+                self._stalled_beat = beat
+                self._pending = self._capture()
+
+    def _report(self, lag: float) -> None:
+        stall, self._pending = self._pending, None
+        stall["seconds"] = round(lag, 3)
+        self.stalls.append(stall)
+        metrics.incr("event_loop_stalls")
+        logger.warning(
+            "Event loop blocked for %.2fs (task %s, %s)\n%s",
+            lag,
+            stall["task_id"],
+            stall["coroutine"],
+            stall["stack"],
+        )
+
+    async def run(self) -> None:
+        """Sample loop lag until cancelled."""
+        if not self.sample_seconds:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        threading.Thread(
+            target=self._watch, name="event-loop-monitor", daemon=True
+        ).start()
+        try:
+            while True:
+                start = self._beat = time.monotonic()
+                await asyncio.sleep(self.sample_seconds)
+                lag = max(0.0, time.monotonic() - start - self.sample_seconds)
+                self.last_lag = lag
+                self.max_lag = max(self.max_lag, lag)
+                metrics.observe("event_loop_lag_seconds", lag)
+                if self._pending:
+                    self._report(lag)
+        finally:
+            self._stopped.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "last_lag_seconds": round(self.last_lag, 3),
+            "max_lag_seconds": round(self.max_lag, 3),
+            "recent_stalls": list(self.stalls),
+        }
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread into collapsed-stack counts.
+
+    The output has one "outer;...;inner count" line per distinct stack, the
+    input format of flamegraph.pl and speedscope. Given a loop and task_id,
+    only samples taken while that task (or a task it spawned) is running on
+    the loop are counted, which profiles one task among many sharing the loop.
+    """
+
+    # Telling tasks apart needs Task.get_context, new in Python 3.12
+    can_profile_tasks = hasattr(asyncio.Task, "get_context")
+
+    def __init__(
+        self,
+        thread_id: int,
+        interval: float = CONFIG["PROFILE_SAMPLE_SECONDS"],
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        task_id: Optional[str] = None,
+    ):
+        """
+        Raises:
+            RuntimeError: If task_id is given on Python older than 3.12
+        """
+        if task_id and not self.can_profile_tasks:
+            raise RuntimeError("Profiling a single task requires Python 3.12 or later")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.loop = loop
+        self.task_id = task_id
+        self.samples = 0
+        self._counts: Dict[str, int] = {}
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _collapse(frame: Any) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(
+                f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+            )
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _in_task(self) -> bool:
+        try:
+            task = asyncio.current_task(self.loop)
+        except RuntimeError:
+            return False
+        return (
+            task is not None and task.get_context().get(current_task_id) == self.task_id
+        )
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None or (self.task_id and not self._in_task()):
+                continue
+            stack = self._collapse(frame)
+            self._counts[stack] = self._counts.get(stack, 0) + 1
+            self.samples += 1
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> str:
+        """Stop sampling and return the collapsed stacks."""
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        return "".join(f"{stack} {count}\n" for stack, count in self._counts.items())
+
+
+def save_profile(name: str, data: bytes) -> str:
+    """Write a profile into PROFILE_DIR and return its path."""
+    os.makedirs(CONFIG["PROFILE_DIR"], exist_ok=True)
+    path = os.path.join(CONFIG["PROFILE_DIR"], os.path.basename(name))
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+# Screenshot formats with their MIME types; Playwright encodes png and jpeg
+SCREENSHOT_FORMATS: Dict[str, str] = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+
+def load_pillow() -> Any:
+    """
+    Import Pillow, which resizes screenshots and encodes WebP.
+
+    Raises:
+        ImportError: If Pillow is not installed
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImportError(
+            "Pillow is required to resize screenshots or save them as WebP. "
+            "Install it with: pip install Pillow"
+        )
+    return Image
+
+
+def needs_pillow(settings: Dict[str, Any]) -> bool:
+    """Whether screenshots with these settings are re-encoded with Pillow."""
+    return bool(
+        settings["format"] == "webp" or settings["max_width"] or settings["max_height"]
+    )
+
+
+def screenshot_settings(
+    capture: str, options: Optional[Dict[str, Any]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Build the screenshot settings of a task from its options and the defaults.
+
+    Args:
+        capture: "none", "final" (after the task) or "steps" (also after each step)
+        options: Optional format, quality, max_width, max_height and full_page
+
+    Returns:
+        The settings, or None if no screenshots are to be taken
+
+    Raises:
+        ValueError: If an option is invalid
+        ImportError: If the options need Pillow and it is not installed
+    """
+    if capture == "none":
+        return None
+    if capture not in ("final", "steps"):
+        raise ValueError(
+            f"Unknown screenshots value: {capture}. Supported values: none, final, steps"
+        )
+    options = options or {}
+    settings = {
+        "capture": capture,
+        "format": str(options.get("format", CONFIG["SCREENSHOT_FORMAT"])).lower(),
+        "quality": int(options.get("quality", CONFIG["SCREENSHOT_QUALITY"])),
+        "max_width": int(options.get("max_width", CONFIG["SCREENSHOT_MAX_WIDTH"])),
+        "max_height": int(options.get("max_height", CONFIG["SCREENSHOT_MAX_HEIGHT"])),
+        "full_page": bool(options.get("full_page", CONFIG["SCREENSHOT_FULL_PAGE"])),
+    }
+    if settings["format"] not in SCREENSHOT_FORMATS:
+        raise ValueError(
+            f"Unsupported screenshot format: {settings['format']}. "
+            f"Supported formats: {', '.join(SCREENSHOT_FORMATS)}"
+        )
+    if not 1 <= settings["quality"] <= 100:
+        raise ValueError("Screenshot quality must be between 1 and 100")
+    if settings["max_width"] < 0 or settings["max_height"] < 0:
+        raise ValueError("Screenshot max_width and max_height must not be negative")
+    if needs_pillow(settings):
+        load_pillow()
+    return settings
+
+
+def encode_screenshot(data: bytes, settings: Dict[str, Any]) -> bytes:
+    """
+    Scale a PNG screenshot down to the maximum dimensions and encode it.
+
+    Decoding and encoding a full-page screenshot can take hundreds of
+    milliseconds, so this runs in a thread.
+    """
+    Image = load_pillow()
+    with Image.open(io.BytesIO(data)) as image:
+        if settings["max_width"] or settings["max_height"]:
+            image.thumbnail(
+                (
+                    settings["max_width"] or image.width,
+                    settings["max_height"] or image.height,
+                )
+            )
+        if settings["format"] == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        if settings["format"] == "png":
+            image.save(output, format="PNG", optimize=True)
+        else:
+            image.save(
+                output, format=settings["format"].upper(), quality=settings["quality"]
+            )
+    return output.getvalue()
+
+
+async def capture_screenshot(page: Any, settings: Dict[str, Any]) -> Tuple[bytes, str]:
+    """
+    Take a screenshot of a page as configured by screenshot_settings.
+
+    PNG and JPEG are encoded by the browser. For WebP or a size limit the page
+    is captured as PNG and re-encoded off the event loop.
+
+    Returns:
+        The image and its MIME type
+    """
+    image_format = "png" if needs_pillow(settings) else settings["format"]
+    kwargs: Dict[str, Any] = {
+        "type": image_format,
+        "full_page": settings["full_page"],
+        # One image pixel per CSS pixel, even on high-DPI contexts
+        "scale": "css",
+    }
+    if image_format == "jpeg":
+        kwargs["quality"] = settings["quality"]
+    data = await page.screenshot(**kwargs)
+    if needs_pillow(settings):
+        data = await asyncio.to_thread(encode_screenshot, data, settings)
+    return data, SCREENSHOT_FORMATS[settings["format"]]
+
+
+async def run_browser_task_async(
+    task_id: str,
+    url: str,
+    action: str,
+    llm: BaseLanguageModel,
+    window_width: int = CONFIG["DEFAULT_WINDOW_WIDTH"],
+    window_height: int = CONFIG["DEFAULT_WINDOW_HEIGHT"],
+    locale: str = CONFIG["DEFAULT_LOCALE"],
+    storage_state_store: Optional[StorageStateStore] = None,
+    credential_label: str = "default",
+    profile: str = CONFIG["EXECUTION_PROFILE"],
+    replay_store: Optional[ReplayScriptStore] = None,
+    browser_pool: Optional[BrowserPool] = None,
+    memory_watchdog: Optional[MemoryWatchdog] = None,
+    planner_llm: Optional[BaseLanguageModel] = None,
+    artifact_store: Optional[ArtifactStore] = None,
+    screenshots: Optional[Dict[str, Any]] = None,
+) -> None:
+    """
+    Run a browser task asynchronously and store the result.
+
+    This function executes a browser automation task with the given URL and action,
+    and updates the task store with progress and results.
+
+    When PATIENT_MODE is enabled, the calling function will wait for this function
+    to complete before returning to the client.
+
+    Args:
+        task_id: Unique identifier for the task
+        url: URL to navigate to
+        action: Action to perform after navigation
+        llm: Language model to use for browser agent
+        window_width: Browser window width
+        window_height: Browser window height
+        locale: Browser locale
+        storage_state_store: Optional store of storage-state snapshots to restore
+            sessions from and refresh after successful tasks
+        credential_label: Label of the credentials whose snapshot should be used
+        profile: Name of the execution profile (see EXECUTION_PROFILES)
+        replay_store: Optional store of compiled scripts to try before the agent
+            and to record successful runs into
+        browser_pool: Optional pool to lease the context from (e.g. remote
+            browsers) instead of launching a browser for this task
+        memory_watchdog: Optional watchdog to sample (and limit) the memory of
+            this task's browser; its peak is recorded as peak_memory_mb
+        planner_llm: Optional (typically stronger) model that plans the next
+            steps for the agent, which then carries them out with llm
+        artifact_store: Optional store for large result fields, which are
+            then kept on disk and referenced by URI in the task record
+        screenshots: Optional settings from screenshot_settings; the
+            screenshots are kept in artifact_store
+    """
+    browser = None
+    context = None
+    domain = get_task_domain(url)
+    current_task_id.set(task_id)
+
+    # Profile this task if asked to through /admin/profile or PROFILE_EVERY_N_TASKS
+    sampler = None
+    if task_store[task_id].get("profiling"):
+        sampler = StackSampler(
+            threading.get_ident(), loop=asyncio.get_running_loop(), task_id=task_id
+        )
+        sampler.start()
+
+    try:
+        # Update task status to running
+        task_store[task_id]["status"] = "running"
+        task_store[task_id]["start_time"] = datetime.now().isoformat()
+        task_store[task_id]["progress"] = {
+            "current_step": 0,
+            "total_steps": 0,
+            "steps": [],
+        }
+
+        # LLM usage totals at the previous step, to report per-step usage
+        usage_mark: Dict[str, float] = {}
+
+        # Watches for loops and stalls; hints already given to the agent
+        progress_monitor = ProgressMonitor()
+        hinted: set[str] = set()
+
+        # Start of the current agent step, for its span
+        step_started_ns = time.time_ns()
+
+        async def save_screenshot(name: str) -> Optional[Dict[str, Any]]:
+            """Store a screenshot of the current page and return its reference."""
+            try:
+                page = await context.get_current_page()
+                data, mime_type = await capture_screenshot(page, screenshots)
+            except Exception as e:
+                logger.warning("Task %s: Failed to take screenshot: %s", task_id, e)
+                metrics.incr("screenshot_failures")
+                return None
+            metrics.observe("screenshot_bytes", len(data), format=screenshots["format"])
+            return await asyncio.to_thread(
+                artifact_store.put,
+                task_id,
+                f"{name}.{screenshots['format']}",
+                data,
+                mime_type,
+            )
+
+        # Define step callback function with the correct signature
+        async def step_callback(
+            browser_state: Any, agent_output: Any, step_number: int
+        ) -> None:
+            nonlocal step_started_ns
+            # Update progress in task store
+            task_store[task_id]["progress"]["current_step"] = step_number
+            task_store[task_id]["progress"]["total_steps"] = max(
+                task_store[task_id]["progress"]["total_steps"], step_number
+            )
+
+            # Add step info with minimal details
+            step_info = {"step": step_number, "time": datetime.now().isoformat()}
+
+            # Add goal if available
+            if agent_output and hasattr(agent_output, "current_state"):
+                if hasattr(agent_output.current_state, "next_goal"):
+                    step_info["goal"] = agent_output.current_state.next_goal
+
+            # Add the LLM usage of this step
+            usage = task_store[task_id].get("usage")
+            if usage:
+                for key in ("prompt_tokens", "completion_tokens", "llm_seconds"):
+                    step_info[key] = round(usage[key] - usage_mark.get(key, 0), 3)
+                usage_mark.update(usage)
+
+            # Add the page the agent acted on, if asked to
+            if screenshots and screenshots["capture"] == "steps" and artifact_store:
+                reference = await save_screenshot(f"step-{step_number}")
+                if reference:
+                    step_info["screenshot"] = reference["artifact"]
+
+            # Add to progress steps
+            task_store[task_id]["progress"]["steps"].append(step_info)
+
+            # Nudge or stop an agent that is going round in circles
+            reason = progress_monitor.observe(browser_state, agent_output)
+            agent = task_agents.get(task_id)
+            if reason and agent is not None:
+                if CONFIG["PROGRESS_ACTION"] == "hint" and reason not in hinted:
+                    step_logger.info(
+                        "Task %s: Agent %s, giving it a hint", task_id, reason
+                    )
+                    metrics.incr("agent_progress_hints", reason=reason)
+                    hinted.add(reason)
+                    progress_monitor.reset()
+                    # Insert before the step's state message, which the agent
+                    # removes from its history after this callback
+                    agent._message_manager._add_message_with_tokens(
+                        HumanMessage(content=PROGRESS_HINTS[reason]), position=-1
+                    )
+                else:
+                    logger.info(
+                        "Task %s: Agent %s, ending the run early", task_id, reason
+                    )
+                    metrics.incr("tasks_terminated_early", reason=reason)
+                    task_store[task_id]["early_termination"] = reason
+                    agent.stop()
+
+            # Log progress
+            step_logger.info("Task %s: Step %s completed", task_id, step_number)
+
+            step_ended_ns = time.time_ns()
+            tracer.record(
+                "agent.step",
+                step_started_ns,
+                step_ended_ns,
+                task_id=task_id,
+                step=step_number,
+                url=getattr(browser_state, "url", None),
+                actions=",".join(
+                    name
+                    for action in getattr(agent_output, "action", None) or []
+                    for name in action.model_dump(exclude_none=True)
+                ),
+                prompt_tokens=step_info.get("prompt_tokens"),
+                completion_tokens=step_info.get("completion_tokens"),
+                llm_seconds=step_info.get("llm_seconds"),
+                progress_issue=reason,
+            )
+            step_started_ns = step_ended_ns
+
+        # Define done callback function with the correct signature
+        async def done_callback(history: Any) -> None:
+            # Log completion
+            logger.info(
+                "Task %s: Completed with %d steps", task_id, len(history.history)
+            )
+
+            # Add final step
+            current_step = task_store[task_id]["progress"]["current_step"] + 1
+            task_store[task_id]["progress"]["steps"].append(
+                {
+                    "step": current_step,
+                    "time": datetime.now().isoformat(),
+                    "status": "completed",
+                }
+            )
+
+        # Get Chrome path from environment if available
+        chrome_path = os.environ.get("CHROME_PATH")
+
+        # Look up a saved session for the target domain
+        storage_state = None
+        if storage_state_store and domain:
+            storage_state = storage_state_store.load(domain, credential_label)
+            task_store[task_id]["storage_state_restored"] = storage_state is not None
+
+        async def open_context() -> BrowserContext:
+            """Open a fresh context, in the task's own browser unless pooled."""
+            nonlocal browser
+            with tracer.span(
+                "browser.context",
+                task_id=task_id,
+                profile=profile,
+                pooled=bool(browser_pool),
+            ):
+                if browser_pool:
+                    return await browser_pool.acquire(
+                        window_width=window_width,
+                        window_height=window_height,
+                        locale=locale,
+                        storage_state=storage_state,
+                        profile=profile,
+                    )
+                browser, new_context = await create_browser_context_for_task(
+                    chrome_path=chrome_path,
+                    window_width=window_width,
+                    window_height=window_height,
+                    locale=locale,
+                    storage_state=storage_state,
+                    profile=profile,
+                    browser=browser,
+                )
+                return new_context
+
+        # Create a fresh context for this task
+        context = await open_context()
+        if browser and memory_watchdog:
+            memory_watchdog.watch(task_id, browser)
+
+        # Replay a compiled script for this kind of task before involving the LLM
+        response_data = None
+        script = (
+            replay_store.lookup(url, action, credential_label) if replay_store else None
+        )
+        if script:
+            with tracer.span("task.replay", task_id=task_id) as span:
+                replay = await execute_script_actions(context, script)
+                span.set_attribute("success", replay["success"])
+            if replay["success"]:
+                logger.info(
+                    "Task %s: Completed by replaying a compiled script", task_id
+                )
+                metrics.incr("replay_hits")
+                response_data = {**replay, "profile": profile, "replayed": True}
+            else:
+                # The site changed under the script; let the agent redo it
+                logger.info(
+                    "Task %s: Replay failed (%s), falling back to agent",
+                    task_id,
+                    replay["errors"][-1],
+                )
+                metrics.incr("replay_fallbacks")
+                replay_store.discard(url, action, credential_label)
+
+                # Start the agent from a clean context, not from wherever the
+                # replay stopped
+                used_context, context = context, None
+                if browser_pool:
+                    await browser_pool.release(used_context)
+                else:
+                    await used_context.close()
+                context = await open_context()
+
+        if response_data is None:
+            # Create agent with the fresh context
+            profile_settings = EXECUTION_PROFILES[profile]
+            agent_kwargs: Dict[str, Any] = {
+                "use_vision": profile_settings["use_vision"]
+            }
+            if profile_settings["include_attributes"] is not None:
+                agent_kwargs["include_attributes"] = profile_settings[
+                    "include_attributes"
+                ]
+            if planner_llm is not None:
+                agent_kwargs["planner_llm"] = planner_llm
+
+            agent = Agent(
+                task=f"First, navigate to {url}. Then, {action}",
+                llm=llm,
+                browser_context=context,
+                register_new_step_callback=step_callback,
+                register_done_callback=done_callback,
+                **agent_kwargs,
+            )
+
+            # Run the agent with a reasonable step limit
+            task_agents[task_id] = agent
+            step_started_ns = time.time_ns()
+            try:
+                with tracer.span(
+                    "agent.run", task_id=task_id, model=agent.model_name
+                ) as span:
+                    agent_result = await agent.run(max_steps=CONFIG["MAX_AGENT_STEPS"])
+                    span.set_attribute("steps", len(agent_result.history))
+            finally:
+                task_agents.pop(task_id, None)
+
+            # The agent turns errors inside a step (including a cancellation
+            # landing in a Playwright call) into step failures and carries on,
+            # so honour a cancel that arrived while it was running
+            if task_store[task_id].get("cancel_reason"):
+                raise asyncio.CancelledError()
+
+            # Keep a selector-based script of successful runs for later replay
+            if replay_store and agent_result.is_successful():
+                replay_store.record(url, action, agent_result, credential_label)
+
+            # Get the final result
+            final_result = agent_result.final_result()
+
+            # Check if we have a valid result
+            if final_result and hasattr(final_result, "raise_for_status"):
+                final_result.raise_for_status()
+                result_text = str(final_result.text)
+            else:
+                result_text = (
+                    str(final_result) if final_result else "No final result available"
+                )
+
+            # Gather essential information from the agent history
+            is_successful = agent_result.is_successful()
+            has_errors = agent_result.has_errors()
+            errors = agent_result.errors()
+            urls_visited = agent_result.urls()
+            action_names = agent_result.action_names()
+            extracted_content = agent_result.extracted_content()
+            steps_taken = agent_result.number_of_steps()
+
+            # Per-step latency and (approximate) prompt tokens for profile comparison
+            step_durations = [
+                h.metadata.duration_seconds for h in agent_result.history if h.metadata
+            ]
+            input_tokens = agent_result.total_input_tokens()
+            for duration in step_durations:
+                metrics.observe("agent_step_seconds", duration, profile=profile)
+            metrics.observe("task_input_tokens", input_tokens, profile=profile)
+            metrics.incr("tasks_completed", profile=profile)
+
+            # Create a focused response with the most relevant information
+            response_data = {
+                "final_result": result_text,
+                "success": is_successful,
+                "has_errors": has_errors,
+                "errors": [str(err) for err in errors if err],
+                "urls_visited": [str(url) for url in urls_visited if url],
+                "actions_performed": action_names,
+                "extracted_content": extracted_content,
+                "steps_taken": steps_taken,
+                "profile": profile,
+                "model": agent.model_name,
+                "planner_model": agent.planner_model_name,
+                "avg_step_seconds": (
+                    round(sum(step_durations) / len(step_durations), 3)
+                    if step_durations
+                    else None
+                ),
+                "input_tokens": input_tokens,
+                "usage": dict(task_store[task_id].get("usage") or {}),
+            }
+            if task_store[task_id].get("budget_exhausted"):
+                response_data["budget_exhausted"] = True
+            if task_store[task_id].get("early_termination"):
+                response_data["early_termination"] = task_store[task_id][
+                    "early_termination"
+                ]
+
+        # Capture the page the task ended on
+        if screenshots and artifact_store:
+            reference = await save_screenshot("final")
+            if reference:
+                response_data["screenshot"] = reference
+
+        # Refresh the saved session while the context is still open
+        if storage_state_store and domain and response_data["success"]:
+            try:
+                session = await context.get_session()
+                storage_state_store.save(
+                    domain, credential_label, await session.context.storage_state()
+                )
+            except Exception as e:
+                logger.warning(
+                    "Failed to refresh storage state for task %s: %s", task_id, e
+                )
+
+        # Store the result, with large fields moved out of the task record
+        if artifact_store:
+            response_data = await asyncio.to_thread(
+                artifact_store.offload_result, task_id, response_data
+            )
+        task_store[task_id]["status"] = "completed"
+        task_store[task_id]["end_time"] = datetime.now().isoformat()
+        task_store[task_id]["result"] = response_data
+
+    except asyncio.CancelledError:
+        # Cancelled by browser_cancel or by the task deadline
+        reason = task_store[task_id].get("cancel_reason", "cancelled")
+        logger.info("Task %s: Stopped (%s)", task_id, reason)
+        metrics.incr("tasks_stopped", profile=profile, reason=reason)
+
+        task_store[task_id]["status"] = reason
+        task_store[task_id]["end_time"] = datetime.now().isoformat()
+        raise
+
+    except Exception as e:
+        logger.error("Error in async browser task: %s", e)
+        tb = traceback.format_exc()
+
+        metrics.incr("tasks_failed", profile=profile)
+
+        # Store the error
+        task_store[task_id]["status"] = "failed"
+        task_store[task_id]["end_time"] = datetime.now().isoformat()
+        task_store[task_id]["error"] = str(e)
+        task_store[task_id]["traceback"] = tb
+
+    finally:
+        if sampler:
+            task_store[task_id]["profile_path"] = await asyncio.to_thread(
+                save_profile, f"task-{task_id}.collapsed", sampler.stop().encode()
+            )
+            logger.info(
+                "Task %s: Profile of %d samples saved to %s",
+                task_id,
+                sampler.samples,
+                task_store[task_id]["profile_path"],
+            )
+
+        if memory_watchdog:
+            peak_memory_mb = memory_watchdog.unwatch(task_id)
+            if peak_memory_mb is not None:
+                task_store[task_id]["peak_memory_mb"] = peak_memory_mb
+                if task_store[task_id].get("result"):
+                    task_store[task_id]["result"]["peak_memory_mb"] = peak_memory_mb
+
+        # Clean up browser resources
+        try:
+            with tracer.span(
+                "task.cleanup", task_id=task_id, pooled=bool(browser_pool)
+            ):
+                if context and browser_pool:
+                    await browser_pool.release(context)
+                elif context:
+                    await context.close()
+                if browser:
+                    await browser.close()
+            logger.info("Browser resources for task %s cleaned up", task_id)
+        except Exception as e:
+            logger.error(
+                "Error cleaning up browser resources for task %s: %s", task_id, e
+            )
+
+
+# Structured actions supported by browser_script, with their required fields
+SCRIPT_ACTIONS: Dict[str, Tuple[str, ...]] = {
+    "navigate": ("url",),
+    "click": ("selector",),
+    "type": ("selector", "text"),
+    "wait_for": (),
+    "extract_text": (),
+    "extract_links": (),
+    "screenshot": (),
+}
+
+
+def validate_script_actions(actions: Any) -> None:
+    """
+    Validate a list of structured browser_script actions.
+
+    Raises:
+        ValueError: If the list or any action in it is malformed
+    """
+    if not isinstance(actions, list) or not actions:
+        raise ValueError("'actions' must be a non-empty list")
+
+    for index, action in enumerate(actions):
+        if not isinstance(action, dict) or "type" not in action:
+            raise ValueError(f"Action {index} must be an object with a 'type'")
+        if action["type"] not in SCRIPT_ACTIONS:
+            raise ValueError(
+                f"Unknown action type '{action['type']}' at index {index}. "
+                f"Supported types: {', '.join(SCRIPT_ACTIONS)}"
+            )
+        for field in SCRIPT_ACTIONS[action["type"]]:
+            if field not in action:
+                raise ValueError(
+                    f"Action {index} ({action['type']}) is missing required field '{field}'"
+                )
+
+
+async def execute_script_actions(
+    context: BrowserContext,
+    actions: list[Dict[str, Any]],
+    step_timeout_ms: int = CONFIG["SCRIPT_STEP_TIMEOUT_MS"],
+) -> Dict[str, Any]:
+    """
+    Run structured actions directly on a browser context, without an LLM.
+
+    Execution stops at the first failing action unless it is marked
+    "optional". The result has the same shape as an agent task result.
+
+    Args:
+        context: Browser context to run the actions in
+        actions: Validated list of actions (see SCRIPT_ACTIONS)
+        step_timeout_ms: Default timeout for each action in milliseconds
+
+    Returns:
+        Result dictionary matching the response_data of agent tasks
+    """
+    page = await context.get_current_page()
+    errors: list[str] = []
+    urls_visited: list[str] = []
+    actions_performed: list[str] = []
+    extracted_content: list[str] = []
+    screenshots: list[str] = []
+    steps_taken = 0
+    success = True
+
+    for index, action in enumerate(actions):
+        action_type = action["type"]
+        timeout = action.get("timeout_ms", step_timeout_ms)
+        selector = action.get("selector")
+        steps_taken += 1
+
+        try:
+            if action_type == "navigate":
+                await page.goto(
+                    action["url"],
+                    wait_until=action.get("wait_until", "domcontentloaded"),
+                    timeout=timeout,
+                )
+            elif action_type == "click":
+                await page.click(selector, timeout=timeout)
+            elif action_type == "type":
+                await page.fill(selector, action["text"], timeout=timeout)
+                if action.get("submit"):
+                    await page.press(selector, "Enter", timeout=timeout)
+            elif action_type == "wait_for":
+                if selector:
+                    await page.wait_for_selector(
+                        selector,
+                        state=action.get("state", "visible"),
+                        timeout=timeout,
+                    )
+                else:
+                    await page.wait_for_load_state(
+                        action.get("state", "load"), timeout=timeout
+                    )
+            elif action_type == "extract_text":
+                text = await page.inner_text(selector or "body", timeout=timeout)
+                extracted_content.append(text.strip())
+            elif action_type == "extract_links":
+                links = await page.eval_on_selector_all(
+                    f"{selector or 'body'} a[href]",
+                    "els => els.map(e => ({text: e.innerText.trim(), href: e.href}))",
+                )
+                extracted_content.append(json.dumps(links))
+            elif action_type == "screenshot":
+                image = await page.screenshot(
+                    full_page=action.get("full_page", False), timeout=timeout
+                )
+                screenshots.append(base64.b64encode(image).decode())
+
+            actions_performed.append(action_type)
+            if page.url and (not urls_visited or urls_visited[-1] != page.url):
+                urls_visited.append(page.url)
+        except Exception as e:
+            errors.append(f"Action {index} ({action_type}) failed: {str(e)}")
+            if not action.get("optional"):
+                success = False
+                break
+
+    if extracted_content:
+        final_result = extracted_content[-1]
+    elif errors:
+        final_result = errors[-1]
+    else:
+        final_result = "Script completed"
+
+    response_data = {
+        "final_result": final_result,
+        "success": success,
+        "has_errors": bool(errors),
+        "errors": errors,
+        "urls_visited": urls_visited,
+        "actions_performed": actions_performed,
+        "extracted_content": extracted_content,
+        "steps_taken": steps_taken,
+    }
+    if screenshots:
+        response_data["screenshots"] = screenshots
+    return response_data
+
+
+async def run_browser_script_async(
+    task_id: str,
+    actions: list[Dict[str, Any]],
+    browser_pool: BrowserPool,
+    window_width: int = CONFIG["DEFAULT_WINDOW_WIDTH"],
+    window_height: int = CONFIG["DEFAULT_WINDOW_HEIGHT"],
+    locale: str = CONFIG["DEFAULT_LOCALE"],
+    artifact_store: Optional[ArtifactStore] = None,
+) -> None:
+    """
+    Run a browser_script task on a pooled context and store the result.
+
+    Args:
+        task_id: Unique identifier for the task
+        actions: Validated list of structured actions
+        browser_pool: Pool to lease the browser context from
+        window_width: Browser window width
+        window_height: Browser window height
+        locale: Browser locale
+        artifact_store: Optional store for large result fields and screenshots
+    """
+    context = None
+
+    try:
+        task_store[task_id]["status"] = "running"
+        task_store[task_id]["start_time"] = datetime.now().isoformat()
+
+        started = time.monotonic()
+        context = await browser_pool.acquire(
+            window_width=window_width,
+            window_height=window_height,
+            locale=locale,
+            profile="fast",
+        )
+        response_data = await execute_script_actions(context, actions)
+        metrics.observe("script_seconds", time.monotonic() - started)
+        if artifact_store:
+            response_data = await asyncio.to_thread(
+                artifact_store.offload_result, task_id, response_data
+            )
+
+        task_store[task_id]["status"] = "completed"
+        task_store[task_id]["end_time"] = datetime.now().isoformat()
+        task_store[task_id]["result"] = response_data
+
+    except Exception as e:
+        logger.error("Error in browser script task: %s", e)
+
+        task_store[task_id]["status"] = "failed"
+        task_store[task_id]["end_time"] = datetime.now().isoformat()
+        task_store[task_id]["error"] = str(e)
+        task_store[task_id]["traceback"] = traceback.format_exc()
+
+    finally:
+        if context:
+            try:
+                await browser_pool.release(context)
+            except Exception as e:
+                logger.error(
+                    "Error releasing browser context for task %s: %s", task_id, e
+                )
+
+
+# Readability-style main content extraction, evaluated in the page
+READABILITY_SCRIPT = """
+() => {
+    const meta = name => {
+        const el = document.querySelector(`meta[name="${name}"], meta[property="${name}"]`);
+        return el ? el.getAttribute("content") : null;
+    };
+    const doc = document.body.cloneNode(true);
+    doc.querySelectorAll(
+        "script, style, noscript, template, svg, canvas, iframe, form, nav, header, footer, aside, " +
+        "[role=navigation], [role=banner], [role=contentinfo], [aria-hidden=true], [hidden]"
+    ).forEach(el => el.remove());
+
+    const textLength = el => (el.textContent || "").replace(/\\s+/g, " ").trim().length;
+    let main = doc.querySelector("article, main, [role=main]");
+    if (!main || textLength(main) < 200) {
+        // Score containers by the amount of paragraph text they hold directly
+        let best = null, bestScore = 0;
+        doc.querySelectorAll("div, section, td").forEach(el => {
+            let score = 0;
+            el.querySelectorAll(":scope > p, :scope > pre, :scope > ul, :scope > ol, :scope > h1, :scope > h2, :scope > h3")
+                .forEach(child => { score += textLength(child); });
+            if (score > bestScore) { best = el; bestScore = score; }
+        });
+        main = bestScore >= 200 ? best : doc;
+    }
+
+    const links = [];
+    const seen = new Set();
+    main.querySelectorAll("a[href]").forEach(a => {
+        if (a.href.startsWith("javascript:") || seen.has(a.href)) return;
+        seen.add(a.href);
+        links.push({text: (a.textContent || "").replace(/\\s+/g, " ").trim(), href: a.href});
+    });
+    const canonical = document.querySelector("link[rel=canonical]");
+    return {
+        title: document.title || meta("og:title"),
+        description: meta("description") || meta("og:description"),
+        lang: document.documentElement.lang || null,
+        canonical: canonical ? canonical.href : null,
+        html: main.innerHTML,
+        text: main.innerText || main.textContent || "",
+        links: links,
+    };
+}
+"""
+
+
+def _render_extraction(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn raw readability output into cleaned markdown and text (CPU bound)."""
+    import markdownify
+
+    markdown = markdownify.markdownify(raw["html"], heading_style="ATX")
+    return {
+        "markdown": re.sub(r"\n{3,}", "\n\n", markdown).strip(),
+        "text": re.sub(r"\n{3,}", "\n\n", raw["text"]).strip(),
+    }
+
+
+class ExtractionCache:
+    """
+    Content-addressed cache of browser_extract results.
+
+    URL entries hold HTTP validators and point at a content hash; extracted
+    content is stored once per hash, so pages with identical main content share
+    an entry. Entries are fresh for `ttl_seconds`; stale entries with an ETag or
+    Last-Modified validator are revalidated with a conditional request before
+    falling back to a full page load.
+    """
+
+    def __init__(self, ttl_seconds: int = 300, max_entries: int = 256):
+        """
+        Create an empty cache.
+
+        Args:
+            ttl_seconds: Seconds an entry is served without revalidation
+            max_entries: Maximum number of entries to keep (LRU eviction)
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._content: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def key(
+        url: str, wait_until: str = "load", wait_for_selector: Optional[str] = None
+    ) -> str:
+        """Cache key of an extraction; what was waited for changes its content."""
+        return json.dumps([url, wait_until, wait_for_selector])
+
+    def get(
+        self,
+        url: str,
+        wait_until: str = "load",
+        wait_for_selector: Optional[str] = None,
+    ) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """Return the (entry, content) pair cached for an extraction, if any."""
+        key = self.key(url, wait_until, wait_for_selector)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry, self._content[entry["content_hash"]]
+
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        """Whether an entry can be served without revalidation."""
+        return time.time() - entry["fetched_at"] < self.ttl_seconds
+
+    def touch(self, entry: Dict[str, Any]) -> None:
+        """Mark an entry as freshly validated."""
+        entry["fetched_at"] = time.time()
+
+    def put(
+        self,
+        url: str,
+        content: Dict[str, Any],
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        wait_until: str = "load",
+        wait_for_selector: Optional[str] = None,
+    ) -> str:
+        """
+        Store extracted content for a URL and what was waited for.
+
+        Returns:
+            The content hash the entry now points at
+        """
+        content_hash = hashlib.sha256(
+            json.dumps(content, sort_keys=True).encode()
+        ).hexdigest()
+        self._content.setdefault(content_hash, content)
+        key = self.key(url, wait_until, wait_for_selector)
+        self._entries[key] = {
+            "content_hash": content_hash,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time(),
+        }
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        # Drop content no URL points at any more
+        referenced = {entry["content_hash"] for entry in self._entries.values()}
+        for stale_hash in set(self._content) - referenced:
+            del self._content[stale_hash]
+        return content_hash
+
+    async def revalidate(self, url: str, entry: Dict[str, Any]) -> bool:
+        """
+        Check a stale entry with a conditional request.
+
+        Returns:
+            True if the server answered 304 Not Modified
+        """
+        headers = {"User-Agent": CONFIG["DEFAULT_USER_AGENT"]}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        if len(headers) == 1:
+            return False
+
+        try:
+            async with httpx.AsyncClient(follow_redirects=True, timeout=10) as client:
+                response = await client.get(url, headers=headers)
+        except httpx.HTTPError as e:
+            logger.debug("Revalidation of %s failed: %s", url, e)
+            return False
+
+        if response.status_code == 304:
+            self.touch(entry)
+            return True
+        return False
+
+
+async def extract_page(
+    url: str,
+    browser_pool: BrowserPool,
+    cache: Optional[ExtractionCache] = None,
+    output_format: str = "markdown",
+    wait_until: str = "load",
+    wait_for_selector: Optional[str] = None,
+    timeout_ms: int = CONFIG["EXTRACT_TIMEOUT_MS"],
+) -> Dict[str, Any]:
+    """
+    Load a page in a pooled context and return its cleaned main content.
+
+    No LLM is involved, so latency is bound by the page load.
+
+    Args:
+        url: URL to extract
+        browser_pool: Pool to lease the browser context from
+        cache: Optional extraction cache to serve and store results
+        output_format: "markdown" or "text"
+        wait_until: Load state to wait for (load, domcontentloaded, networkidle)
+        wait_for_selector: Optional selector that must be visible before extracting
+        timeout_ms: Timeout for loading and waiting in milliseconds
+
+    Returns:
+        Dictionary with content, links, page metadata and cache status
+    """
+    started = time.monotonic()
+    cache_status = "miss"
+    content = None
+
+    cached = cache.get(url, wait_until, wait_for_selector) if cache else None
+    if cached:
+        entry, content = cached
+        if cache.is_fresh(entry):
+            cache_status = "hit"
+        elif await cache.revalidate(url, entry):
+            cache_status = "revalidated"
+        else:
+            content = None
+
+    if content is None:
+        context = await browser_pool.acquire(profile="fast")
+        try:
+            page = await context.get_current_page()
+            response = await page.goto(url, wait_until=wait_until, timeout=timeout_ms)
+            if wait_for_selector:
+                await page.wait_for_selector(wait_for_selector, timeout=timeout_ms)
+            raw = await page.evaluate(READABILITY_SCRIPT)
+            final_url = page.url
+            status = response.status if response else None
+            headers = await response.all_headers() if response else {}
+        finally:
+            await browser_pool.release(context)
+
+        # HTML to markdown conversion is CPU bound; keep it off the event loop
+        rendered = await asyncio.to_thread(_render_extraction, raw)
+        content = {
+            "final_url": final_url,
+            "status": status,
+            "title": raw["title"],
+            "description": raw["description"],
+            "lang": raw["lang"],
+            "canonical": raw["canonical"],
+            "links": raw["links"],
+            **rendered,
+        }
+        if cache and status and status < 400:
+            cache.put(
+                url,
+                content,
+                etag=headers.get("etag"),
+                last_modified=headers.get("last-modified"),
+                wait_until=wait_until,
+                wait_for_selector=wait_for_selector,
+            )
+
+    elapsed = time.monotonic() - started
+    metrics.incr("extract_requests", cache=cache_status)
+    metrics.observe("extract_seconds", elapsed, cache=cache_status)
+
+    text_key = "text" if output_format == "text" else "markdown"
+    return {
+        "url": url,
+        "final_url": content["final_url"],
+        "status": content["status"],
+        "title": content["title"],
+        "description": content["description"],
+        "lang": content["lang"],
+        "canonical": content["canonical"],
+        "format": text_key,
+        "content": content[text_key],
+        "links": content["links"],
+        "cache": cache_status,
+        "elapsed_seconds": round(elapsed, 3),
+    }
+
+
+def cancel_task(task_id: str, reason: str = "cancelled") -> bool:
+    """
+    Cancel a pending or running task.
+
+    The task's coroutine is interrupted at its current await, its browser is
+    closed by run_browser_task_async's cleanup and its status becomes the
+    given reason.
+
+    Args:
+        task_id: Unique identifier for the task
+        reason: Final status to record, "cancelled" or "timed_out"
+
+    Batch items still waiting for their turn have no coroutine yet; they are
+    marked with the reason right away and skipped by their batch.
+
+    Returns:
+        True if the task was still active and has been cancelled
+    """
+    handle = task_handles.get(task_id)
+    task_data = task_store.get(task_id)
+    if (
+        handle is None
+        and task_data is not None
+        and task_data.get("batch_id")
+        and task_data["status"] == "pending"
+    ):
+        task_data["cancel_reason"] = reason
+        task_data["status"] = reason
+        task_data["end_time"] = datetime.now().isoformat()
+        return True
+    if handle is None or handle.done():
+        return False
+    task_store[task_id]["cancel_reason"] = reason
+    handle.cancel()
+    agent = task_agents.get(task_id)
+    if agent is not None:
+        agent.stop()
+    return True
+
+
+async def run_with_task_slot(
+    task_id: str,
+    task_slots: asyncio.Semaphore,
+    coro: Awaitable[None],
+    timeout_seconds: Optional[float] = None,
+    memory_watchdog: Optional[MemoryWatchdog] = None,
+) -> None:
+    """
+    Run a task coroutine once one of the server's task slots is free.
+
+    The task stays "pending" while it waits, including for free memory when a
+    memory watchdog is given; the time spent waiting is stored as
+    queued_seconds. Once running, the task is cancelled as "timed_out" if it
+    exceeds timeout_seconds. Cancellations through cancel_task are absorbed
+    here, so awaiting the wrapper never raises CancelledError for them.
+
+    Args:
+        task_id: Unique identifier for the task
+        task_slots: Semaphore bounding concurrently running tasks
+        coro: Task coroutine to run
+        timeout_seconds: Optional wall-clock limit once the task is running
+        memory_watchdog: Optional watchdog to wait on for memory headroom
+    """
+    current = asyncio.current_task()
+    task_handles[task_id] = current
+    queued_at = time.monotonic()
+    deadline = None
+
+    queued_at_ns = time.time_ns()
+
+    try:
+        async with task_slots:
+            if memory_watchdog:
+                await memory_watchdog.wait_for_headroom(task_id)
+            queued_seconds = time.monotonic() - queued_at
+            task_store[task_id]["queued_seconds"] = round(queued_seconds, 3)
+            metrics.observe("task_queue_seconds", queued_seconds)
+            tracer.record(
+                "task.queue",
+                queued_at_ns,
+                time.time_ns(),
+                task_id=task_id,
+                queued_seconds=round(queued_seconds, 3),
+            )
+
+            if timeout_seconds:
+                deadline = asyncio.get_running_loop().call_later(
+                    timeout_seconds, cancel_task, task_id, "timed_out"
+                )
+            with tracer.span("task.run", task_id=task_id) as span:
+                await coro
+                span.set_attribute("status", task_store[task_id]["status"])
+    except asyncio.CancelledError:
+        reason = task_store.get(task_id, {}).get("cancel_reason")
+        if reason is None:
+            # Not one of ours (e.g. server shutdown), so keep propagating
+            raise
+        if task_store[task_id]["status"] == "pending":
+            # Cancelled while waiting for a slot; the task never started
+            task_store[task_id]["status"] = reason
+            task_store[task_id]["end_time"] = datetime.now().isoformat()
+        current.uncancel()
+    finally:
+        if deadline:
+            deadline.cancel()
+        if (
+            inspect.iscoroutine(coro)
+            and inspect.getcoroutinestate(coro) == inspect.CORO_CREATED
+        ):
+            # Never started because we were cancelled in the queue
+            coro.close()
+        task_handles.pop(task_id, None)
+
+
+def summarize_batch(batch_id: str, cursor: int = 0) -> Dict[str, Any]:
+    """
+    Build the aggregated view of a batch.
+
+    Args:
+        batch_id: Batch identifier
+        cursor: Number of finished items the client has already received
+
+    Returns:
+        Batch progress counts plus the items that finished after the cursor,
+        in completion order, and the cursor to pass next time
+    """
+    batch = batch_store[batch_id]
+    counts = {"pending": 0, "running": 0, "completed": 0, "failed": 0}
+    for task_id in batch["task_ids"]:
+        if task_id in task_store:
+            status = task_store[task_id]["status"]
+        else:
+            # Items removed by cleanup keep the status they finished with
+            status = batch["statuses"].get(task_id, "expired")
+        counts[status] = counts.get(status, 0) + 1
+
+    finished = batch["finished"]
+    results = []
+    for task_id in finished[cursor:]:
+        task_data = task_store.get(task_id)
+        if task_data is None:
+            continue
+        results.append(
+            {
+                "index": task_data["batch_index"],
+                "task_id": task_id,
+                "url": task_data["url"],
+                "status": task_data["status"],
+                "result": task_data.get("result"),
+                "error": task_data.get("error"),
+            }
+        )
+
+    return {
+        "batch_id": batch_id,
+        "status": batch["status"],
+        "created_at": batch["created_at"],
+        "end_time": batch.get("end_time"),
+        "total": len(batch["task_ids"]),
+        "progress": counts,
+        "results": results,
+        "cursor": len(finished),
+    }
+
+
+async def run_browser_batch_async(
+    batch_id: str,
+    run_item: Callable[[str], Awaitable[None]],
+    max_concurrency: int,
+    on_item_done: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> None:
+    """
+    Run the items of a batch with bounded fan-out.
+
+    Items are regular tasks in task_store, so failures are recorded per item
+    and never fail the batch as a whole.
+
+    Args:
+        batch_id: Batch identifier
+        run_item: Coroutine function running one item task by task ID
+        max_concurrency: Maximum number of items of this batch running at once
+        on_item_done: Optional callback invoked with each task ID as it finishes
+    """
+    batch = batch_store[batch_id]
+    fan_out = asyncio.Semaphore(max_concurrency)
+
+    async def _run(task_id: str) -> None:
+        async with fan_out:
+            # Items cancelled while waiting for their turn are not started
+            if task_store[task_id]["status"] == "pending":
+                try:
+                    await run_item(task_id)
+                except Exception as e:
+                    # run_browser_task_async records its own errors; this is a guard
+                    logger.error("Batch %s: item %s crashed: %s", batch_id, task_id, e)
+                    task_store[task_id]["status"] = "failed"
+                    task_store[task_id]["error"] = str(e)
+                    task_store[task_id]["end_time"] = datetime.now().isoformat()
+        batch["statuses"][task_id] = task_store[task_id]["status"]
+        batch["finished"].append(task_id)
+        if on_item_done:
+            try:
+                await on_item_done(task_id)
+            except Exception as e:
+                logger.debug("Batch %s: item notification failed: %s", batch_id, e)
+
+    await asyncio.gather(*(_run(task_id) for task_id in batch["task_ids"]))
+    batch["status"] = "completed"
+    batch["end_time"] = datetime.now().isoformat()
+    logger.info("Batch %s: Completed %d items", batch_id, len(batch["task_ids"]))
+
+
+def _process_worker_main(
+    worker_id: int,
+    inbox: Any,
+    outbox: Any,
+    llm_settings: Dict[str, Any],
+) -> None:
+    """Entry point of a worker process; runs tasks on its own event loop."""
+    asyncio.run(_process_worker_loop(worker_id, inbox, outbox, llm_settings))
+
+
+async def _process_worker_loop(
+    worker_id: int,
+    inbox: Any,
+    outbox: Any,
+    llm_settings: Dict[str, Any],
+) -> None:
+    """
+    Receive tasks from the parent and report their progress and results.
+
+    Messages from the parent are ("run", task_id, task_record, kwargs),
+    ("cancel", task_id, reason) and ("stop",). Messages to the parent are
+    ("update", task_id, task_record), ("done", task_id, task_record) and
+    ("metrics", worker_id, snapshot).
+    """
+    loop = asyncio.get_running_loop()
+    llm_pool = LLMClientPool(**llm_settings)
+    storage_state_store = create_storage_state_store()
+    replay_store = ReplayScriptStore(max_scripts=CONFIG["REPLAY_MAX_SCRIPTS"])
+    interval = CONFIG["WORKER_PROGRESS_INTERVAL_SECONDS"]
+    # Admission is decided by the parent; workers only enforce the task limit
+    memory_watchdog = MemoryWatchdog(min_available_mb=0)
+    watchdog = asyncio.create_task(memory_watchdog.run())
+    artifact_store = ArtifactStore()
+    # Stalls in a worker are reported in its logs
+    loop_monitor = asyncio.create_task(EventLoopMonitor().run())
+    # Each worker keeps its own connections to the remote browsers, if any
+    browser_pool = (
+        BrowserPool(endpoints=CONFIG["BROWSER_CDP_URLS"])
+        if CONFIG["BROWSER_CDP_URLS"]
+        else None
+    )
+
+    async def report_progress(task_id: str) -> None:
+        last_sent = None
+        while True:
+            await asyncio.sleep(interval)
+            snapshot = json.dumps(task_store[task_id], sort_keys=True, default=str)
+            if snapshot != last_sent:
+                outbox.put(("update", task_id, json.loads(snapshot)))
+                last_sent = snapshot
+
+    async def run_one(task_id: str, kwargs: Dict[str, Any]) -> None:
+        replay = kwargs.pop("replay", False)
+        model = kwargs.pop("model", None)
+        planner_model = kwargs.pop("planner_model", None)
+        temperature = kwargs.pop("temperature", None)
+        # Continue the trace of the parent's task.run span
+        parent_span = Tracer.parse_traceparent(kwargs.pop("traceparent", None))
+        reporter = asyncio.create_task(report_progress(task_id))
+        try:
+            with tracer.span(
+                "worker.task", parent=parent_span, task_id=task_id, worker_id=worker_id
+            ):
+                await run_browser_task_async(
+                    task_id=task_id,
+                    llm=llm_pool.get(model, temperature),
+                    planner_llm=(
+                        llm_pool.get(planner_model, temperature)
+                        if planner_model
+                        else None
+                    ),
+                    storage_state_store=storage_state_store,
+                    replay_store=replay_store if replay else None,
+                    browser_pool=browser_pool,
+                    memory_watchdog=memory_watchdog,
+                    artifact_store=artifact_store,
+                    **kwargs,
+                )
+        except asyncio.CancelledError:
+            pass  # Status was recorded by run_browser_task_async
+        finally:
+            reporter.cancel()
+            record = json.loads(json.dumps(task_store.pop(task_id), default=str))
+            outbox.put(("done", task_id, record))
+            outbox.put(("metrics", worker_id, metrics.snapshot()))
+            task_handles.pop(task_id, None)
+
+    while True:
+        message = await loop.run_in_executor(None, inbox.get)
+        if message[0] == "run":
+            _, task_id, task_record, kwargs = message
+            task_store[task_id] = task_record
+            task_handles[task_id] = asyncio.create_task(run_one(task_id, kwargs))
+        elif message[0] == "cancel":
+            _, task_id, reason = message
+            cancel_task(task_id, reason)
+        elif message[0] == "stop":
+            for task_id in list(task_handles):
+                cancel_task(task_id, "cancelled")
+            if task_handles:
+                await asyncio.gather(*task_handles.values(), return_exceptions=True)
+            if browser_pool:
+                await browser_pool.close()
+            watchdog.cancel()
+            loop_monitor.cancel()
+            # Worker processes exit without running atexit handlers
+            tracer.shutdown()
+            break
+
+
+class ProcessTaskExecutor:
+    """
+    Runs run_browser_task_async in a pool of worker processes.
+
+    Each worker has its own event loop, LLM client and browsers, so the
+    CPU-heavy parts of agents (DOM processing, screenshot encoding, prompt
+    construction) spread across cores and keep the server's event loop free
+    for MCP traffic. Workers stream task snapshots back over a queue; a reader
+    thread applies them to the parent's task_store. Crashed workers are
+    replaced and their tasks marked failed.
+    """
+
+    def __init__(
+        self,
+        llm_settings: Dict[str, Any],
+        workers: int = CONFIG["PROCESS_WORKERS"],
+        tasks_per_worker: int = CONFIG["TASKS_PER_WORKER"],
+    ):
+        """
+        Create the executor; worker processes start with start().
+
+        Args:
+            llm_settings: Keyword arguments for create_llm in each worker
+            workers: Number of worker processes
+            tasks_per_worker: Maximum concurrent tasks per worker
+        """
+        self.llm_settings = llm_settings
+        self.workers = max(1, workers)
+        self.tasks_per_worker = max(1, tasks_per_worker)
+        self._ctx = multiprocessing.get_context("spawn")
+        self._outbox = self._ctx.Queue()
+        self._processes: list[Any] = [None] * self.workers
+        self._inboxes: list[Any] = [None] * self.workers
+        self._assignments: Dict[str, int] = {}
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._worker_metrics: Dict[int, Dict[str, Any]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._capacity: Optional[asyncio.Semaphore] = None
+        self._monitor: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def _spawn(self, worker_id: int) -> None:
+        inbox = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_process_worker_main,
+            # Every worker governs its own LLM calls, so each one enforces
+            # an equal share of the limits
+            args=(
+                worker_id,
+                inbox,
+                self._outbox,
+                {**self.llm_settings, "processes": self.workers},
+            ),
+            name=f"browser-use-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        self._inboxes[worker_id] = inbox
+        self._processes[worker_id] = process
+        logger.info("Started worker process %s (pid %s)", worker_id, process.pid)
+
+    @property
+    def capacity(self) -> int:
+        """Number of tasks the workers can run at once."""
+        return self.workers * self.tasks_per_worker
+
+    async def start(self) -> None:
+        """Start the worker processes and the result reader."""
+        self._loop = asyncio.get_running_loop()
+        self._capacity = asyncio.Semaphore(self.capacity)
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+        threading.Thread(
+            target=self._read_outbox, name="browser-use-worker-reader", daemon=True
+        ).start()
+        self._monitor = asyncio.create_task(self._monitor_workers())
+
+    def _read_outbox(self) -> None:
+        while True:
+            message = self._outbox.get()
+            if message is None:
+                return
+            self._loop.call_soon_threadsafe(self._apply, message)
+
+    def _apply(self, message: Tuple[Any, ...]) -> None:
+        kind = message[0]
+        if kind == "metrics":
+            self._worker_metrics[message[1]] = message[2]
+            return
+
+        _, task_id, record = message
+        if task_id in task_store:
+            # Keep parent-only fields such as cancel_reason
+            task_store[task_id].update(record)
+        if kind == "done":
+            self._assignments.pop(task_id, None)
+            future = self._futures.pop(task_id, None)
+            if future and not future.done():
+                future.set_result(None)
+
+    async def _monitor_workers(self) -> None:
+        while not self._stopping:
+            await asyncio.sleep(1)
+            for worker_id, process in enumerate(self._processes):
+                if process.is_alive() or self._stopping:
+                    continue
+                logger.error(
+                    "Worker process %s exited with code %s", worker_id, process.exitcode
+                )
+                for task_id, assigned in list(self._assignments.items()):
+                    if assigned != worker_id:
+                        continue
+                    self._apply(
+                        (
+                            "done",
+                            task_id,
+                            {
+                                "status": "failed",
+                                "error": "Worker process exited unexpectedly",
+                                "end_time": datetime.now().isoformat(),
+                            },
+                        )
+                    )
+                self._spawn(worker_id)
+
+    def _pick_worker(self) -> int:
+        load = [0] * self.workers
+        for worker_id in self._assignments.values():
+            load[worker_id] += 1
+        return min(range(self.workers), key=lambda worker_id: load[worker_id])
+
+    async def run(self, task_id: str, **kwargs: Any) -> None:
+        """
+        Run a task in a worker process and wait until it has finished.
+
+        Cancelling the caller forwards the cancellation (with the task's
+        cancel_reason) to the worker and waits for its cleanup report.
+
+        Args:
+            task_id: Unique identifier of a task registered in task_store
+            **kwargs: Picklable arguments for run_browser_task_async, plus
+                "replay" to use the worker's replay store
+        """
+        async with self._capacity:
+            worker_id = self._pick_worker()
+            future = self._loop.create_future()
+            self._futures[task_id] = future
+            self._assignments[task_id] = worker_id
+            self._inboxes[worker_id].put(
+                (
+                    "run",
+                    task_id,
+                    dict(task_store[task_id]),
+                    {**kwargs, "traceparent": tracer.traceparent()},
+                )
+            )
+
+            try:
+                await asyncio.shield(future)
+            except asyncio.CancelledError:
+                reason = task_store[task_id].get("cancel_reason", "cancelled")
+                self._inboxes[worker_id].put(("cancel", task_id, reason))
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), timeout=30)
+                except asyncio.TimeoutError:
+                    logger.error(
+                        "Worker %s did not confirm cancelling %s", worker_id, task_id
+                    )
+                raise
+
+    def stats(self) -> Dict[str, Any]:
+        """Return worker liveness, load and the workers' own metrics."""
+        return {
+            "workers": self.workers,
+            "tasks_per_worker": self.tasks_per_worker,
+            "alive": sum(1 for p in self._processes if p is not None and p.is_alive()),
+            "running_tasks": len(self._assignments),
+            "worker_metrics": self._worker_metrics,
+        }
+
+    async def stop(self, timeout: float = 30) -> None:
+        """Stop the workers, cancelling their tasks, and the reader thread."""
+        self._stopping = True
+        if self._monitor:
+            self._monitor.cancel()
+        for inbox in self._inboxes:
+            if inbox is not None:
+                inbox.put(("stop",))
+        for process in self._processes:
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                process.terminate()
+        self._outbox.put(None)
+
+
+class TaskStateBackend(ABC):
+    """
+    Storage for task metadata and results shared between server instances.
+
+    Each record holds a task's data together with the instance that owns it,
+    so any instance can answer for a task and knows where to forward requests
+    that need the owner (fresh progress, cancellation). Subclasses implement
+    the storage; calls are blocking and are made from a worker thread.
+    """
+
+    @abstractmethod
+    def put(
+        self,
+        task_id: str,
+        task_data: Dict[str, Any],
+        instance_id: str,
+        instance_url: Optional[str],
+    ) -> None:
+        """Insert or replace the record of a task."""
+
+    @abstractmethod
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Return a task's record as a dict with task_id, instance_id,
+        instance_url, status, updated_at and task, or None if unknown.
+        """
+
+    @abstractmethod
+    def list_finished(self) -> list[Dict[str, Any]]:
+        """Return the records of all finished tasks."""
+
+    @abstractmethod
+    def delete(self, task_ids: list[str]) -> None:
+        """Remove the records of the given tasks."""
+
+    @abstractmethod
+    def purge(self, older_than: float) -> int:
+        """Remove finished tasks last updated before a Unix timestamp."""
+
+    def close(self) -> None:
+        """Release any resources held by the backend."""
+
+
+class SQLiteTaskStateBackend(TaskStateBackend):
+    """
+    Task state backend on a SQLite database file.
+
+    Instances on the same host (or sharing a volume with working file locks)
+    point TASK_STATE_PATH at the same file. WAL mode lets readers proceed while
+    another instance writes.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open (and create if needed) the database.
+
+        Args:
+            path: Path of the SQLite database file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                "task_id TEXT PRIMARY KEY, instance_id TEXT NOT NULL, "
+                "instance_url TEXT, status TEXT NOT NULL, "
+                "updated_at REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, updated_at)"
+            )
+
+    def _record(self, row: Tuple) -> Dict[str, Any]:
+        return {
+            "task_id": row[0],
+            "instance_id": row[1],
+            "instance_url": row[2],
+            "status": row[3],
+            "updated_at": row[4],
+            "task": json.loads(row[5]),
+        }
+
+    def put(
+        self,
+        task_id: str,
+        task_data: Dict[str, Any],
+        instance_id: str,
+        instance_url: Optional[str],
+    ) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    task_id,
+                    instance_id,
+                    instance_url,
+                    task_data["status"],
+                    time.time(),
+                    json.dumps(task_data, default=str),
+                ),
+            )
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        return self._record(row) if row else None
+
+    def list_finished(self) -> list[Dict[str, Any]]:
+        placeholders = ", ".join("?" for _ in FINISHED_STATUSES)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM tasks WHERE status IN ({placeholders})",  # nosec
+                FINISHED_STATUSES,
+            ).fetchall()
+        return [self._record(row) for row in rows]
+
+    def delete(self, task_ids: list[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM tasks WHERE task_id = ?", [(t,) for t in task_ids]
+            )
+
+    def purge(self, older_than: float) -> int:
+        placeholders = ", ".join("?" for _ in FINISHED_STATUSES)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f"DELETE FROM tasks WHERE status IN ({placeholders}) "  # nosec
+                "AND updated_at < ?",
+                (*FINISHED_STATUSES, older_than),
+            )
+        return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_task_state_backend() -> Optional[TaskStateBackend]:
+    """
+    Create the shared task state backend from configuration.
+
+    Returns:
+        A TaskStateBackend, or None if TASK_STATE_BACKEND is "memory"
+
+    Raises:
+        ValueError: If the backend is not supported
+    """
+    backend = CONFIG["TASK_STATE_BACKEND"]
+    if backend == "memory":
+        return None
+    if backend == "sqlite":
+        return SQLiteTaskStateBackend(CONFIG["TASK_STATE_PATH"])
+    raise ValueError(
+        f"Unsupported task state backend: {backend}. Supported backends: memory, sqlite"
+    )
+
+
+class SharedTaskState:
+    """
+    Publishes this instance's tasks to a TaskStateBackend and answers for
+    tasks owned by other instances.
+
+    Local tasks are written to the backend when they are created or finish
+    and otherwise at most every TASK_STATE_SYNC_SECONDS while they change.
+    Lookups of unfinished remote tasks are forwarded to the owning instance
+    for fresh progress when its INSTANCE_URL is known, falling back to the
+    last published snapshot.
+    """
+
+    def __init__(
+        self,
+        backend: TaskStateBackend,
+        instance_id: str = CONFIG["INSTANCE_ID"],
+        instance_url: Optional[str] = CONFIG["INSTANCE_URL"],
+        secret: Optional[str] = CONFIG["INSTANCE_SECRET"],
+        sync_seconds: float = CONFIG["TASK_STATE_SYNC_SECONDS"],
+    ):
+        self.backend = backend
+        self.instance_id = instance_id
+        self.instance_url = instance_url.rstrip("/") if instance_url else None
+        self.secret = secret
+        self.sync_seconds = sync_seconds
+        # Digest of the last published version of each local task
+        self._published: Dict[str, str] = {}
+        self._wakeup = asyncio.Event()
+
+    def notify(self) -> None:
+        """Publish pending changes now instead of at the next sync interval."""
+        self._wakeup.set()
+
+    async def sync(self) -> int:
+        """Write local tasks that changed since they were last published."""
+        published = dict(self._published)
+        # Serialize on the loop, where no task can change halfway through
+        snapshots = {
+            task_id: json.dumps(task_data, sort_keys=True, default=str)
+            for task_id, task_data in task_store.items()
+        }
+
+        def _write() -> Dict[str, str]:
+            # Hashing and writing every task is too slow for the event loop
+            changed = {}
+            for task_id, snapshot in snapshots.items():
+                digest = hashlib.sha256(snapshot.encode()).hexdigest()
+                if published.get(task_id) != digest:
+                    self.backend.put(
+                        task_id,
+                        json.loads(snapshot),
+                        self.instance_id,
+                        self.instance_url,
+                    )
+                    changed[task_id] = digest
+            return changed
+
+        changed = await asyncio.to_thread(_write)
+        self._published.update(changed)
+
+        # Forget tasks removed by cleanup_old_tasks
+        for task_id in set(self._published) - set(task_store):
+            del self._published[task_id]
+        return len(changed)
+
+    async def run(self) -> None:
+        """Publish local task changes and purge old records until cancelled."""
+        last_purge = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.sync_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.sync()
+                if time.monotonic() - last_purge > CONFIG["CLEANUP_INTERVAL_SECONDS"]:
+                    last_purge = time.monotonic()
+                    purged = await asyncio.to_thread(
+                        self.backend.purge, time.time() - 3600
+                    )
+                    if purged:
+                        logger.info(
+                            "Purged %d old tasks from shared task state", purged
+                        )
+            except Exception as e:
+                logger.error("Error publishing task state: %s", e)
+
+    def _headers(self) -> Dict[str, str]:
+        return {"X-Instance-Secret": self.secret} if self.secret else {}
+
+    async def lookup(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Find a task owned by another instance.
+
+        Returns:
+            The task's data, or None if no instance knows it
+        """
+        record = await asyncio.to_thread(self.backend.get, task_id)
+        if record is None:
+            return None
+        task_data = record["task"]
+        if (
+            task_data["status"] not in FINISHED_STATUSES
+            and record["instance_url"]
+            and record["instance_id"] != self.instance_id
+        ):
+            try:
+                async with httpx.AsyncClient(timeout=5) as client:
+                    response = await client.get(
+                        f"{record['instance_url']}/internal/tasks/{task_id}",
+                        headers=self._headers(),
+                    )
+                if response.status_code == 200:
+                    task_data = response.json()
+                    metrics.incr("task_state_forwards", outcome="ok")
+                else:
+                    metrics.incr("task_state_forwards", outcome="error")
+            except httpx.HTTPError as e:
+                metrics.incr("task_state_forwards", outcome="error")
+                logger.warning(
+                    "Could not reach instance %s for task %s: %s",
+                    record["instance_id"],
+                    task_id,
+                    e,
+                )
+        task_data["instance_id"] = record["instance_id"]
+        return task_data
+
+    async def cancel(self, task_id: str, reason: str = "cancelled") -> Optional[bool]:
+        """
+        Ask the instance owning a task to cancel it.
+
+        Returns:
+            Whether the owner cancelled the task, or None if the task is
+            unknown or its owner cannot be reached
+        """
+        record = await asyncio.to_thread(self.backend.get, task_id)
+        if record is None:
+            return None
+        if record["task"]["status"] in FINISHED_STATUSES:
+            return False
+        if not record["instance_url"] or record["instance_id"] == self.instance_id:
+            return None
+        try:
+            async with httpx.AsyncClient(timeout=5) as client:
+                response = await client.post(
+                    f"{record['instance_url']}/internal/tasks/{task_id}/cancel",
+                    json={"reason": reason},
+                    headers=self._headers(),
+                )
+            response.raise_for_status()
+            return bool(response.json().get("cancelled"))
+        except httpx.HTTPError as e:
+            logger.warning(
+                "Could not reach instance %s to cancel task %s: %s",
+                record["instance_id"],
+                task_id,
+                e,
+            )
+            return None
+
+    def is_authorized(self, headers: Any) -> bool:
+        """
+        Check the shared secret on a request from another instance.
+
+        Without INSTANCE_SECRET, requests from other instances are refused.
+        """
+        if not self.secret:
+            return False
+        return hmac.compare_digest(headers.get("X-Instance-Secret", ""), self.secret)
+
+    def close(self) -> None:
+        self.backend.close()
+
+
+async def cleanup_old_tasks() -> None:
+    """
+    Periodically clean up old completed tasks to prevent memory leaks.
+
+    This function runs continuously in the background, removing tasks that have been
+    completed or failed for more than 1 hour to conserve memory.
+    """
+    while True:
+        try:
+            # Sleep first to avoid cleaning up tasks too early
+            await asyncio.sleep(CONFIG["CLEANUP_INTERVAL_SECONDS"])
+
+            current_time = datetime.now()
+            tasks_to_remove = []
+
+            # Find completed tasks older than 1 hour
+            for task_id, task_data in task_store.items():
+                if task_data["status"] in FINISHED_STATUSES and "end_time" in task_data:
+                    end_time = datetime.fromisoformat(task_data["end_time"])
+                    hours_elapsed = (current_time - end_time).total_seconds() / 3600
+
+                    if hours_elapsed > 1:  # Remove tasks older than 1 hour
+                        tasks_to_remove.append(task_id)
+
+            # Remove old tasks
+            for task_id in tasks_to_remove:
+                del task_store[task_id]
+
+            if tasks_to_remove:
+                logger.info("Cleaned up %d old tasks", len(tasks_to_remove))
+
+            # Remove finished batches older than 1 hour
+            batches_to_remove = [
+                batch_id
+                for batch_id, batch in batch_store.items()
+                if batch["status"] == "completed"
+                and (
+                    current_time - datetime.fromisoformat(batch["end_time"])
+                ).total_seconds()
+                > 3600
+            ]
+            for batch_id in batches_to_remove:
+                del batch_store[batch_id]
+
+        except Exception as e:
+            logger.error("Error in task cleanup: %s", e)
+
+
+def create_mcp_server(
+    llm: BaseLanguageModel,
+    task_expiry_minutes: int = CONFIG["DEFAULT_TASK_EXPIRY_MINUTES"],
+    window_width: int = CONFIG["DEFAULT_WINDOW_WIDTH"],
+    window_height: int = CONFIG["DEFAULT_WINDOW_HEIGHT"],
+    locale: str = CONFIG["DEFAULT_LOCALE"],
+    storage_state_store: Optional[StorageStateStore] = None,
+    process_executor: Optional[ProcessTaskExecutor] = None,
+    task_state: Optional[SharedTaskState] = None,
+    llm_pool: Optional[LLMClientPool] = None,
+) -> Server:
+    """
+    Create and configure an MCP server for browser interaction.
+
+    Args:
+        llm: The language model to use for browser agent
+        task_expiry_minutes: Minutes after which tasks are considered expired
+        window_width: Browser window width
+        window_height: Browser window height
+        locale: Browser locale
+        storage_state_store: Optional store of storage-state snapshots
+        process_executor: Optional executor running agent tasks in worker
+            processes instead of on this event loop
+        task_state: Optional shared task state, so that tasks can be looked up
+            and cancelled through any instance of a multi-instance deployment
+        llm_pool: Optional pool of LLM clients; enables per-task model
+            selection (model, planner_model, temperature)
+
+    Returns:
+        Configured MCP server instance
+    """
+    # Create MCP server instance
+    app = Server("browser_use")
+
+    # Warm browsers shared by scripted tasks; with remote endpoints configured
+    # this is the connection pool for every task
+    browser_pool = BrowserPool(
+        size=CONFIG["BROWSER_POOL_SIZE"],
+        chrome_path=os.environ.get("CHROME_PATH"),
+        endpoints=CONFIG["BROWSER_CDP_URLS"],
+    )
+
+    # Cache of browser_extract results
+    extraction_cache = ExtractionCache(
+        ttl_seconds=CONFIG["EXTRACT_CACHE_TTL_SECONDS"],
+        max_entries=CONFIG["EXTRACT_CACHE_MAX_ENTRIES"],
+    )
+
+    # Scripts compiled from successful agent runs
+    replay_store = ReplayScriptStore(max_scripts=CONFIG["REPLAY_MAX_SCRIPTS"])
+
+    # Bounds the number of browser tasks running at once, across all tools;
+    # worker processes are sized by the executor instead of MAX_CONCURRENT_TASKS
+    max_concurrent_tasks = (
+        process_executor.capacity
+        if process_executor
+        else CONFIG["MAX_CONCURRENT_TASKS"]
+    )
+    task_slots = asyncio.Semaphore(max_concurrent_tasks)
+
+    # Holds back new tasks when memory is short and stops runaway browsers
+    memory_watchdog = MemoryWatchdog()
+
+    # Reports calls that block the event loop
+    loop_monitor = EventLoopMonitor()
+
+    # Large result fields and screenshots, kept out of the task records
+    artifact_store = ArtifactStore()
+
+    # Counts created tasks, for PROFILE_EVERY_N_TASKS
+    task_counter = itertools.count(1)
+    if CONFIG["PROFILE_EVERY_N_TASKS"] and not StackSampler.can_profile_tasks:
+        logger.warning(
+            "PROFILE_EVERY_N_TASKS is ignored: profiling tasks requires Python 3.12"
+        )
+
+    # Set by drain() once the server is shutting down
+    app.draining = False
+
+    # Running batches by batch ID, for drain() to wait on
+    batch_handles: Dict[str, asyncio.Task] = {}
+
+    async def drain(grace_seconds: float = CONFIG["DRAIN_GRACE_SECONDS"]) -> None:
+        """
+        Stop taking new tasks and let the ones in flight finish.
+
+        Tasks still running (or queued) after grace_seconds are cancelled, which
+        closes their browsers. Results stay readable until the process exits.
+        """
+        app.draining = True
+        logger.info(
+            "Draining %d tasks, waiting up to %gs", len(task_handles), grace_seconds
+        )
+
+        # Batch items still waiting for their turn are not started
+        for task_id, task_data in list(task_store.items()):
+            if task_data.get("batch_id") and task_id not in task_handles:
+                if cancel_task(task_id, "cancelled"):
+                    task_data["error"] = "Server shut down before the task started"
+                    metrics.incr("tasks_cancelled_on_shutdown")
+
+        deadline = time.monotonic() + grace_seconds
+        while (task_handles or batch_handles) and time.monotonic() < deadline:
+            await asyncio.wait(
+                [*task_handles.values(), *batch_handles.values()],
+                timeout=deadline - time.monotonic(),
+            )
+
+        if task_handles:
+            logger.warning("Cancelling %d tasks left after draining", len(task_handles))
+            for task_id in list(task_handles):
+                task_store[task_id]["error"] = (
+                    "Server shut down before the task finished"
+                )
+                cancel_task(task_id, "cancelled")
+                metrics.incr("tasks_cancelled_on_shutdown")
+            await asyncio.wait(list(task_handles.values()), timeout=30)
+        if batch_handles:
+            await asyncio.wait(list(batch_handles.values()), timeout=30)
+        logger.info("Drained")
+
+    # Learns task run times to tell clients when to expect results
+    duration_estimator = TaskDurationEstimator()
+
+    async def seed_duration_estimator() -> None:
+        """Learn run times from the finished tasks in the shared task state."""
+        records = await asyncio.to_thread(task_state.backend.list_finished)
+        for record in records:
+            duration_estimator.record(record["task"])
+
+    def estimate_task(task_data: Dict[str, Any]) -> Dict[str, float]:
+        """Estimate the time left for a task, given the tasks queued before it."""
+        tasks_ahead = sum(
+            1
+            for other in list(task_store.values())
+            if other["status"] == "running"
+            or (
+                other["status"] == "pending"
+                and other["created_at"] < task_data["created_at"]
+            )
+        )
+        return duration_estimator.estimate(task_data, tasks_ahead, max_concurrent_tasks)
+
+    def create_browser_task(
+        arguments: Dict[str, Any], defaults: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        Validate browser_use arguments and register a pending task.
+
+        Args:
+            arguments: browser_use arguments (url, action and optional settings)
+            defaults: Fallback values for optional settings, e.g. from a batch
+
+        Returns:
+            The new task ID
+
+        Raises:
+            ValueError: If required arguments are missing or invalid
+        """
+        defaults = defaults or {}
+        if "url" not in arguments:
+            raise ValueError("Missing required argument 'url'")
+        if "action" not in arguments:
+            raise ValueError("Missing required argument 'action'")
+        profile = (
+            arguments.get("profile")
+            or defaults.get("profile")
+            or CONFIG["EXECUTION_PROFILE"]
+        ).lower()
+        if profile not in EXECUTION_PROFILES:
+            raise ValueError(
+                f"Unknown profile: {profile}. Supported profiles: {', '.join(EXECUTION_PROFILES)}"
+            )
+
+        # Per-task models; creating the clients up front surfaces bad names
+        model_settings = {
+            key: arguments.get(key, defaults.get(key))
+            for key in ("model", "planner_model", "temperature")
+        }
+        if any(value is not None for value in model_settings.values()):
+            if llm_pool is None:
+                raise ValueError(
+                    "Per-task model selection is not enabled on this server"
+                )
+            try:
+                llm_pool.get(model_settings["model"], model_settings["temperature"])
+                if model_settings["planner_model"]:
+                    llm_pool.get(
+                        model_settings["planner_model"], model_settings["temperature"]
+                    )
+            except ImportError as e:
+                raise ValueError(str(e))
+
+        try:
+            screenshots = screenshot_settings(
+                arguments.get("screenshots", defaults.get("screenshots", "none")),
+                arguments.get("screenshot_options", defaults.get("screenshot_options")),
+            )
+        except ImportError as e:
+            raise ValueError(str(e))
+
+        # Generate a task ID
+        task_id = str(uuid.uuid4())
+
+        # Initialize task in store
+        task_store[task_id] = {
+            "id": task_id,
+            "status": "pending",
+            "url": arguments["url"],
+            "action": arguments["action"],
+            "profile": profile,
+            "credential_label": arguments.get("credential_label")
+            or defaults.get("credential_label")
+            or "default",
+            "replay": arguments.get(
+                "replay", defaults.get("replay", CONFIG["REPLAY_SCRIPTS"])
+            ),
+            "timeout_seconds": max(
+                0.0,
+                float(
+                    arguments.get(
+                        "timeout_seconds",
+                        defaults.get("timeout_seconds", CONFIG["TASK_TIMEOUT_SECONDS"]),
+                    )
+                ),
+            )
+            or None,
+            "max_tokens_budget": int(
+                arguments.get(
+                    "max_tokens_budget",
+                    defaults.get("max_tokens_budget", CONFIG["TASK_MAX_TOKENS_BUDGET"]),
+                )
+            )
+            or None,
+            **model_settings,
+            "screenshots": screenshots,
+            "profiling": bool(
+                CONFIG["PROFILE_EVERY_N_TASKS"]
+                and StackSampler.can_profile_tasks
+                and next(task_counter) % CONFIG["PROFILE_EVERY_N_TASKS"] == 0
+            ),
+            "created_at": datetime.now().isoformat(),
+        }
+        tracer.annotate(task_id=task_id)
+        if task_state:
+            task_state.notify()
+        return task_id
+
+    def start_browser_task(task_id: str) -> asyncio.Task:
+        """Schedule a registered task in the background, subject to task slots."""
+        handle = asyncio.create_task(
+            run_with_task_slot(
+                task_id,
+                task_slots,
+                run_browser_task(task_id),
+                timeout_seconds=task_store[task_id]["timeout_seconds"],
+                memory_watchdog=memory_watchdog,
+            )
+        )
+        handle.add_done_callback(
+            lambda _: duration_estimator.record(task_store.get(task_id))
+        )
+        if task_state:
+            # Publish the result right away rather than at the next sync
+            handle.add_done_callback(lambda _: task_state.notify())
+        return handle
+
+    async def run_browser_task(task_id: str) -> None:
+        """Run a task registered by create_browser_task."""
+        task_data = task_store[task_id]
+        if process_executor:
+            await process_executor.run(
+                task_id,
+                url=task_data["url"],
+                action=task_data["action"],
+                window_width=window_width,
+                window_height=window_height,
+                locale=locale,
+                credential_label=task_data["credential_label"],
+                profile=task_data["profile"],
+                replay=task_data["replay"],
+                model=task_data["model"],
+                planner_model=task_data["planner_model"],
+                temperature=task_data["temperature"],
+                screenshots=task_data["screenshots"],
+            )
+            return
+
+        task_llm = llm
+        planner_llm = None
+        if llm_pool:
+            if task_data["model"] or task_data["temperature"] is not None:
+                task_llm = llm_pool.get(task_data["model"], task_data["temperature"])
+            if task_data["planner_model"]:
+                planner_llm = llm_pool.get(
+                    task_data["planner_model"], task_data["temperature"]
+                )
+
+        await run_browser_task_async(
+            task_id=task_id,
+            url=task_data["url"],
+            action=task_data["action"],
+            llm=task_llm,
+            planner_llm=planner_llm,
+            window_width=window_width,
+            window_height=window_height,
+            locale=locale,
+            storage_state_store=storage_state_store,
+            credential_label=task_data["credential_label"],
+            profile=task_data["profile"],
+            replay_store=replay_store if task_data["replay"] else None,
+            browser_pool=browser_pool if browser_pool.endpoints else None,
+            memory_watchdog=memory_watchdog,
+            artifact_store=artifact_store,
+            screenshots=task_data["screenshots"],
+        )
+
+    async def screenshot_contents(
+        task_data: Dict[str, Any],
+    ) -> list[types.ImageContent]:
+        """
+        Return the screenshots of a finished task as images.
+
+        Screenshots over SCREENSHOT_INLINE_MAX_BYTES, and those no longer (or
+        not) on this host's disk, are left as artifact references in the result.
+        """
+        result = task_data.get("result") or {}
+        references = [result["screenshot"]] if result.get("screenshot") else []
+        references += [
+            reference
+            for reference in result.get("screenshots") or []
+            if isinstance(reference, dict)
+        ]
+
+        def load(reference: Dict[str, Any]) -> Tuple[str, str]:
+            data, mime_type = artifact_store.read(
+                reference["artifact"], 0, reference["size"]
+            )
+            return base64.b64encode(data).decode(), mime_type
+
+        contents = []
+        for reference in references:
+            if reference["size"] > CONFIG["SCREENSHOT_INLINE_MAX_BYTES"]:
+                continue
+            try:
+                data, mime_type = await asyncio.to_thread(load, reference)
+            except FileNotFoundError:
+                continue
+            contents.append(
+                types.ImageContent(type="image", data=data, mimeType=mime_type)
+            )
+        return contents
+
+    async def handle_tool_call(
+        name: str, arguments: dict
+    ) -> list[Union[types.TextContent, types.ImageContent, types.EmbeddedResource]]:
+        """
+        Handle tool calls from the MCP client.
+
+        Args:
+            name: The name of the tool to call
+            arguments: The arguments to pass to the tool
+
+        Returns:
+            A list of content objects to return to the client.
+            When PATIENT_MODE is enabled, the browser_use tool will wait for the task to complete
+            and return the full result immediately instead of just the task ID.
 
         Raises:
             ValueError: If required arguments are missing
         """
+        # While draining for shutdown, finish what is running but start nothing
+        if app.draining and name in (
+            "browser_use",
+            "browser_use_batch",
+            "browser_script",
+            "browser_extract",
+        ):
+            metrics.incr("drain_rejects")
+            return [
+                types.TextContent(
+                    type="text",
+                    text=json.dumps(
+                        {"error": "Server is shutting down; retry on another instance"},
+                        indent=2,
+                    ),
+                )
+            ]
+
+        # With MEMORY_ADMISSION=reject, refuse new work instead of queueing it
+        if (
+            name in ("browser_use", "browser_use_batch")
+            and CONFIG["MEMORY_ADMISSION"] == "reject"
+            and not memory_watchdog.has_headroom()
+        ):
+            metrics.incr("memory_admission_rejects")
+            return [
+                types.TextContent(
+                    type="text",
+                    text=json.dumps(
+                        {
+                            "error": "Server is low on memory; retry later",
+                            "available_memory_mb": round(memory_watchdog.available_mb),
+                            "required_memory_mb": memory_watchdog.min_available_mb,
+                        },
+                        indent=2,
+                    ),
+                )
+            ]
+
         # Handle browser_use tool
         if name == "browser_use":
-            # Check required arguments
-            if "url" not in arguments:
-                raise ValueError("Missing required argument 'url'")
-            if "action" not in arguments:
-                raise ValueError("Missing required argument 'action'")
+            task_id = create_browser_task(arguments)
 
-            # Generate a task ID
-            task_id = str(uuid.uuid4())
+            # Start task in background
+            _task = start_browser_task(task_id)
 
-            # Initialize task in store
-            task_store[task_id] = {
-                "id": task_id,
-                "status": "pending",
-                "url": arguments["url"],
-                "action": arguments["action"],
+            # If PATIENT is set, wait for the task to complete
+            if CONFIG["PATIENT_MODE"]:
+                try:
+                    await _task
+                    # Return the completed task result instead of just the ID
+                    task_data = task_store[task_id]
+                    if task_data["status"] == "failed":
+                        logger.error(
+                            "Task %s failed: %s",
+                            task_id,
+                            task_data.get("error", "Unknown error"),
+                        )
+                    return [
+                        types.TextContent(
+                            type="text",
+                            text=json.dumps(task_data, indent=2),
+                        ),
+                        *await screenshot_contents(task_data),
+                    ]
+                except Exception as e:
+                    logger.error("Error in patient mode execution: %s", e)
+                    traceback_str = traceback.format_exc()
+                    # Update task store with error
+                    task_store[task_id]["status"] = "failed"
+                    task_store[task_id]["error"] = str(e)
+                    task_store[task_id]["traceback"] = traceback_str
+                    task_store[task_id]["end_time"] = datetime.now().isoformat()
+                    # Return error information
+                    return [
+                        types.TextContent(
+                            type="text",
+                            text=json.dumps(task_store[task_id], indent=2),
+                        )
+                    ]
+
+            # Return task ID immediately with explicit sleep instruction
+            estimate = estimate_task(task_store[task_id])
+            wait = estimate["poll_after_seconds"]
+            return [
+                types.TextContent(
+                    type="text",
+                    text=json.dumps(
+                        {
+                            "task_id": task_id,
+                            "status": "pending",
+                            "message": f"Browser task started. It should take about {estimate['estimated_seconds']} seconds. Please wait for {wait} seconds, then check the result using browser_get_result or the resource URI, which will suggest when to check next.",
+                            "estimated_time": f"{estimate['estimated_seconds']} seconds",
+                            **estimate,
+                            "resource_uri": f"resource://browser_task/{task_id}",
+                            "sleep_command": f"sleep {wait}",
+                            "instruction": f"Use the terminal command 'sleep {wait}' to wait {wait} seconds before checking the status.",
+                        },
+                        indent=2,
+                    ),
+                )
+            ]
+
+        # Handle browser_use_batch tool
+        elif name == "browser_use_batch":
+            items = arguments.get("items")
+            if not isinstance(items, list) or not items:
+                raise ValueError("Missing required argument 'items'")
+            if len(items) > CONFIG["BATCH_MAX_ITEMS"]:
+                raise ValueError(
+                    f"Too many items: {len(items)}. Maximum is {CONFIG['BATCH_MAX_ITEMS']}"
+                )
+            max_concurrency = max(
+                1,
+                min(
+                    int(
+                        arguments.get(
+                            "max_concurrency", CONFIG["BATCH_MAX_CONCURRENCY"]
+                        )
+                    ),
+                    max_concurrent_tasks,
+                ),
+            )
+
+            batch_id = str(uuid.uuid4())
+            defaults = {
+                key: arguments[key]
+                for key in (
+                    "profile",
+                    "credential_label",
+                    "replay",
+                    "timeout_seconds",
+                    "max_tokens_budget",
+                    "model",
+                    "planner_model",
+                    "temperature",
+                    "screenshots",
+                    "screenshot_options",
+                )
+                if key in arguments
+            }
+
+            # Validate every item before registering any of them
+            for index, item in enumerate(items):
+                if not isinstance(item, dict):
+                    raise ValueError(
+                        f"Item {index} must be an object with url and action"
+                    )
+            task_ids = []
+            for index, item in enumerate(items):
+                try:
+                    task_id = create_browser_task(item, defaults)
+                except ValueError as e:
+                    for created in task_ids:
+                        del task_store[created]
+                    raise ValueError(f"Item {index}: {str(e)}")
+                task_store[task_id]["batch_id"] = batch_id
+                task_store[task_id]["batch_index"] = index
+                task_ids.append(task_id)
+
+            batch_store[batch_id] = {
+                "id": batch_id,
+                "status": "running",
                 "created_at": datetime.now().isoformat(),
+                "task_ids": task_ids,
+                "finished": [],
+                # Final status of each finished item, kept after its task expires
+                "statuses": {},
             }
 
-            # Start task in background
-            _task = asyncio.create_task(
-                run_browser_task_async(
-                    task_id=task_id,
-                    url=arguments["url"],
-                    action=arguments["action"],
-                    llm=llm,
-                    window_width=window_width,
-                    window_height=window_height,
-                    locale=locale,
+            # Stream each item's result to the client as it finishes
+            session = app.request_context.session
+            meta = app.request_context.meta
+            progress_token = meta.progressToken if meta else None
+
+            async def on_item_done(task_id: str) -> None:
+                batch = batch_store[batch_id]
+                task_data = task_store[task_id]
+                await session.send_log_message(
+                    level="info",
+                    data={
+                        "batch_id": batch_id,
+                        "index": task_data["batch_index"],
+                        "task_id": task_id,
+                        "status": task_data["status"],
+                        "result": task_data.get("result"),
+                        "error": task_data.get("error"),
+                    },
+                    logger="browser_use_batch",
+                )
+                if progress_token is not None:
+                    await session.send_progress_notification(
+                        progress_token, len(batch["finished"]), len(task_ids)
+                    )
+
+            _batch = asyncio.create_task(
+                run_browser_batch_async(
+                    batch_id=batch_id,
+                    # Each item is its own asyncio task so it can be cancelled alone
+                    run_item=start_browser_task,
+                    max_concurrency=max_concurrency,
+                    on_item_done=on_item_done,
+                )
+            )
+            batch_handles[batch_id] = _batch
+            _batch.add_done_callback(lambda _: batch_handles.pop(batch_id, None))
+
+            if CONFIG["PATIENT_MODE"]:
+                await _batch
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=json.dumps(summarize_batch(batch_id), indent=2),
+                    )
+                ]
+
+            return [
+                types.TextContent(
+                    type="text",
+                    text=json.dumps(
+                        {
+                            "batch_id": batch_id,
+                            "status": "running",
+                            "total": len(task_ids),
+                            "task_ids": task_ids,
+                            "message": f"Batch of {len(task_ids)} browser tasks started with up to {max_concurrency} running at once. Item results are streamed as log notifications; poll browser_get_batch with the returned cursor to collect them.",
+                            "resource_uri": f"resource://browser_batch/{batch_id}",
+                        },
+                        indent=2,
+                    ),
                 )
-            )
+            ]
 
-            # If PATIENT is set, wait for the task to complete
-            if CONFIG["PATIENT_MODE"]:
-                try:
-                    await _task
-                    # Return the completed task result instead of just the ID
-                    task_data = task_store[task_id]
-                    if task_data["status"] == "failed":
-                        logger.error(
-                            f"Task {task_id} failed: {task_data.get('error', 'Unknown error')}"
-                        )
+        # Handle browser_cancel tool
+        elif name == "browser_cancel":
+            if "task_id" in arguments:
+                task_ids = [arguments["task_id"]]
+                if task_ids[0] not in task_store and task_state:
+                    # Owned by another instance; forward the cancel to it
+                    cancelled = await task_state.cancel(task_ids[0])
+                    if cancelled is not None:
+                        return [
+                            types.TextContent(
+                                type="text",
+                                text=json.dumps(
+                                    {
+                                        "cancelled": task_ids if cancelled else [],
+                                        "already_finished": []
+                                        if cancelled
+                                        else task_ids,
+                                    },
+                                    indent=2,
+                                ),
+                            )
+                        ]
+                if task_ids[0] not in task_store:
                     return [
                         types.TextContent(
                             type="text",
-                            text=json.dumps(task_data, indent=2),
+                            text=json.dumps(
+                                {"error": "Task not found", "task_id": task_ids[0]},
+                                indent=2,
+                            ),
                         )
                     ]
-                except Exception as e:
-                    logger.error(f"Error in patient mode execution: {str(e)}")
-                    traceback_str = traceback.format_exc()
-                    # Update task store with error
-                    task_store[task_id]["status"] = "failed"
-                    task_store[task_id]["error"] = str(e)
-                    task_store[task_id]["traceback"] = traceback_str
-                    task_store[task_id]["end_time"] = datetime.now().isoformat()
-                    # Return error information
+            elif "batch_id" in arguments:
+                if arguments["batch_id"] not in batch_store:
                     return [
                         types.TextContent(
                             type="text",
-                            text=json.dumps(task_store[task_id], indent=2),
+                            text=json.dumps(
+                                {
+                                    "error": "Batch not found",
+                                    "batch_id": arguments["batch_id"],
+                                },
+                                indent=2,
+                            ),
                         )
                     ]
+                task_ids = batch_store[arguments["batch_id"]]["task_ids"]
+            else:
+                raise ValueError("Missing required argument 'task_id' or 'batch_id'")
 
-            # Return task ID immediately with explicit sleep instruction
+            cancelled = [task_id for task_id in task_ids if cancel_task(task_id)]
+            # Let the cancelled tasks run their cleanup before reporting back
+            await asyncio.sleep(0)
             return [
                 types.TextContent(
                     type="text",
                     text=json.dumps(
                         {
-                            "task_id": task_id,
-                            "status": "pending",
-                            "message": f"Browser task started. Please wait for {CONFIG['DEFAULT_ESTIMATED_TASK_SECONDS']} seconds, then check the result using browser_get_result or the resource URI. Always wait exactly 5 seconds between status checks.",
-                            "estimated_time": f"{CONFIG['DEFAULT_ESTIMATED_TASK_SECONDS']} seconds",
-                            "resource_uri": f"resource://browser_task/{task_id}",
-                            "sleep_command": "sleep 5",
-                            "instruction": "Use the terminal command 'sleep 5' to wait 5 seconds between status checks. IMPORTANT: Always use exactly 5 seconds, no more and no less.",
+                            "cancelled": cancelled,
+                            "already_finished": [
+                                task_id
+                                for task_id in task_ids
+                                if task_id not in cancelled
+                            ],
                         },
                         indent=2,
                     ),
                 )
             ]
 
+        # Handle browser_get_batch tool
+        elif name == "browser_get_batch":
+            if "batch_id" not in arguments:
+                raise ValueError("Missing required argument 'batch_id'")
+            batch_id = arguments["batch_id"]
+            if batch_id not in batch_store:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=json.dumps(
+                            {"error": "Batch not found", "batch_id": batch_id}, indent=2
+                        ),
+                    )
+                ]
+            return [
+                types.TextContent(
+                    type="text",
+                    text=json.dumps(
+                        summarize_batch(batch_id, int(arguments.get("cursor", 0))),
+                        indent=2,
+                    ),
+                )
+            ]
+
+        # Handle browser_script tool
+        elif name == "browser_script":
+            if "actions" not in arguments:
+                raise ValueError("Missing required argument 'actions'")
+            actions = arguments["actions"]
+            validate_script_actions(actions)
+
+            task_id = str(uuid.uuid4())
+            first_url = next(
+                (a["url"] for a in actions if a["type"] == "navigate"), None
+            )
+            task_store[task_id] = {
+                "id": task_id,
+                "status": "pending",
+                "url": first_url,
+                "action": f"browser_script ({len(actions)} actions)",
+                "created_at": datetime.now().isoformat(),
+            }
+
+            # Scripts are short, so they always run to completion before returning
+            await run_browser_script_async(
+                task_id=task_id,
+                actions=actions,
+                browser_pool=browser_pool,
+                window_width=window_width,
+                window_height=window_height,
+                locale=locale,
+                artifact_store=artifact_store,
+            )
+            if task_state:
+                task_state.notify()
+            return [
+                types.TextContent(
+                    type="text", text=json.dumps(task_store[task_id], indent=2)
+                ),
+                *await screenshot_contents(task_store[task_id]),
+            ]
+
+        # Handle browser_extract tool
+        elif name == "browser_extract":
+            if "url" not in arguments:
+                raise ValueError("Missing required argument 'url'")
+            output_format = arguments.get("format", "markdown")
+            if output_format not in ("markdown", "text"):
+                raise ValueError(
+                    f"Unsupported format: {output_format}. Supported formats: markdown, text"
+                )
+
+            try:
+                result = await extract_page(
+                    url=arguments["url"],
+                    browser_pool=browser_pool,
+                    cache=extraction_cache
+                    if arguments.get("use_cache", True)
+                    else None,
+                    output_format=output_format,
+                    wait_until=arguments.get("wait_until", "load"),
+                    wait_for_selector=arguments.get("wait_for_selector"),
+                    timeout_ms=arguments.get(
+                        "timeout_ms", CONFIG["EXTRACT_TIMEOUT_MS"]
+                    ),
+                )
+            except Exception as e:
+                logger.error("Error extracting %s: %s", arguments["url"], e)
+                result = {"url": arguments["url"], "error": str(e)}
+
+            return [types.TextContent(type="text", text=json.dumps(result, indent=2))]
+
         # Handle browser_get_result tool
         elif name == "browser_get_result":
             # Get result of async task
@@ -747,7 +5675,12 @@ def create_mcp_server(
 
             task_id = arguments["task_id"]
 
-            if task_id not in task_store:
+            # Tasks started through another instance are found via shared state
+            task_data = task_store.get(task_id)
+            if task_data is None and task_state:
+                task_data = await task_state.lookup(task_id)
+
+            if task_data is None:
                 return [
                     types.TextContent(
                         type="text",
@@ -758,40 +5691,61 @@ def create_mcp_server(
                 ]
 
             # Get the current task data
-            task_data = task_store[task_id].copy()
+            task_data = task_data.copy()
 
-            # If task is still running, add simple guidance
-            if task_data["status"] == "running":
-                # Add a simple next check suggestion
+            # If task is not finished yet, suggest when to check again
+            if task_data["status"] in ("pending", "running"):
+                estimate = estimate_task(task_data)
+                wait = estimate["poll_after_seconds"]
                 progress = task_data.get("progress", {})
                 current_step = progress.get("current_step", 0)
 
-                if current_step > 0:
-                    # Simple message based on current step
-                    task_data["message"] = (
-                        f"Task is running (step {current_step}). Wait 5 seconds before checking again."
-                    )
-                    task_data["sleep_command"] = "sleep 5"
-                    task_data["instruction"] = (
-                        "Use the terminal command 'sleep 5' to wait 5 seconds before checking again. IMPORTANT: Always use exactly 5 seconds, no more and no less."
-                    )
+                if task_data["status"] == "pending":
+                    state = "Task is queued"
+                elif current_step > 0:
+                    state = f"Task is running (step {current_step})"
                 else:
-                    task_data["message"] = (
-                        "Task is starting. Wait 5 seconds before checking again."
-                    )
-                    task_data["sleep_command"] = "sleep 5"
-                    task_data["instruction"] = (
-                        "Use the terminal command 'sleep 5' to wait 5 seconds before checking again. IMPORTANT: Always use exactly 5 seconds, no more and no less."
-                    )
+                    state = "Task is starting"
+                task_data["message"] = (
+                    f"{state}, about {estimate['estimated_seconds']} seconds left. Wait {wait} seconds before checking again."
+                )
+                task_data["estimated_time"] = f"{estimate['estimated_seconds']} seconds"
+                task_data.update(estimate)
+                task_data["sleep_command"] = f"sleep {wait}"
+                task_data["instruction"] = (
+                    f"Use the terminal command 'sleep {wait}' to wait {wait} seconds before checking again."
+                )
 
             # Return current task status and result if available
             return [
-                types.TextContent(type="text", text=json.dumps(task_data, indent=2))
+                types.TextContent(type="text", text=json.dumps(task_data, indent=2)),
+                *await screenshot_contents(task_data),
             ]
 
         else:
             raise ValueError(f"Unknown tool: {name}")
 
+    @app.call_tool()
+    async def call_tool(
+        name: str, arguments: dict
+    ) -> list[Union[types.TextContent, types.ImageContent, types.EmbeddedResource]]:
+        """
+        Trace a tool call and handle it with handle_tool_call.
+
+        A W3C traceparent in the request's _meta makes the call (and the tasks
+        it starts) part of the client's trace.
+        """
+        try:
+            meta = app.request_context.meta
+        except LookupError:
+            meta = None
+        with tracer.span(
+            "tool.call",
+            parent=Tracer.parse_traceparent(getattr(meta, "traceparent", None)),
+            tool=name,
+        ):
+            return await handle_tool_call(name, arguments)
+
     @app.list_tools()
     async def list_tools() -> list[types.Tool]:
         """
@@ -806,75 +5760,327 @@ def create_mcp_server(
         """
         patient_mode = CONFIG["PATIENT_MODE"]
 
+        screenshot_options_schema = {
+            "type": "object",
+            "description": "Screenshot encoding (defaults to the server's)",
+            "properties": {
+                "format": {
+                    "type": "string",
+                    "enum": list(SCREENSHOT_FORMATS),
+                    "description": f"Image format (defaults to {CONFIG['SCREENSHOT_FORMAT']})",
+                },
+                "quality": {
+                    "type": "integer",
+                    "description": f"JPEG/WebP quality from 1 to 100 (defaults to {CONFIG['SCREENSHOT_QUALITY']})",
+                },
+                "max_width": {
+                    "type": "integer",
+                    "description": "Scale the image down to at most this width (0 means no limit)",
+                },
+                "max_height": {
+                    "type": "integer",
+                    "description": "Scale the image down to at most this height (0 means no limit)",
+                },
+                "full_page": {
+                    "type": "boolean",
+                    "description": "Capture the whole scrollable page instead of the viewport",
+                },
+            },
+        }
+
+        # The browser_use schema is shared; only the descriptions depend on mode
+        browser_use_schema = {
+            "type": "object",
+            "required": ["url", "action"],
+            "properties": {
+                "url": {
+                    "type": "string",
+                    "description": "URL to navigate to",
+                },
+                "action": {
+                    "type": "string",
+                    "description": "Action to perform in the browser",
+                },
+                "credential_label": {
+                    "type": "string",
+                    "description": "Label of the saved login session to reuse for the target domain (defaults to 'default')",
+                },
+                "replay": {
+                    "type": "boolean",
+                    "description": f"Try a script compiled from an earlier successful run of the same task before starting the LLM agent (defaults to {str(CONFIG['REPLAY_SCRIPTS']).lower()})",
+                },
+                "timeout_seconds": {
+                    "type": "number",
+                    "description": f"Wall-clock limit for the task once it starts running; it is stopped and marked timed_out when exceeded (defaults to {CONFIG['TASK_TIMEOUT_SECONDS']}, 0 disables)",
+                },
+                "profile": {
+                    "type": "string",
+                    "enum": list(EXECUTION_PROFILES),
+                    "description": f"Execution profile trading speed for accuracy (defaults to '{CONFIG['EXECUTION_PROFILE']}'). 'fast' disables element highlighting and vision and trims the DOM state",
+                },
+                "model": {
+                    "type": "string",
+                    "description": "Model that carries out the steps, as 'model' or 'provider/model' (e.g. 'gpt-4o-mini', 'anthropic/claude-3-5-haiku-latest'); defaults to the server's model",
+                },
+                "planner_model": {
+                    "type": "string",
+                    "description": "Optional stronger model that plans the next steps, in the same format as model",
+                },
+                "temperature": {
+                    "type": "number",
+                    "description": "Sampling temperature for the task's models (defaults to the server's)",
+                },
+                "max_tokens_budget": {
+                    "type": "integer",
+                    "description": f"LLM tokens the task may use; the agent stops after the step that exhausts them and returns what it has (defaults to {CONFIG['TASK_MAX_TOKENS_BUDGET']}, 0 means no limit)",
+                },
+                "screenshots": {
+                    "type": "string",
+                    "enum": ["none", "final", "steps"],
+                    "description": "Screenshots to take: none (default), the page the task ended on (returned as an image with the result), or also the page at each step (kept as artifacts referenced from the progress)",
+                },
+                "screenshot_options": screenshot_options_schema,
+            },
+        }
+        browser_script_tool = types.Tool(
+            name="browser_script",
+            description="Runs an ordered list of structured browser actions directly, without an LLM, and returns the result. Use it when every step is known in advance",
+            inputSchema={
+                "type": "object",
+                "required": ["actions"],
+                "properties": {
+                    "actions": {
+                        "type": "array",
+                        "description": "Actions to run in order. Execution stops at the first failing action unless it sets optional=true",
+                        "items": {
+                            "type": "object",
+                            "required": ["type"],
+                            "properties": {
+                                "type": {
+                                    "type": "string",
+                                    "enum": list(SCRIPT_ACTIONS),
+                                },
+                                "url": {
+                                    "type": "string",
+                                    "description": "URL for navigate",
+                                },
+                                "selector": {
+                                    "type": "string",
+                                    "description": "CSS selector for click/type/wait_for, or scope for extract_text/extract_links",
+                                },
+                                "text": {
+                                    "type": "string",
+                                    "description": "Text for type",
+                                },
+                                "submit": {
+                                    "type": "boolean",
+                                    "description": "Press Enter after type",
+                                },
+                                "state": {
+                                    "type": "string",
+                                    "description": "Element state (visible, attached, hidden) for wait_for with a selector, or load state (load, domcontentloaded, networkidle) without one",
+                                },
+                                "full_page": {
+                                    "type": "boolean",
+                                    "description": "Capture the full page for screenshot",
+                                },
+                                "timeout_ms": {"type": "integer"},
+                                "optional": {
+                                    "type": "boolean",
+                                    "description": "Continue with the next action if this one fails",
+                                },
+                            },
+                        },
+                    }
+                },
+            },
+        )
+        browser_extract_tool = types.Tool(
+            name="browser_extract",
+            description="Loads a page and returns its cleaned main content as markdown or text with links and metadata, without an LLM. Use it for 'read this page' requests",
+            inputSchema={
+                "type": "object",
+                "required": ["url"],
+                "properties": {
+                    "url": {
+                        "type": "string",
+                        "description": "URL to extract",
+                    },
+                    "format": {
+                        "type": "string",
+                        "enum": ["markdown", "text"],
+                        "description": "Output format (defaults to markdown)",
+                    },
+                    "wait_until": {
+                        "type": "string",
+                        "enum": ["load", "domcontentloaded", "networkidle"],
+                        "description": "Page readiness condition to wait for (defaults to load)",
+                    },
+                    "wait_for_selector": {
+                        "type": "string",
+                        "description": "CSS selector that must be visible before extracting",
+                    },
+                    "timeout_ms": {
+                        "type": "integer",
+                        "description": "Timeout for loading and waiting in milliseconds",
+                    },
+                    "use_cache": {
+                        "type": "boolean",
+                        "description": "Serve and store results in the extraction cache (defaults to true)",
+                    },
+                },
+            },
+        )
+        batch_tools = [
+            types.Tool(
+                name="browser_use_batch",
+                description="Runs the same kind of browser task on many URLs with bounded concurrency and returns a batch ID. Item results are streamed as they finish and can be collected with browser_get_batch",
+                inputSchema={
+                    "type": "object",
+                    "required": ["items"],
+                    "properties": {
+                        "items": {
+                            "type": "array",
+                            "description": f"Up to {CONFIG['BATCH_MAX_ITEMS']} tasks, each with a url and action",
+                            "items": {
+                                "type": "object",
+                                "required": ["url", "action"],
+                                "properties": {
+                                    "url": {"type": "string"},
+                                    "action": {"type": "string"},
+                                    "profile": {
+                                        "type": "string",
+                                        "enum": list(EXECUTION_PROFILES),
+                                    },
+                                    "credential_label": {"type": "string"},
+                                    "model": {"type": "string"},
+                                },
+                            },
+                        },
+                        "max_concurrency": {
+                            "type": "integer",
+                            "description": f"Maximum items of this batch running at once (defaults to {CONFIG['BATCH_MAX_CONCURRENCY']}, capped by the server-wide task limit)",
+                        },
+                        "profile": {
+                            "type": "string",
+                            "enum": list(EXECUTION_PROFILES),
+                            "description": "Default execution profile for items",
+                        },
+                        "credential_label": {
+                            "type": "string",
+                            "description": "Default saved login session label for items",
+                        },
+                        "replay": {
+                            "type": "boolean",
+                            "description": "Default replay setting for items",
+                        },
+                        "timeout_seconds": {
+                            "type": "number",
+                            "description": "Wall-clock limit for each item once it starts running",
+                        },
+                        "model": {
+                            "type": "string",
+                            "description": "Default model for items ('model' or 'provider/model')",
+                        },
+                        "planner_model": {
+                            "type": "string",
+                            "description": "Default planner model for items",
+                        },
+                        "temperature": {
+                            "type": "number",
+                            "description": "Default sampling temperature for items",
+                        },
+                        "max_tokens_budget": {
+                            "type": "integer",
+                            "description": "LLM token budget for each item",
+                        },
+                        "screenshots": {
+                            "type": "string",
+                            "enum": ["none", "final", "steps"],
+                            "description": "Default screenshots for items",
+                        },
+                        "screenshot_options": screenshot_options_schema,
+                    },
+                },
+            ),
+            types.Tool(
+                name="browser_cancel",
+                description="Cancels a pending or running browser task, or all unfinished items of a batch, and releases their browsers",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "task_id": {
+                            "type": "string",
+                            "description": "ID of the task to cancel",
+                        },
+                        "batch_id": {
+                            "type": "string",
+                            "description": "ID of the batch whose unfinished items to cancel",
+                        },
+                    },
+                },
+            ),
+            types.Tool(
+                name="browser_get_batch",
+                description="Gets aggregated progress of a browser task batch and the item results that finished since the given cursor",
+                inputSchema={
+                    "type": "object",
+                    "required": ["batch_id"],
+                    "properties": {
+                        "batch_id": {
+                            "type": "string",
+                            "description": "ID of the batch",
+                        },
+                        "cursor": {
+                            "type": "integer",
+                            "description": "Cursor returned by the previous call; omit to get all finished items",
+                        },
+                    },
+                },
+            ),
+        ]
+        get_result_schema = {
+            "type": "object",
+            "required": ["task_id"],
+            "properties": {
+                "task_id": {
+                    "type": "string",
+                    "description": "ID of the task to get results for",
+                }
+            },
+        }
+
         if patient_mode:
             return [
                 types.Tool(
                     name="browser_use",
                     description="Performs a browser action and returns the complete result directly (patient mode active)",
-                    inputSchema={
-                        "type": "object",
-                        "required": ["url", "action"],
-                        "properties": {
-                            "url": {
-                                "type": "string",
-                                "description": "URL to navigate to",
-                            },
-                            "action": {
-                                "type": "string",
-                                "description": "Action to perform in the browser",
-                            },
-                        },
-                    },
+                    inputSchema=browser_use_schema,
                 ),
                 types.Tool(
                     name="browser_get_result",
                     description="Gets the result of an asynchronous browser task (not needed in patient mode as browser_use returns complete results directly)",
-                    inputSchema={
-                        "type": "object",
-                        "required": ["task_id"],
-                        "properties": {
-                            "task_id": {
-                                "type": "string",
-                                "description": "ID of the task to get results for",
-                            }
-                        },
-                    },
+                    inputSchema=get_result_schema,
                 ),
+                browser_script_tool,
+                browser_extract_tool,
+                *batch_tools,
             ]
         else:
             return [
                 types.Tool(
                     name="browser_use",
                     description="Performs a browser action and returns a task ID for async execution",
-                    inputSchema={
-                        "type": "object",
-                        "required": ["url", "action"],
-                        "properties": {
-                            "url": {
-                                "type": "string",
-                                "description": "URL to navigate to",
-                            },
-                            "action": {
-                                "type": "string",
-                                "description": "Action to perform in the browser",
-                            },
-                        },
-                    },
+                    inputSchema=browser_use_schema,
                 ),
                 types.Tool(
                     name="browser_get_result",
                     description="Gets the result of an asynchronous browser task",
-                    inputSchema={
-                        "type": "object",
-                        "required": ["task_id"],
-                        "properties": {
-                            "task_id": {
-                                "type": "string",
-                                "description": "ID of the task to get results for",
-                            }
-                        },
-                    },
+                    inputSchema=get_result_schema,
                 ),
+                browser_script_tool,
+                browser_extract_tool,
+                *batch_tools,
             ]
 
     @app.list_resources()
@@ -888,7 +6094,7 @@ def create_mcp_server(
         # List all completed tasks as resources
         resources = []
         for task_id, task_data in task_store.items():
-            if task_data["status"] in ["completed", "failed"]:
+            if task_data["status"] in FINISHED_STATUSES:
                 resources.append(
                     types.Resource(
                         uri=f"resource://browser_task/{task_id}",
@@ -896,10 +6102,24 @@ def create_mcp_server(
                         description=f"Result of browser task for URL: {task_data.get('url', 'unknown')}",
                     )
                 )
+
+        # Include finished tasks of the other instances
+        if task_state:
+            records = await asyncio.to_thread(task_state.backend.list_finished)
+            for record in records:
+                if record["task_id"] in task_store:
+                    continue
+                resources.append(
+                    types.Resource(
+                        uri=f"resource://browser_task/{record['task_id']}",
+                        title=f"Browser Task Result: {record['task_id'][:8]}",
+                        description=f"Result of browser task for URL: {record['task'].get('url', 'unknown')}",
+                    )
+                )
         return resources
 
     @app.read_resource()
-    async def read_resource(uri: str) -> list[types.ResourceContents]:
+    async def read_resource(uri: AnyUrl) -> list[ReadResourceContents]:
         """
         Read a resource for the MCP client.
 
@@ -909,39 +6129,126 @@ def create_mcp_server(
         Returns:
             The contents of the resource
         """
+        # Artifacts are read in chunks: artifact://<task>/<name>?offset=&length=
+        if str(uri).startswith("artifact://"):
+            query = parse_qs(urlparse(str(uri)).query)
+            try:
+                offset = int(query.get("offset", ["0"])[0])
+                length = int(
+                    query.get("length", [str(CONFIG["ARTIFACT_CHUNK_BYTES"])])[0]
+                )
+                chunk, mime_type = await asyncio.to_thread(
+                    artifact_store.read,
+                    str(uri).split("?", 1)[0],
+                    max(0, offset),
+                    min(max(1, length), CONFIG["ARTIFACT_CHUNK_BYTES"]),
+                )
+            except (FileNotFoundError, ValueError):
+                raise ValueError(f"Artifact not found: {uri}")
+            return [ReadResourceContents(content=chunk, mime_type=mime_type)]
+
+        # Batches are served as their aggregated view
+        uri = str(uri)
+        if uri.startswith("resource://browser_batch/"):
+            batch_id = uri.replace("resource://browser_batch/", "")
+            if batch_id not in batch_store:
+                return [
+                    ReadResourceContents(
+                        content=json.dumps(
+                            {"error": f"Batch not found: {batch_id}"}, indent=2
+                        ),
+                        mime_type="application/json",
+                    )
+                ]
+            return [
+                ReadResourceContents(
+                    content=json.dumps(summarize_batch(batch_id), indent=2),
+                    mime_type="application/json",
+                )
+            ]
+
         # Extract task ID from URI
         if not uri.startswith("resource://browser_task/"):
             return [
-                types.ResourceContents(
-                    type="text",
-                    text=json.dumps(
+                ReadResourceContents(
+                    content=json.dumps(
                         {"error": f"Invalid resource URI: {uri}"}, indent=2
                     ),
+                    mime_type="application/json",
                 )
             ]
 
         task_id = uri.replace("resource://browser_task/", "")
-        if task_id not in task_store:
+        task_data = task_store.get(task_id)
+        if task_data is None and task_state:
+            task_data = await task_state.lookup(task_id)
+        if task_data is None:
             return [
-                types.ResourceContents(
-                    type="text",
-                    text=json.dumps({"error": f"Task not found: {task_id}"}, indent=2),
+                ReadResourceContents(
+                    content=json.dumps(
+                        {"error": f"Task not found: {task_id}"}, indent=2
+                    ),
+                    mime_type="application/json",
                 )
             ]
 
         # Return task data
         return [
-            types.ResourceContents(
-                type="text", text=json.dumps(task_store[task_id], indent=2)
+            ReadResourceContents(
+                content=json.dumps(task_data, indent=2), mime_type="application/json"
             )
         ]
 
     # Add cleanup_old_tasks function to app for later scheduling
     app.cleanup_old_tasks = cleanup_old_tasks
+    # Expose the browser pool and executor so they can be managed on startup/shutdown
+    app.browser_pool = browser_pool
+    app.process_executor = process_executor
+    app.max_concurrent_tasks = max_concurrent_tasks
+    app.task_state = task_state
+    app.memory_watchdog = memory_watchdog
+    app.loop_monitor = loop_monitor
+    app.duration_estimator = duration_estimator
+    app.seed_duration_estimator = seed_duration_estimator
+    app.artifact_store = artifact_store
+    app.drain = drain
+    app.llm_pool = llm_pool
 
     return app
 
 
+class DrainingServer(uvicorn.Server):
+    """
+    uvicorn server that drains tasks before shutting down.
+
+    The first SIGTERM/SIGINT runs drain() while the server keeps handling
+    requests, so clients can still collect results (new work is refused); the
+    usual shutdown follows once it returns. A second signal shuts down at once.
+    Signals are only handled when the server runs in the main thread.
+    """
+
+    def __init__(self, config: uvicorn.Config, drain: Callable[[], Awaitable[None]]):
+        super().__init__(config)
+        self.drain = drain
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._draining: Optional[asyncio.Future] = None
+
+    async def serve(self, sockets: Optional[list] = None) -> None:
+        self._loop = asyncio.get_running_loop()
+        await super().serve(sockets)
+
+    def handle_exit(self, sig: int, frame: Any) -> None:
+        if self._loop is None or self._draining is not None or self.should_exit:
+            super().handle_exit(sig, frame)
+            return
+        logger.info("Received %s, draining before shutdown", signal.Signals(sig).name)
+        self._loop.call_soon_threadsafe(self._start_drain)
+
+    def _start_drain(self) -> None:
+        self._draining = asyncio.ensure_future(self.drain())
+        self._draining.add_done_callback(lambda _: setattr(self, "should_exit", True))
+
+
 @click.command()
 @click.option("--port", default=8000, help="Port to listen on for SSE")
 @click.option(
@@ -1000,6 +6307,52 @@ def create_mcp_server(
     type=float,
     help="Temperature setting for the LLM model",
 )
+@click.option(
+    "--profile",
+    default=CONFIG["EXECUTION_PROFILE"],
+    type=click.Choice(list(EXECUTION_PROFILES), case_sensitive=False),
+    help="Default execution profile for browser tasks (fast, default, accurate)",
+)
+@click.option(
+    "--execution-mode",
+    default=CONFIG["EXECUTION_MODE"],
+    type=click.Choice(["inline", "process"], case_sensitive=False),
+    help="Run agent tasks on the server event loop (inline) or in worker processes (process)",
+)
+@click.option(
+    "--workers",
+    default=CONFIG["PROCESS_WORKERS"],
+    type=int,
+    help="Number of worker processes in process execution mode",
+)
+@click.option(
+    "--tasks-per-worker",
+    default=CONFIG["TASKS_PER_WORKER"],
+    type=int,
+    help="Maximum concurrent tasks per worker process",
+)
+@click.option(
+    "--task-state-backend",
+    default=CONFIG["TASK_STATE_BACKEND"],
+    type=click.Choice(["memory", "sqlite"], case_sensitive=False),
+    help="Where task state is kept; sqlite shares it between instances",
+)
+@click.option(
+    "--instance-url",
+    default=CONFIG["INSTANCE_URL"],
+    help="URL other instances use to reach this one for forwarded requests",
+)
+@click.option(
+    "--browser-cdp-urls",
+    default=None,
+    help="Comma-separated CDP endpoints of remote browsers to run tasks in",
+)
+@click.option(
+    "--browser-mode",
+    default=CONFIG["BROWSER_MODE"],
+    type=click.Choice(list(BROWSER_MODES), case_sensitive=False),
+    help="How local browsers run: headless (headless shell), headless-full or headed (needs a display)",
+)
 def main(
     port: int,
     proxy_port: Optional[int],
@@ -1014,6 +6367,14 @@ def main(
     llm_api_key: Optional[str],
     llm_base_url: Optional[str],
     llm_temperature: float,
+    profile: str,
+    execution_mode: str,
+    workers: int,
+    tasks_per_worker: int,
+    task_state_backend: str,
+    instance_url: Optional[str],
+    browser_cdp_urls: Optional[str],
+    browser_mode: str,
 ) -> int:
     """
     Run the browser-use MCP server.
@@ -1044,6 +6405,14 @@ def main(
         llm_api_key: API key for the LLM provider
         llm_base_url: Base URL for the LLM provider
         llm_temperature: Temperature setting for the LLM model
+        profile: Default execution profile for browser tasks
+        execution_mode: "inline" or "process"
+        workers: Number of worker processes in process execution mode
+        tasks_per_worker: Maximum concurrent tasks per worker process
+        task_state_backend: "memory" or a backend shared between instances
+        instance_url: URL other instances use to reach this one
+        browser_cdp_urls: Comma-separated CDP endpoints of remote browsers
+        browser_mode: How local browsers run (see BROWSER_MODES)
 
     Returns:
         Exit code (0 for success)
@@ -1051,28 +6420,110 @@ def main(
     # Store Chrome path in environment variable if provided
     if chrome_path:
         os.environ["CHROME_PATH"] = chrome_path
-        logger.info(f"Using Chrome path: {chrome_path}")
+        logger.info("Using Chrome path: %s", chrome_path)
     else:
         logger.info(
             "No Chrome path specified, letting Playwright use its default browser"
         )
 
+    # Use remote browsers instead of launching them; the environment variable
+    # carries the setting into worker processes
+    if browser_cdp_urls:
+        os.environ["BROWSER_CDP_URLS"] = browser_cdp_urls
+        CONFIG["BROWSER_CDP_URLS"] = [
+            url.strip() for url in browser_cdp_urls.split(",") if url.strip()
+        ]
+    if CONFIG["BROWSER_CDP_URLS"]:
+        logger.info("Using remote browsers: %s", ", ".join(CONFIG["BROWSER_CDP_URLS"]))
+    else:
+        # Like BROWSER_CDP_URLS, the environment variable reaches the workers
+        CONFIG["BROWSER_MODE"] = browser_mode.lower()
+        os.environ["BROWSER_MODE"] = CONFIG["BROWSER_MODE"]
+        logger.info(
+            "Browser mode: %s (%s)",
+            CONFIG["BROWSER_MODE"],
+            BROWSER_MODES[CONFIG["BROWSER_MODE"]],
+        )
+        if (
+            CONFIG["BROWSER_MODE"] == "headed"
+            and sys.platform.startswith("linux")
+            and not os.environ.get("DISPLAY")
+        ):
+            logger.warning("Browser mode is headed but DISPLAY is not set")
+
+    # Apply the server-wide execution profile; calls may still override it
+    CONFIG["EXECUTION_PROFILE"] = profile.lower()
+    logger.info("Default execution profile: %s", CONFIG["EXECUTION_PROFILE"])
+
     # Initialize LLM with user-specified provider and options
     try:
-        llm = create_llm(
+        llm_pool = LLMClientPool(
             provider=llm_provider,
             model=llm_model,
             api_key=llm_api_key,
             base_url=llm_base_url,
             temperature=llm_temperature,
         )
-        logger.info(f"Initialized LLM provider: {llm_provider}")
+        llm = llm_pool.get()
+        logger.info("Initialized LLM provider: %s", llm_provider)
         if llm_model:
-            logger.info(f"Using model: {llm_model}")
+            logger.info("Using model: %s", llm_model)
+    except (ValueError, ImportError) as e:
+        logger.error("Failed to initialize LLM: %s", e)
+        return 1
+
+    # Initialize the storage-state snapshot store if configured
+    try:
+        storage_state_store = create_storage_state_store()
+        if storage_state_store:
+            logger.info(
+                "Storage-state snapshots enabled in %s", storage_state_store.directory
+            )
     except (ValueError, ImportError) as e:
-        logger.error(f"Failed to initialize LLM: {str(e)}")
+        logger.error("Failed to initialize storage-state store: %s", e)
+        return 1
+
+    # Share task state with other instances if configured
+    CONFIG["TASK_STATE_BACKEND"] = task_state_backend.lower()
+    task_state = None
+    try:
+        backend = create_task_state_backend()
+        if backend:
+            if instance_url and not CONFIG["INSTANCE_SECRET"]:
+                # The internal routes refuse requests without a shared secret
+                logger.warning(
+                    "INSTANCE_URL is ignored without INSTANCE_SECRET; other "
+                    "instances will not forward lookups and cancels to this one"
+                )
+                instance_url = None
+            task_state = SharedTaskState(backend, instance_url=instance_url)
+            logger.info(
+                "Sharing task state via %s as instance %s",
+                CONFIG["TASK_STATE_BACKEND"],
+                task_state.instance_id,
+            )
+    except (ValueError, sqlite3.Error) as e:
+        logger.error("Failed to initialize task state backend: %s", e)
         return 1
 
+    # Run agents in worker processes if requested; each worker builds its own LLM
+    process_executor = None
+    if execution_mode.lower() == "process":
+        process_executor = ProcessTaskExecutor(
+            llm_settings={
+                "provider": llm_provider,
+                "model": llm_model,
+                "api_key": llm_api_key,
+                "base_url": llm_base_url,
+                "temperature": llm_temperature,
+            },
+            workers=workers,
+            tasks_per_worker=tasks_per_worker,
+        )
+        logger.info(
+            "Process execution mode: %s workers x %s tasks", workers, tasks_per_worker
+        )
+
     # Create MCP server
     app = create_mcp_server(
         llm=llm,
@@ -1080,6 +6531,10 @@ def main(
         window_width=window_width,
         window_height=window_height,
         locale=locale,
+        storage_state_store=storage_state_store,
+        process_executor=process_executor,
+        task_state=task_state,
+        llm_pool=llm_pool,
     )
 
     sse = SseServerTransport("/messages/")
@@ -1095,13 +6550,236 @@ def main(
                     streams[0], streams[1], app.create_initialization_options()
                 )
         except Exception as e:
-            logger.error(f"Error in handle_sse: {str(e)}")
+            logger.error("Error in handle_sse: %s", e)
             raise
 
+    async def handle_metrics(request):
+        """Expose server metrics as JSON."""
+        task_counts: Dict[str, int] = {}
+        for task_data in list(task_store.values()):
+            task_counts[task_data["status"]] = (
+                task_counts.get(task_data["status"], 0) + 1
+            )
+        return JSONResponse(
+            {
+                **metrics.snapshot(),
+                "tasks": task_counts,
+                "browser_pool": app.browser_pool.stats(),
+                "process_executor": (
+                    app.process_executor.stats() if app.process_executor else None
+                ),
+                "llm_clients": app.llm_pool.stats() if app.llm_pool else None,
+                "task_durations": app.duration_estimator.stats(),
+                "log_queue_depth": log_queue.qsize(),
+                "event_loop": app.loop_monitor.stats(),
+                "artifacts": await asyncio.to_thread(app.artifact_store.stats),
+                "llm_governors": {
+                    name: governor.stats() for name, governor in llm_governors.items()
+                },
+            }
+        )
+
+    async def handle_healthz(request):
+        """Liveness: the process is up and serving requests."""
+        return JSONResponse({"status": "ok"})
+
+    async def handle_readyz(request):
+        """
+        Readiness: whether this instance should get new work, with its capacity.
+
+        Returns 503 while tasks are queued or running at the configured limits,
+        memory is short, remote browsers are all unreachable or worker
+        processes are all gone.
+        """
+        running = queued = 0
+        for task_data in list(task_store.values()):
+            if task_data["status"] == "running":
+                running += 1
+            elif task_data["status"] == "pending":
+                queued += 1
+
+        reasons = []
+        if app.draining:
+            reasons.append("draining")
+        if (
+            CONFIG["READY_MAX_QUEUED_TASKS"]
+            and queued >= CONFIG["READY_MAX_QUEUED_TASKS"]
+        ):
+            reasons.append("queue_full")
+        if (
+            CONFIG["READY_MAX_RUNNING_TASKS"]
+            and running >= CONFIG["READY_MAX_RUNNING_TASKS"]
+        ):
+            reasons.append("busy")
+        if not app.memory_watchdog.has_headroom():
+            reasons.append("low_memory")
+        if app.browser_pool.endpoints and not app.browser_pool.endpoints_up():
+            reasons.append("browsers_unreachable")
+        workers_alive = None
+        if app.process_executor:
+            workers_alive = app.process_executor.stats()["alive"]
+            if not workers_alive:
+                reasons.append("no_workers")
+
+        available_mb = app.memory_watchdog.available_mb
+        pool_stats = app.browser_pool.stats()
+        capacity = {
+            "running_tasks": running,
+            "queued_tasks": queued,
+            "max_concurrent_tasks": app.max_concurrent_tasks,
+            "free_slots": max(0, app.max_concurrent_tasks - running),
+            "available_memory_mb": round(available_mb) if available_mb else None,
+            "min_available_memory_mb": app.memory_watchdog.min_available_mb,
+            "browsers": pool_stats["browsers"],
+            "active_contexts": pool_stats["active_contexts"],
+            "browser_endpoints_up": (
+                app.browser_pool.endpoints_up() if app.browser_pool.endpoints else None
+            ),
+            "workers_alive": workers_alive,
+            "average_task_seconds": app.duration_estimator.stats()["average_seconds"],
+        }
+        return JSONResponse(
+            {"ready": not reasons, "reasons": reasons, "capacity": capacity},
+            status_code=503 if reasons else 200,
+        )
+
+    async def handle_internal_task(request):
+        """Serve a local task to another instance."""
+        if not task_state or not task_state.is_authorized(request.headers):
+            return JSONResponse({"error": "Forbidden"}, status_code=403)
+        task_id = request.path_params["task_id"]
+        if task_id not in task_store:
+            return JSONResponse({"error": "Task not found"}, status_code=404)
+        return JSONResponse(json.loads(json.dumps(task_store[task_id], default=str)))
+
+    async def handle_internal_cancel(request):
+        """Cancel a local task on behalf of another instance."""
+        if not task_state or not task_state.is_authorized(request.headers):
+            return JSONResponse({"error": "Forbidden"}, status_code=403)
+        task_id = request.path_params["task_id"]
+        if task_id not in task_store:
+            return JSONResponse({"error": "Task not found"}, status_code=404)
+        body = await request.json()
+        reason = body.get("reason", "cancelled")
+        cancelled = cancel_task(task_id, reason)
+        await asyncio.sleep(0)
+        return JSONResponse({"cancelled": cancelled})
+
+    def is_admin(request) -> bool:
+        """Check the admin token on a request; admin routes are off without one."""
+        if not CONFIG["ADMIN_TOKEN"]:
+            return False
+        return hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {CONFIG['ADMIN_TOKEN']}"
+        )
+
+    profile_lock = asyncio.Lock()
+
+    async def handle_admin_profile(request):
+        """
+        Profile the server for a number of seconds, or mark a task for profiling.
+
+        Query parameters: seconds (default 10), format ("pstats" from cProfile,
+        or "collapsed" stacks from sampling the event loop thread) and task_id
+        (profile that pending task's run instead; the profile's path is stored
+        in the task as "profile_path").
+        """
+        if not is_admin(request):
+            return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+        task_id = request.query_params.get("task_id")
+        if task_id:
+            if not StackSampler.can_profile_tasks:
+                return JSONResponse(
+                    {"error": "Profiling a single task requires Python 3.12 or later"},
+                    status_code=501,
+                )
+            if task_id not in task_store:
+                return JSONResponse({"error": "Task not found"}, status_code=404)
+            if task_store[task_id]["status"] != "pending":
+                return JSONResponse(
+                    {"error": "Only tasks that have not started can be profiled"},
+                    status_code=409,
+                )
+            task_store[task_id]["profiling"] = True
+            return JSONResponse({"task_id": task_id, "profiling": True})
+
+        try:
+            seconds = float(request.query_params.get("seconds", 10))
+        except ValueError:
+            return JSONResponse({"error": "Invalid seconds"}, status_code=400)
+        seconds = min(max(seconds, 0.1), CONFIG["PROFILE_MAX_SECONDS"])
+        output_format = request.query_params.get("format", "pstats")
+        if output_format not in ("pstats", "collapsed"):
+            return JSONResponse(
+                {"error": "Unsupported format. Supported formats: pstats, collapsed"},
+                status_code=400,
+            )
+        if profile_lock.locked():
+            return JSONResponse(
+                {"error": "A profile is already running"}, status_code=409
+            )
+
+        async with profile_lock:
+            name = f"server-{datetime.now():%Y%m%d-%H%M%S}.{output_format}"
+            if output_format == "pstats":
+                profiler = cProfile.Profile()
+                try:
+                    profiler.enable()
+                except ValueError as e:
+                    # Another profiler (e.g. a debugger) is active
+                    return JSONResponse({"error": str(e)}, status_code=409)
+                try:
+                    await asyncio.sleep(seconds)
+                finally:
+                    profiler.disable()
+                profiler.create_stats()
+                data = marshal.dumps(profiler.stats)
+            else:
+                sampler = StackSampler(threading.get_ident())
+                sampler.start()
+                try:
+                    await asyncio.sleep(seconds)
+                finally:
+                    data = sampler.stop().encode()
+            path = await asyncio.to_thread(save_profile, name, data)
+
+        logger.info("Saved a %.0fs %s profile to %s", seconds, output_format, path)
+        return Response(
+            data,
+            media_type="application/octet-stream",
+            headers={
+                "Content-Disposition": f'attachment; filename="{name}"',
+                "X-Profile-Path": path,
+            },
+        )
+
+    async def handle_admin_profile_file(request):
+        """Download a saved profile, e.g. one recorded for a task."""
+        if not is_admin(request):
+            return JSONResponse({"error": "Forbidden"}, status_code=403)
+        path = os.path.join(
+            CONFIG["PROFILE_DIR"], os.path.basename(request.path_params["name"])
+        )
+        if not os.path.isfile(path):
+            return JSONResponse({"error": "Profile not found"}, status_code=404)
+        return FileResponse(path, filename=os.path.basename(path))
+
     starlette_app = Starlette(
         debug=True,
         routes=[
             Route("/sse", endpoint=handle_sse),
+            Route("/metrics", endpoint=handle_metrics),
+            Route("/healthz", endpoint=handle_healthz),
+            Route("/readyz", endpoint=handle_readyz),
+            Route("/internal/tasks/{task_id}", endpoint=handle_internal_task),
+            Route(
+                "/internal/tasks/{task_id}/cancel",
+                endpoint=handle_internal_cancel,
+                methods=["POST"],
+            ),
+            Route("/admin/profile", endpoint=handle_admin_profile, methods=["POST"]),
+            Route("/admin/profiles/{name}", endpoint=handle_admin_profile_file),
             Mount("/messages/", app=sse.handle_post_message),
         ],
     )
@@ -1114,57 +6792,95 @@ def main(
 
         # Sanity checks for critical configuration
         if port <= 0 or port > 65535:
-            logger.error(f"Invalid port number: {port}")
+            logger.error("Invalid port number: %s", port)
             raise ValueError(f"Invalid port number: {port}")
 
         if window_width <= 0 or window_height <= 0:
-            logger.error(f"Invalid window dimensions: {window_width}x{window_height}")
+            logger.error(
+                "Invalid window dimensions: %sx%s", window_width, window_height
+            )
             raise ValueError(
                 f"Invalid window dimensions: {window_width}x{window_height}"
             )
 
         if task_expiry_minutes <= 0:
-            logger.error(f"Invalid task expiry minutes: {task_expiry_minutes}")
+            logger.error("Invalid task expiry minutes: %s", task_expiry_minutes)
             raise ValueError(f"Invalid task expiry minutes: {task_expiry_minutes}")
 
         # Start background task cleanup
         asyncio.create_task(app.cleanup_old_tasks())
         logger.info("Task cleanup process scheduled")
 
+        if app.process_executor:
+            await app.process_executor.start()
+
+        asyncio.create_task(app.memory_watchdog.run())
+        asyncio.create_task(app.loop_monitor.run())
+
+        if app.task_state:
+            await app.seed_duration_estimator()
+            asyncio.create_task(app.task_state.run())
+            logger.info("Task state publishing scheduled")
+
+    @starlette_app.on_event("shutdown")
+    async def shutdown_event():
+        """Release pooled browsers on shutdown."""
+        await app.browser_pool.close()
+        logger.info("Browser pool closed")
+
+        if app.process_executor:
+            await app.process_executor.stop()
+            logger.info("Worker processes stopped")
+
+        if app.task_state:
+            # Publish the final state of local tasks before leaving
+            await app.task_state.sync()
+            app.task_state.close()
+
     # Function to run uvicorn in a separate thread
     def run_uvicorn():
-        # Configure uvicorn to use JSON logging
+        # Configure uvicorn to log through the same queue, so access lines
+        # are written in JSON by the background writer thread
         log_config = {
             "version": 1,
             "disable_existing_loggers": False,
-            "formatters": {
-                "json": {
-                    "()": "pythonjsonlogger.jsonlogger.JsonFormatter",
-                    "fmt": '{"time":"%(asctime)s","level":"%(levelname)s","name":"%(name)s","message":"%(message)s"}',
-                }
-            },
             "handlers": {
                 "default": {
-                    "formatter": "json",
-                    "class": "logging.StreamHandler",
-                    "stream": "ext://sys.stderr",
+                    "()": lambda: log_handler,
                 }
             },
             "loggers": {
                 "": {"handlers": ["default"], "level": "INFO"},
-                "uvicorn": {"handlers": ["default"], "level": "INFO"},
-                "uvicorn.error": {"handlers": ["default"], "level": "INFO"},
-                "uvicorn.access": {"handlers": ["default"], "level": "INFO"},
+                # Without propagate=False each uvicorn record is also handled
+                # by its parents' handlers and queued two or three times
+                "uvicorn": {
+                    "handlers": ["default"],
+                    "level": "INFO",
+                    "propagate": False,
+                },
+                "uvicorn.error": {
+                    "handlers": ["default"],
+                    "level": "INFO",
+                    "propagate": False,
+                },
+                "uvicorn.access": {
+                    "handlers": ["default"],
+                    "level": "INFO",
+                    "propagate": False,
+                },
             },
         }
 
-        uvicorn.run(
+        config = uvicorn.Config(
             starlette_app,
             host="0.0.0.0",  # nosec
             port=port,
             log_config=log_config,
             log_level="info",
+            # SSE streams never end on their own, so don't wait long for them
+            timeout_graceful_shutdown=5,
         )
+        DrainingServer(config, drain=app.drain).run()
 
     # If proxy mode is enabled, run both the SSE server and mcp-proxy
     if stdio:
@@ -1187,9 +6903,9 @@ def main(
             "*",
         ]
 
-        logger.info(f"Running proxy command: {' '.join(proxy_cmd)}")
+        logger.info("Running proxy command: %s", " ".join(proxy_cmd))
         logger.info(
-            f"SSE server running on port {port}, proxy running on port {proxy_port}"
+            "SSE server running on port %s, proxy running on port %s", port, proxy_port
         )
 
         try:
@@ -1202,12 +6918,12 @@ def main(
             logger.error("For more information, see: https://github.com/sparfenyuk/mcp-proxy")
             return 1
         except Exception as e:
-            logger.error(f"Error starting mcp-proxy: {str(e)}")
-            logger.error(f"Command was: {' '.join(proxy_cmd)}")
+            logger.error("Error starting mcp-proxy: %s", e)
+            logger.error("Command was: %s", " ".join(proxy_cmd))
             logger.error("Make sure mcp-proxy is installed and accessible in your PATH.")
             return 1
     else:
-        logger.info(f"Running in direct SSE mode on port {port}")
+        logger.info("Running in direct SSE mode on port %s", port)
         run_uvicorn()
 
     return 0
@@ -87,6 +87,52 @@ def cli():
     type=float,
     help="Temperature setting for the LLM model",
 )
+@click.option(
+    "--profile",
+    default=None,
+    type=click.Choice(["fast", "default", "accurate"], case_sensitive=False),
+    help="Default execution profile for browser tasks (uses EXECUTION_PROFILE or 'default' if not specified)",
+)
+@click.option(
+    "--execution-mode",
+    default=None,
+    type=click.Choice(["inline", "process"], case_sensitive=False),
+    help="Run agent tasks on the server event loop (inline) or in worker processes (process)",
+)
+@click.option(
+    "--workers",
+    default=None,
+    type=int,
+    help="Number of worker processes in process execution mode",
+)
+@click.option(
+    "--tasks-per-worker",
+    default=None,
+    type=int,
+    help="Maximum concurrent tasks per worker process",
+)
+@click.option(
+    "--task-state-backend",
+    default=None,
+    type=click.Choice(["memory", "sqlite"], case_sensitive=False),
+    help="Where task state is kept; sqlite shares it between instances (uses TASK_STATE_BACKEND or 'memory' if not specified)",
+)
+@click.option(
+    "--instance-url",
+    default=None,
+    help="URL other instances use to reach this one for forwarded requests",
+)
+@click.option(
+    "--browser-cdp-urls",
+    default=None,
+    help="Comma-separated CDP endpoints of remote browsers to run tasks in (uses BROWSER_CDP_URLS if not specified)",
+)
+@click.option(
+    "--browser-mode",
+    default=None,
+    type=click.Choice(["headless", "headless-full", "headed"], case_sensitive=False),
+    help="How local browsers run: headless (headless shell), headless-full or headed (needs a display) (uses BROWSER_MODE or 'headless' if not specified)",
+)
 def run(
     subcommand,
     port,
@@ -102,6 +148,14 @@ def run(
     llm_api_key,
     llm_base_url,
     llm_temperature,
+    profile,
+    execution_mode,
+    workers,
+    tasks_per_worker,
+    task_state_backend,
+    instance_url,
+    browser_cdp_urls,
+    browser_mode,
 ):
     """Run the browser-use MCP server.
 
@@ -155,6 +209,30 @@ def run(
 
         new_argv.extend(["--llm-temperature", str(llm_temperature)])
 
+        if profile:
+            new_argv.extend(["--profile", profile])
+
+        if execution_mode:
+            new_argv.extend(["--execution-mode", execution_mode])
+
+        if workers is not None:
+            new_argv.extend(["--workers", str(workers)])
+
+        if tasks_per_worker is not None:
+            new_argv.extend(["--tasks-per-worker", str(tasks_per_worker)])
+
+        if task_state_backend:
+            new_argv.extend(["--task-state-backend", task_state_backend])
+
+        if instance_url:
+            new_argv.extend(["--instance-url", instance_url])
+
+        if browser_cdp_urls:
+            new_argv.extend(["--browser-cdp-urls", browser_cdp_urls])
+
+        if browser_mode:
+            new_argv.extend(["--browser-mode", browser_mode])
+
         # Replace sys.argv temporarily
         sys.argv = new_argv
 
@@ -6,8 +6,21 @@ This provides a clean import path for the CLI and other code.
 
 from server.server import (
     CONFIG,
+    ArtifactStore,
+    BrowserPool,
+    JsonFileSpanExporter,
+    LLMClientPool,
+    LLMGovernor,
+    ReplayScriptStore,
     Server,
+    SharedTaskState,
+    SpanExporter,
+    SQLiteTaskStateBackend,
+    StorageStateStore,
+    TaskStateBackend,
+    Tracer,
     cleanup_old_tasks,
+    create_browser_config,
     create_browser_context_for_task,
     create_mcp_server,
     init_configuration,
@@ -27,4 +40,17 @@ __all__ = [
     "init_configuration",
     "CONFIG",
     "task_store",
+    "StorageStateStore",
+    "BrowserPool",
+    "ReplayScriptStore",
+    "TaskStateBackend",
+    "SQLiteTaskStateBackend",
+    "SharedTaskState",
+    "LLMGovernor",
+    "LLMClientPool",
+    "SpanExporter",
+    "JsonFileSpanExporter",
+    "Tracer",
+    "ArtifactStore",
+    "create_browser_config",
 ]